@@ -0,0 +1,222 @@
+from dataclasses import dataclass, field
+
+# -----------------------------------------------------------------
+# Batch Data (stage outputs keyed by Item Number / ConceptID)
+# -----------------------------------------------------------------
+# Stage outputs are joined to their jobs by key rather than by position,
+# so a reordered or dropped element from the model can never pair one
+# question's stem with another question's distractors.
+
+STAGES = (1, 2, 3)
+
+# Ledger statuses (per item, per stage)
+STATUS_OK = "ok"
+STATUS_MISSING = "missing"
+STATUS_MALFORMED = "malformed"
+STATUS_TRUNCATED = "truncated"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+# Stage 1 only: the sentence is a near-duplicate (see dedup_index)
+STATUS_DUPLICATE = "duplicate"
+
+
+def item_key(value):
+    """
+    Normalises an Item Number / job_id / ConceptID for dictionary lookups.
+    """
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def align_items(keys, items):
+    """
+    Matches items to slots by their "Item Number" (keys[i] is the expected
+    number for slot i), falling back to position for items whose number is
+    not an expected key. Returns a list parallel to keys, None where no item
+    matched.
+    """
+    index = {key: i for i, key in enumerate(keys)}
+    aligned = [None] * len(keys)
+    leftovers = []
+
+    for pos, item in enumerate(items or []):
+        if not isinstance(item, dict):
+            continue
+        slot = index.get(item_key(item.get("Item Number")))
+        if slot is not None and aligned[slot] is None:
+            aligned[slot] = item
+        else:
+            leftovers.append((pos, item))
+
+    for pos, item in leftovers:
+        if pos < len(keys) and aligned[pos] is None:
+            aligned[pos] = item
+
+    return aligned
+
+
+@dataclass
+class BatchItem:
+    """
+    One job and everything the pipeline produced for it.
+    """
+    job: dict
+    key: str = ""
+    stage1: dict = None
+    stage2: dict = None
+    stage3: dict = None
+    status: dict = field(default_factory=lambda: {stage: STATUS_SKIPPED for stage in STAGES})
+    attempts: int = 0
+    notes: list = field(default_factory=list)
+    # Stage-2 output with locally rejected candidates removed (stage-3 input)
+    prefiltered: dict = None
+    # Stage-1 sentences rejected as near-duplicates (named in the regeneration prompt)
+    rejected: list = field(default_factory=list)
+
+    @property
+    def item_number(self):
+        """
+        The Item Number the model used for this job (what stage 2/3 echo back).
+        """
+        if self.stage1 is not None and item_key(self.stage1.get("Item Number")):
+            return item_key(self.stage1.get("Item Number"))
+        return self.key
+
+    def output(self, stage):
+        return getattr(self, f"stage{stage}")
+
+    def stage3_candidates(self):
+        return self.prefiltered if self.prefiltered is not None else self.stage2
+
+    def set_output(self, stage, item):
+        setattr(self, f"stage{stage}", item)
+
+    def ready_for(self, stage):
+        """
+        True if every stage before `stage` produced an output.
+        """
+        return all(self.output(s) is not None for s in STAGES if s < stage)
+
+    def is_complete(self):
+        return all(self.output(s) is not None for s in STAGES)
+
+    def mark(self, stage, status, note=None):
+        self.status[stage] = status
+        if note:
+            self.notes.append(f"Stage {stage}: {note}")
+
+    def ledger_entry(self):
+        entry = {"job_id": self.job.get('job_id'), "attempts": self.attempts, "notes": list(self.notes)}
+        for stage in STAGES:
+            entry[f"stage{stage}"] = self.status[stage]
+        return entry
+
+
+class Batch:
+    """
+    Ordered collection of BatchItems with O(1) lookup by job key.
+    """
+
+    def __init__(self, job_list):
+        self._items = {}
+        for job in job_list:
+            key = self._unique_key(item_key(job.get('job_id')))
+            self._items[key] = BatchItem(job, key)
+
+    def _unique_key(self, key):
+        # Duplicate IDs (e.g. repeated ConceptIDs) still get their own slot
+        if key in self._items:
+            n = 2
+            while f"{key}#{n}" in self._items:
+                n += 1
+            key = f"{key}#{n}"
+        return key
+
+    @classmethod
+    def merge(cls, batches):
+        """
+        One batch holding the items of several batches, in order (e.g. the
+        sub-batches of a mixed run). Items keep their key unless it clashes.
+        """
+        merged = cls([])
+        for batch in batches:
+            for item in batch:
+                item.key = merged._unique_key(item.key)
+                merged._items[item.key] = item
+        return merged
+
+    @classmethod
+    def from_stage_outputs(cls, job_list, stage1_outputs=None, stage2_outputs=None, stage3_outputs=None):
+        """
+        Builds a batch from plain stage lists, joining stage 1 on job_id and
+        stages 2/3 on the Item Number stage 1 used.
+        """
+        batch = cls(job_list)
+        for stage, outputs in zip(STAGES, (stage1_outputs, stage2_outputs, stage3_outputs)):
+            if outputs:
+                batch.add_stage_outputs(stage, outputs)
+        return batch
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __contains__(self, key):
+        return item_key(key) in self._items
+
+    def get(self, key):
+        return self._items.get(item_key(key))
+
+    def keys(self):
+        return list(self._items)
+
+    def subset(self, keys):
+        return [self._items[key] for key in keys]
+
+    def add_stage_outputs(self, stage, outputs, keys=None):
+        """
+        Joins a stage's output array onto the items (all, or only `keys`).
+        Returns the list of items that received an output.
+        """
+        targets = self.subset(keys) if keys is not None else list(self)
+        expected = [item_key(item.job.get('job_id')) if stage == 1 else item.item_number for item in targets]
+        placed = []
+        for item, output in zip(targets, align_items(expected, outputs)):
+            if output is not None:
+                item.set_output(stage, output)
+                placed.append(item)
+        return placed
+
+    def stage_list(self, stage):
+        """
+        Stage outputs in job order, None where missing.
+        """
+        return [item.output(stage) for item in self]
+
+    def ready_for(self, stage, keys=None):
+        items = self.subset(keys) if keys is not None else list(self)
+        return [item for item in items if item.ready_for(stage)]
+
+    def completed(self):
+        return [item for item in self if item.is_complete()]
+
+    def ledger(self):
+        return [item.ledger_entry() for item in self]
+
+
+def join_stage_outputs(job_list, stage1_outputs, stage2_outputs=None):
+    """
+    Keyed join used by the prompt builders: returns (job, stage1, stage2)
+    rows for jobs that have a stage-1 output, matched by Item Number
+    instead of list position. stage2 is None when it is missing.
+    """
+    batch = Batch.from_stage_outputs(job_list, stage1_outputs, stage2_outputs)
+    rows = []
+    for item in batch:
+        if item.stage1 is None:
+            continue
+        rows.append((item.job, item.stage1, item.stage2))
+    return rows
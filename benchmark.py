@@ -0,0 +1,101 @@
+import argparse
+import os
+import statistics
+import time
+
+import pandas as pd
+
+import example_bank
+import llm_service
+import pipeline
+import test_planner
+
+# -----------------------------------------------------------------
+# Strategy Benchmark (latency and cost per generation mode)
+# -----------------------------------------------------------------
+# Runs the same planned batch through every generation strategy with the
+# response cache off and reports wall-clock latency, API requests, tokens
+# and estimated cost. Needs a real API key:
+#
+#   OPENAI_API_KEY=... python benchmark.py --type Grammar --cefr B1 --size 5 --runs 3
+
+# USD per 1M tokens: (prompt, cached prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60)
+}
+
+
+def estimate_cost(stats, model):
+    """
+    Estimated USD cost of a run from its call stats, or None for an
+    unknown model. Prompt tokens served from the provider's prompt cache
+    are billed at the cached rate.
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    cached = stats.get("cached_tokens", 0)
+    uncached = stats["prompt_tokens"] - cached
+    return (uncached * prices[0] + cached * prices[1] + stats["completion_tokens"] * prices[2]) / 1_000_000
+
+
+def benchmark_strategy(job_list, api_key, strategy, model, runs, context):
+    """
+    Runs one strategy `runs` times. Returns a summary dict.
+    """
+    seconds, requests, tokens, cached, costs, completed = [], [], [], [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        # dedup off: repeated runs would otherwise reject each other's sentences
+        results = pipeline.run_pipeline_sync(
+            job_list, job_list[0]['type'], api_key, context=context,
+            model=model, use_cache=False, mode=strategy, dedup=False
+        )
+        seconds.append(time.perf_counter() - start)
+        stats = results["stats"]
+        requests.append(stats["requests"])
+        tokens.append(stats["prompt_tokens"] + stats["completion_tokens"])
+        cached.append(stats["cached_tokens"])
+        costs.append(estimate_cost(stats, model) or 0.0)
+        completed.append(len(results["batch"].completed()))
+
+    return {
+        "strategy": strategy,
+        "median_seconds": round(statistics.median(seconds), 2),
+        "requests": statistics.median(requests),
+        "tokens": statistics.median(tokens),
+        "cached_tokens": statistics.median(cached),
+        "cost_usd": round(statistics.median(costs), 4),
+        "completed": f"{statistics.median(completed):g}/{len(job_list)}"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare generation strategies on latency and cost.")
+    parser.add_argument("--type", default="Grammar", choices=("Grammar", "Vocabulary"))
+    parser.add_argument("--cefr", default="B1")
+    parser.add_argument("--focus", default="Past Simple vs Present Perfect")
+    parser.add_argument("--size", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--model", default=llm_service.DEFAULT_MODEL)
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or OPENAI_API_KEY)")
+
+    try:
+        context = {"example_banks": example_bank.load_example_banks()}
+    except FileNotFoundError:
+        context = {"example_banks": {}}
+    rows = []
+    for strategy in test_planner.GENERATION_STRATEGIES:
+        job_list = test_planner.create_job_list(args.size, args.type, args.cefr, [args.focus], "", strategy)
+        rows.append(benchmark_strategy(job_list, args.api_key, strategy, args.model, args.runs, context))
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import batch_data
+
+# -----------------------------------------------------------------
+# Stage Checkpoints (SQLite)
+# -----------------------------------------------------------------
+# Every stage output of a run with a checkpoint scope is saved under
+# (scope, ConceptID, stage) as soon as its chunk finishes the stage, so a
+# crashed or stopped run resumes where it left off and a long list can be
+# worked through a few hundred rows at a time without regenerating anything.
+# The scope separates runs whose prompts differ (list kind, question form;
+# job_queue gives other jobs a scope of their own);
+# each row also stores a fingerprint of its job, so an edited row or a
+# different CEFR level is generated again instead of restored.
+CHECKPOINT_SETTINGS = {
+    "path": os.environ.get("CHECKPOINT_PATH", ".checkpoints.sqlite")
+}
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def configure_checkpoints(path=None):
+    """
+    Updates checkpoint settings (e.g. a temporary path for regression tests).
+    """
+    if path is not None:
+        CHECKPOINT_SETTINGS["path"] = path
+
+
+def list_scope(kind, question_form=None):
+    """
+    Checkpoint scope for a list run: outputs are only reused between runs
+    of the same list kind and question form.
+    """
+    return f"{kind}|{question_form or ''}"
+
+
+def job_fingerprint(job):
+    payload = json.dumps(job, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _connect():
+    path = CHECKPOINT_SETTINGS["path"]
+    conn = sqlite3.connect(path, timeout=30)
+    with _init_lock:
+        if path not in _initialized_paths:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "scope TEXT NOT NULL, concept_id TEXT NOT NULL, stage INTEGER NOT NULL, "
+                "fingerprint TEXT NOT NULL, output TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (scope, concept_id, stage))"
+            )
+            conn.commit()
+            _initialized_paths.add(path)
+    return conn
+
+
+def save(scope, stage, items):
+    """
+    Stores the stage output of every BatchItem in items that has one.
+    Later-stage outputs of those items are deleted, since they were built
+    on the output being replaced.
+    """
+    rows = [(scope, item.key, stage, job_fingerprint(item.job), json.dumps(item.output(stage), ensure_ascii=False),
+             time.time())
+            for item in items if item.output(stage) is not None]
+    if not rows:
+        return
+    try:
+        conn = _connect()
+        try:
+            conn.executemany(
+                "DELETE FROM checkpoints WHERE scope = ? AND concept_id = ? AND stage > ?",
+                [(scope, row[1], stage) for row in rows]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (scope, concept_id, stage, fingerprint, output, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CHECKPOINT WRITE FAILED: {e}")
+
+
+def load(scope, items):
+    """
+    Saved stage outputs for the given BatchItems, as {item key: {stage: output}}.
+    Only outputs saved for an identical job are returned, and only as an
+    unbroken run of stages from stage 1.
+    """
+    items = list(items)
+    if not items:
+        return {}
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                "SELECT concept_id, stage, fingerprint, output FROM checkpoints WHERE scope = ?", (scope,)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CHECKPOINT READ FAILED: {e}")
+        return {}
+
+    fingerprints = {item.key: job_fingerprint(item.job) for item in items}
+    saved = {}
+    for key, stage, fingerprint, output in rows:
+        if fingerprints.get(key) == fingerprint:
+            saved.setdefault(key, {})[stage] = json.loads(output)
+
+    restored = {}
+    for key, outputs in saved.items():
+        stages = {}
+        for stage in batch_data.STAGES:
+            if stage not in outputs:
+                break
+            stages[stage] = outputs[stage]
+        if stages:
+            restored[key] = stages
+    return restored
+
+
+def accepted_ids(scope, job_list):
+    """
+    job_ids (ConceptIDs) in job_list whose final stage is already saved,
+    i.e. that already have an accepted question.
+    """
+    batch = batch_data.Batch(job_list)
+    saved = load(scope, batch)
+    return [item.job.get('job_id') for item in batch if batch_data.STAGES[-1] in saved.get(item.key, {})]
+
+
+def clear(scope=None):
+    """
+    Deletes the checkpoints of one scope, or all of them.
+    """
+    try:
+        conn = _connect()
+        try:
+            if scope is None:
+                conn.execute("DELETE FROM checkpoints")
+            else:
+                conn.execute("DELETE FROM checkpoints WHERE scope = ?", (scope,))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CHECKPOINT CLEAR FAILED: {e}")
@@ -0,0 +1,259 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+# -----------------------------------------------------------------
+# Near-Duplicate Index (MinHash / LSH over Complete Sentence)
+# -----------------------------------------------------------------
+# Every accepted question's Complete Sentence is normalised (case, accents,
+# punctuation, spacing), cut into character shingles and summarised as a
+# MinHash signature. Signatures are split into LSH bands stored in a local
+# SQLite file, so a new sentence is only compared with the few stored
+# sentences that share a band, however large the index grows. Stage-1
+# output is checked before stages 2-3 run, and uploaded batches can be
+# checked in the Refinement Workshop. Set DEDUP_INDEX=off to disable.
+DEDUP_SETTINGS = {
+    "enabled": os.environ.get("DEDUP_INDEX", "on").lower() not in ("off", "0", "false"),
+    "path": os.environ.get("DEDUP_INDEX_PATH", ".dedup_index.sqlite"),
+    # Estimated Jaccard similarity (of shingle sets) that counts as a duplicate
+    "threshold": 0.7,
+    "shingle_size": 5,
+    # num_perm = bands * rows; 16 bands of 4 rows find pairs above ~0.5
+    "bands": 16,
+    "rows": 4
+}
+
+# Hash family h(x) = (a * x + b) mod p over 31-bit shingle hashes
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240611)
+_PERMUTATIONS = DEDUP_SETTINGS["bands"] * DEDUP_SETTINGS["rows"]
+_A = _rng.integers(1, _PRIME, size=_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=_PERMUTATIONS, dtype=np.uint64)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def configure_dedup(enabled=None, path=None, threshold=None):
+    """
+    Updates index settings (e.g. a temporary path for regression tests).
+    """
+    if enabled is not None:
+        DEDUP_SETTINGS["enabled"] = enabled
+    if path is not None:
+        DEDUP_SETTINGS["path"] = path
+    if threshold is not None:
+        DEDUP_SETTINGS["threshold"] = threshold
+
+
+def normalize_sentence(text):
+    """
+    Lowercase text without accents, punctuation or repeated spaces.
+    """
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(_PUNCTUATION_RE.sub(" ", text).split())
+
+
+def signature(text):
+    """
+    MinHash signature (uint32 array) of a sentence's normalised shingles.
+    """
+    normalized = normalize_sentence(text)
+    size = DEDUP_SETTINGS["shingle_size"]
+    shingles = {normalized[i:i + size] for i in range(max(1, len(normalized) - size + 1))}
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles], dtype=np.uint64)
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def similarity(sig_a, sig_b):
+    """
+    Estimated Jaccard similarity of two signatures.
+    """
+    return float(np.mean(sig_a == sig_b))
+
+
+def _band_keys(sig):
+    rows = DEDUP_SETTINGS["rows"]
+    return [(band, zlib.crc32(sig[band * rows:(band + 1) * rows].tobytes()))
+            for band in range(DEDUP_SETTINGS["bands"])]
+
+
+def _connect():
+    path = DEDUP_SETTINGS["path"]
+    conn = sqlite3.connect(path, timeout=30)
+    with _init_lock:
+        if path not in _initialized_paths:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sentences ("
+                "id INTEGER PRIMARY KEY, normalized TEXT NOT NULL UNIQUE, text TEXT NOT NULL, "
+                "signature BLOB NOT NULL, source TEXT, created REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands ("
+                "band INTEGER NOT NULL, bucket INTEGER NOT NULL, sentence_id INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+            conn.commit()
+            _initialized_paths.add(path)
+    return conn
+
+
+def _lookup(conn, sig):
+    """
+    Best stored match for a signature as (text, similarity), or None.
+    """
+    keys = _band_keys(sig)
+    clause = " OR ".join("(band = ? AND bucket = ?)" for _ in keys)
+    params = [value for key in keys for value in key]
+    rows = conn.execute(
+        f"SELECT text, signature FROM sentences WHERE id IN (SELECT sentence_id FROM bands WHERE {clause})", params
+    ).fetchall()
+
+    best = None
+    for text, stored in rows:
+        score = similarity(sig, np.frombuffer(stored, dtype=np.uint32))
+        if score >= DEDUP_SETTINGS["threshold"] and (best is None or score > best[1]):
+            best = (text, score)
+    return best
+
+
+def find_duplicate(text):
+    """
+    The closest indexed sentence to text as (text, similarity), or None if
+    nothing reaches the threshold.
+    """
+    try:
+        conn = _connect()
+        try:
+            return _lookup(conn, signature(text))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"DEDUP INDEX READ FAILED: {e}")
+        return None
+
+
+def add(texts, source=""):
+    """
+    Indexes sentences. Sentences already indexed (same normalised text) are
+    skipped. Returns the number of sentences added.
+    """
+    added = 0
+    try:
+        conn = _connect()
+        try:
+            for text in texts:
+                normalized = normalize_sentence(text)
+                if not normalized:
+                    continue
+                sig = signature(text)
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO sentences (normalized, text, signature, source, created) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (normalized, str(text), sig.tobytes(), source, time.time())
+                )
+                if cursor.rowcount:
+                    conn.executemany(
+                        "INSERT INTO bands (band, bucket, sentence_id) VALUES (?, ?, ?)",
+                        [(band, bucket, cursor.lastrowid) for band, bucket in _band_keys(sig)]
+                    )
+                    added += 1
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"DEDUP INDEX WRITE FAILED: {e}")
+    return added
+
+
+def find_duplicates(texts, use_index=True):
+    """
+    Checks a list of sentences against each other and (with use_index)
+    against the index. Returns a list parallel to texts: None for a
+    sentence to keep, or (matched text, similarity, "batch" / "index")
+    for a near-duplicate. The first of several similar sentences is kept.
+    """
+    guard = DuplicateGuard(use_index=use_index)
+    return [guard.check(text) for text in texts]
+
+
+class DuplicateGuard:
+    """
+    Duplicate check for one run: a sentence is rejected if it is close to
+    an indexed sentence or to one this guard has already accepted.
+    Accepted sentences are bucketed by LSH band like the index, so each
+    check only compares the sentences sharing a band with it.
+    """
+    def __init__(self, use_index=True):
+        self.use_index = use_index
+        self.accepted = []
+        # (band, bucket) -> positions in self.accepted
+        self.buckets = {}
+
+    def check(self, text):
+        """
+        None if text is new (it is then remembered), otherwise
+        (matched text, similarity, "batch" / "index").
+        """
+        if not normalize_sentence(text):
+            return None
+        sig = signature(text)
+        keys = _band_keys(sig)
+        best = None
+        candidates = {position for key in keys for position in self.buckets.get(key, ())}
+        for position in sorted(candidates):
+            other_text, other_sig = self.accepted[position]
+            score = similarity(sig, other_sig)
+            if score >= DEDUP_SETTINGS["threshold"] and (best is None or score > best[1]):
+                best = (other_text, score, "batch")
+        if best is None and self.use_index:
+            match = find_duplicate(text)
+            if match:
+                best = (match[0], match[1], "index")
+        if best is None:
+            for key in keys:
+                self.buckets.setdefault(key, []).append(len(self.accepted))
+            self.accepted.append((text, sig))
+        return best
+
+
+def question_sentence(question):
+    """
+    The Complete Sentence of a question row: its own column when present,
+    otherwise the Question Prompt with the blank filled by the correct answer.
+    """
+    sentence = question.get("Complete Sentence")
+    if isinstance(sentence, str) and sentence.strip():
+        return sentence
+    prompt = question.get("Question Prompt")
+    if not isinstance(prompt, str):
+        return ""
+    letter = str(question.get("Correct Answer", "A")).strip().upper()
+    answer = question.get(f"Answer {letter}")
+    return prompt.replace("____", answer if isinstance(answer, str) else "")
+
+
+def clear():
+    """
+    Deletes every indexed sentence.
+    """
+    try:
+        conn = _connect()
+        try:
+            conn.execute("DELETE FROM bands")
+            conn.execute("DELETE FROM sentences")
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"DEDUP INDEX CLEAR FAILED: {e}")
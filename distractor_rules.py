@@ -0,0 +1,234 @@
+import string
+
+# -----------------------------------------------------------------
+# Deterministic Stage-3 Prefilter
+# -----------------------------------------------------------------
+# Obvious rejects are removed from the stage-2 candidates before they are
+# sent for validation, and the reason for every drop is recorded. When
+# exactly three candidates survive there is nothing left for the model to
+# choose, so the item is completed locally and skips the stage-3 call.
+PREFILTER_SETTINGS = {
+    "enabled": True,
+    "select_locally": True,
+    "distractors_needed": 3
+}
+
+# Per batch kind (see pipeline.KIND_*):
+# - max_words: longest candidate allowed (None = no limit)
+# - single_word_if_answer_is: a one-word answer needs one-word candidates
+# - form_parity: candidates should share the answer's inflection (vocabulary);
+#   grammar distractors are wrong forms on purpose
+KIND_RULES = {
+    "Grammar": {"max_words": 3, "single_word_if_answer_is": False, "form_parity": False},
+    "Vocabulary": {"max_words": 3, "single_word_if_answer_is": True, "form_parity": True},
+    "Vocabulary List": {"max_words": None, "single_word_if_answer_is": True, "form_parity": True},
+    "Grammar List": {"max_words": None, "single_word_if_answer_is": False, "form_parity": False}
+}
+
+# Local scorer for combined mode (one call returns scored candidates)
+SCORER_SETTINGS = {
+    "min_model_score": 3,
+    "model_weight": 1.0,
+    "form_parity_weight": 2.0,
+    "length_parity_weight": 1.0,
+    "similarity_weight": 2.0,
+    # Near-copies of the key (e.g. a misspelling) are too risky to keep
+    "max_similarity": 0.8
+}
+
+_SUFFIXES = ("ing", "est", "ed", "er", "ly", "s")
+
+CANDIDATE_LETTERS = "ABCDEFGH"
+
+
+def normalize_option(text):
+    """
+    Comparison form of an answer option: lowercased, single-spaced,
+    without surrounding punctuation.
+    """
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    return " ".join(text.split()).strip(string.punctuation + " ").lower()
+
+
+def get_candidates(stage2_item):
+    """
+    Candidate values of a stage-2 item in letter order.
+    """
+    if not isinstance(stage2_item, dict):
+        return []
+    return [stage2_item[f"Candidate {k}"] for k in CANDIDATE_LETTERS if f"Candidate {k}" in stage2_item]
+
+
+def rejection_reason(candidate, answer_key, seen, rules):
+    """
+    Returns why a candidate is an obvious reject, or None if it passes.
+    seen holds the normalized candidates already kept.
+    """
+    # Numbers, lists or objects in a candidate slot are not usable options
+    if candidate is not None and not isinstance(candidate, str):
+        return "not text"
+    key = normalize_option(candidate)
+    if not key:
+        return "empty"
+    if key == answer_key:
+        return "same as correct answer"
+    if key in seen:
+        return "duplicate candidate"
+    if "/" in str(candidate):
+        return "contains slash alternatives"
+
+    words = len(key.split())
+    if rules.get("single_word_if_answer_is") and len(answer_key.split()) == 1 and words > 1:
+        return "multi-word for single-word answer"
+    if rules.get("max_words") and words > rules["max_words"]:
+        return f"more than {rules['max_words']} words"
+    return None
+
+
+def prefilter_candidates(kind, candidates, correct_answer):
+    """
+    Applies the kind's rules to a candidate list.
+    Returns (kept, dropped) where dropped is a list of (candidate, reason).
+    """
+    rules = KIND_RULES.get(kind, {})
+    answer_key = normalize_option(correct_answer)
+    kept = []
+    dropped = []
+    seen = set()
+
+    for candidate in candidates:
+        reason = rejection_reason(candidate, answer_key, seen, rules)
+        if reason:
+            dropped.append((candidate, reason))
+            continue
+        seen.add(normalize_option(candidate))
+        kept.append(candidate.strip())
+    return kept, dropped
+
+
+def filtered_stage2_item(stage2_item, kept):
+    """
+    Copy of a stage-2 item with only the kept candidates, re-lettered from A.
+    """
+    item = {k: v for k, v in stage2_item.items() if not k.startswith("Candidate ")}
+    for letter, candidate in zip(CANDIDATE_LETTERS, kept):
+        item[f"Candidate {letter}"] = candidate
+    return item
+
+
+def local_selection(stage1_item, kept, dropped, notes="Selected locally by prefilter"):
+    """
+    Stage-3 style output for distractors chosen without the model (the
+    surviving candidates when exactly three are left, or the scorer's picks).
+    """
+    selection = {"Item Number": stage1_item.get("Item Number", "")}
+    for letter, candidate in zip("ABC", kept):
+        selection[f"Selected Distractor {letter}"] = candidate
+    if dropped:
+        notes += "; rejected: " + ", ".join(f"'{c}' ({reason})" for c, reason in dropped)
+    selection["Validation Notes"] = notes
+    return selection
+
+
+def inflection_shape(text):
+    """
+    Coarse inflection class of an option's last word ("ed", "ing", "s", ...
+    or "" for a base form), used for the form-parity check.
+    """
+    words = normalize_option(text).split()
+    if not words:
+        return ""
+    word = words[-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            return suffix
+    return ""
+
+
+def _trigrams(text):
+    padded = f"  {normalize_option(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def key_similarity(candidate, answer):
+    """
+    Character-trigram Jaccard similarity between a candidate and the key.
+    """
+    a, b = _trigrams(candidate), _trigrams(answer)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def get_scored_candidates(stage2_item):
+    """
+    (candidate, model score) pairs of a combined-mode item in letter order.
+    Missing or unreadable scores count as 0.
+    """
+    scored = []
+    if not isinstance(stage2_item, dict):
+        return scored
+    for k in CANDIDATE_LETTERS:
+        if f"Candidate {k}" not in stage2_item:
+            continue
+        try:
+            score = float(stage2_item.get(f"Score {k}", 0))
+        except (TypeError, ValueError):
+            score = 0.0
+        scored.append((stage2_item[f"Candidate {k}"], score))
+    return scored
+
+
+def score_candidate(kind, candidate, model_score, correct_answer):
+    """
+    Local distractor score: the model's score plus parity and closeness to
+    the key. Returns (score, reason) with reason set when it is rejected.
+    """
+    settings = SCORER_SETTINGS
+    if model_score < settings["min_model_score"]:
+        return None, f"low model score ({model_score:g})"
+
+    similarity = key_similarity(candidate, correct_answer)
+    if similarity >= settings["max_similarity"]:
+        return None, "too similar to correct answer"
+
+    score = settings["model_weight"] * model_score + settings["similarity_weight"] * similarity
+    if KIND_RULES.get(kind, {}).get("form_parity") and inflection_shape(candidate) == inflection_shape(correct_answer):
+        score += settings["form_parity_weight"]
+    if len(normalize_option(candidate).split()) == len(normalize_option(correct_answer).split()):
+        score += settings["length_parity_weight"]
+    return score, None
+
+
+def select_scored(kind, stage1_item, stage2_item):
+    """
+    Picks the final distractors from a combined-mode candidate set:
+    obvious rejects are removed (prefilter_candidates), the rest are ranked
+    by score_candidate and the best three are kept.
+    Returns (selection or None, dropped) like the prefilter.
+    """
+    needed = PREFILTER_SETTINGS["distractors_needed"]
+    answer = stage1_item.get("Correct Answer", "")
+    scored = get_scored_candidates(stage2_item)
+    kept, dropped = prefilter_candidates(kind, [c for c, _ in scored], answer)
+
+    model_scores = {}
+    for candidate, model_score in scored:
+        model_scores.setdefault(normalize_option(candidate), model_score)
+
+    ranked = []
+    for candidate in kept:
+        score, reason = score_candidate(kind, candidate, model_scores[normalize_option(candidate)], answer)
+        if reason:
+            dropped.append((candidate, reason))
+        else:
+            ranked.append((score, candidate))
+
+    if len(ranked) < needed:
+        return None, dropped
+
+    ranked.sort(key=lambda pair: -pair[0])
+    best = [candidate for _, candidate in ranked[:needed]]
+    notes = "Scored locally: " + ", ".join(f"'{c}' {s:.1f}" for s, c in ranked)
+    return local_selection(stage1_item, best, dropped, notes), dropped
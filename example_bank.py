@@ -0,0 +1,96 @@
+import os
+import threading
+
+import pandas as pd
+
+# -----------------------------------------------------------------
+# Example Bank Loader (style examples for stage 1)
+# -----------------------------------------------------------------
+# The bank CSVs are exported with a UTF-8 BOM and snake_case headers
+# (CEFR_rating, Question_Prompt, ...). Headers are normalised to the names
+# the prompt builders use ("CEFR rating", "Question Prompt", ...), repeated
+# text columns are stored as categories, and each file is cached until its
+# modification time changes, so a replaced bank is picked up on the next
+# load without restarting the app.
+BANK_FILES = {
+    "grammar": "grammar_bank.csv",
+    "vocabulary": "vocab_bank.csv"
+}
+
+# Canonical column name -> accepted spellings (compared case-insensitively,
+# with "_" and "-" read as spaces)
+COLUMN_ALIASES = {
+    "Item Number": ["item number", "item no"],
+    "Assessment Focus": ["assessment focus", "focus"],
+    "Question Prompt": ["question prompt", "question", "stem"],
+    "Answer A": ["answer a", "option a"],
+    "Answer B": ["answer b", "option b"],
+    "Answer C": ["answer c", "option c"],
+    "Answer D": ["answer d", "option d"],
+    "Correct Answer": ["correct answer", "answer key"],
+    "CEFR rating": ["cefr rating", "cefr", "cefr level"],
+    "Category": ["category"],
+    "GSE Score": ["gse score", "gse"]
+}
+
+CATEGORY_COLUMNS = ["Assessment Focus", "Correct Answer", "CEFR rating", "Category"]
+
+# Not used in prompts
+DROP_COLUMNS = ["GSE Score"]
+
+_ALIAS_LOOKUP = {alias: name for name, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def normalize_column(column):
+    """
+    Canonical name for a bank header, or the cleaned header if unknown.
+    """
+    cleaned = " ".join(str(column).lstrip("\ufeff").replace("_", " ").replace("-", " ").split())
+    return _ALIAS_LOOKUP.get(cleaned.lower(), cleaned)
+
+
+def normalize_bank(df):
+    """
+    Renames bank columns to their canonical names, drops unused columns and
+    stores repeated text columns as categories.
+    """
+    df = df.rename(columns=normalize_column)
+    df = df.loc[:, ~df.columns.duplicated()]
+    df = df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns])
+
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("string").str.strip().astype("category")
+    return df
+
+
+def load_bank(path):
+    """
+    Loads and normalises one bank CSV. The result is cached until the
+    file's modification time or size changes.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _banks_lock:
+        cached = _banks.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+    # utf-8-sig drops the BOM that would otherwise stick to the first header
+    bank = normalize_bank(pd.read_csv(path, encoding="utf-8-sig"))
+    with _banks_lock:
+        _banks[path] = (signature, bank)
+    return bank
+
+
+def load_example_banks(directory="."):
+    """
+    Loads every bank in BANK_FILES from directory.
+    Returns {question type (lowercase): dataframe}, matching the job types
+    used by prompt_engineer.get_few_shot_examples.
+    Raises FileNotFoundError if a bank file is missing.
+    """
+    return {kind: load_bank(os.path.join(directory, filename)) for kind, filename in BANK_FILES.items()}
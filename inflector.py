@@ -0,0 +1,360 @@
+import re
+
+# -----------------------------------------------------------------
+# English Inflection (rules + exception tables)
+# -----------------------------------------------------------------
+# Used to put database candidates into the same form as the stage-1
+# "Correct Answer" locally (e.g. answer "blew" -> candidate "burn" becomes
+# "burned"), so the model is not asked to conjugate them.
+FORM_BASE = "base"
+FORM_PAST = "past"
+FORM_PAST_PARTICIPLE = "past participle"
+FORM_ING = "ing"
+FORM_THIRD_PERSON = "third person"
+FORM_PLURAL = "plural"
+FORM_COMPARATIVE = "comparative"
+FORM_SUPERLATIVE = "superlative"
+
+# Forms tried per word class, in detection order
+FORMS_BY_CLASS = {
+    "verb": (FORM_PAST, FORM_PAST_PARTICIPLE, FORM_ING, FORM_THIRD_PERSON),
+    "noun": (FORM_PLURAL,),
+    "adjective": (FORM_COMPARATIVE, FORM_SUPERLATIVE),
+    "adverb": (FORM_COMPARATIVE, FORM_SUPERLATIVE)
+}
+
+# Word classes each form belongs to (a candidate must have one of them to be inflected)
+FORM_CLASS = {
+    form: {word_class for word_class, class_forms in FORMS_BY_CLASS.items() if form in class_forms}
+    for forms in FORMS_BY_CLASS.values() for form in forms
+}
+
+# base: (past, past participle)
+IRREGULAR_VERBS = {
+    "arise": ("arose", "arisen"), "awake": ("awoke", "awoken"), "be": ("was", "been"),
+    "bear": ("bore", "born"), "beat": ("beat", "beaten"), "become": ("became", "become"),
+    "begin": ("began", "begun"), "bend": ("bent", "bent"), "bet": ("bet", "bet"),
+    "bind": ("bound", "bound"), "bite": ("bit", "bitten"), "bleed": ("bled", "bled"),
+    "blow": ("blew", "blown"), "break": ("broke", "broken"), "breed": ("bred", "bred"),
+    "bring": ("brought", "brought"), "build": ("built", "built"), "burst": ("burst", "burst"),
+    "buy": ("bought", "bought"), "catch": ("caught", "caught"), "choose": ("chose", "chosen"),
+    "cling": ("clung", "clung"), "come": ("came", "come"), "cost": ("cost", "cost"),
+    "creep": ("crept", "crept"), "cut": ("cut", "cut"), "deal": ("dealt", "dealt"),
+    "dig": ("dug", "dug"), "do": ("did", "done"), "draw": ("drew", "drawn"),
+    "drink": ("drank", "drunk"), "drive": ("drove", "driven"), "eat": ("ate", "eaten"),
+    "fall": ("fell", "fallen"), "feed": ("fed", "fed"), "feel": ("felt", "felt"),
+    "fight": ("fought", "fought"), "find": ("found", "found"), "flee": ("fled", "fled"),
+    "fly": ("flew", "flown"), "forbid": ("forbade", "forbidden"), "forget": ("forgot", "forgotten"),
+    "forgive": ("forgave", "forgiven"), "freeze": ("froze", "frozen"), "get": ("got", "got"),
+    "give": ("gave", "given"), "go": ("went", "gone"), "grind": ("ground", "ground"),
+    "grow": ("grew", "grown"), "hang": ("hung", "hung"), "have": ("had", "had"),
+    "hear": ("heard", "heard"), "hide": ("hid", "hidden"), "hit": ("hit", "hit"),
+    "hold": ("held", "held"), "hurt": ("hurt", "hurt"), "keep": ("kept", "kept"),
+    "kneel": ("knelt", "knelt"), "know": ("knew", "known"), "lay": ("laid", "laid"),
+    "lead": ("led", "led"), "leave": ("left", "left"), "lend": ("lent", "lent"),
+    "let": ("let", "let"), "lie": ("lay", "lain"), "light": ("lit", "lit"),
+    "lose": ("lost", "lost"), "make": ("made", "made"), "mean": ("meant", "meant"),
+    "meet": ("met", "met"), "mistake": ("mistook", "mistaken"), "overcome": ("overcame", "overcome"),
+    "pay": ("paid", "paid"), "put": ("put", "put"), "quit": ("quit", "quit"),
+    "read": ("read", "read"), "ride": ("rode", "ridden"), "ring": ("rang", "rung"),
+    "rise": ("rose", "risen"), "run": ("ran", "run"), "say": ("said", "said"),
+    "see": ("saw", "seen"), "seek": ("sought", "sought"), "sell": ("sold", "sold"),
+    "send": ("sent", "sent"), "set": ("set", "set"), "shake": ("shook", "shaken"),
+    "shine": ("shone", "shone"), "shoot": ("shot", "shot"), "show": ("showed", "shown"),
+    "shrink": ("shrank", "shrunk"), "shut": ("shut", "shut"), "sing": ("sang", "sung"),
+    "sink": ("sank", "sunk"), "sit": ("sat", "sat"), "sleep": ("slept", "slept"),
+    "slide": ("slid", "slid"), "speak": ("spoke", "spoken"), "speed": ("sped", "sped"),
+    "spend": ("spent", "spent"), "spin": ("spun", "spun"), "split": ("split", "split"),
+    "spread": ("spread", "spread"), "spring": ("sprang", "sprung"), "stand": ("stood", "stood"),
+    "steal": ("stole", "stolen"), "stick": ("stuck", "stuck"), "sting": ("stung", "stung"),
+    "strike": ("struck", "struck"), "swear": ("swore", "sworn"), "sweep": ("swept", "swept"),
+    "swim": ("swam", "swum"), "swing": ("swung", "swung"), "take": ("took", "taken"),
+    "teach": ("taught", "taught"), "tear": ("tore", "torn"), "tell": ("told", "told"),
+    "think": ("thought", "thought"), "throw": ("threw", "thrown"), "understand": ("understood", "understood"),
+    "undertake": ("undertook", "undertaken"), "upset": ("upset", "upset"), "wake": ("woke", "woken"),
+    "wear": ("wore", "worn"), "weep": ("wept", "wept"), "win": ("won", "won"),
+    "wind": ("wound", "wound"), "withdraw": ("withdrew", "withdrawn"), "write": ("wrote", "written")
+}
+
+# Other accepted forms when detecting (never produced)
+PAST_VARIANTS = {"be": ("were",), "get": ("gotten",), "learn": ("learnt",), "dream": ("dreamt",),
+                 "burn": ("burnt",), "spell": ("spelt",), "smell": ("smelt",), "spill": ("spilt",)}
+
+IRREGULAR_THIRD_PERSON = {"be": "is", "have": "has"}
+
+IRREGULAR_PLURALS = {
+    "man": "men", "woman": "women", "child": "children", "person": "people", "mouse": "mice",
+    "goose": "geese", "tooth": "teeth", "foot": "feet", "ox": "oxen", "louse": "lice",
+    "sheep": "sheep", "fish": "fish", "deer": "deer", "series": "series", "species": "species",
+    "crisis": "crises", "analysis": "analyses", "thesis": "theses", "phenomenon": "phenomena",
+    "criterion": "criteria", "cactus": "cacti", "fungus": "fungi", "medium": "media",
+    "knife": "knives", "leaf": "leaves", "life": "lives", "wife": "wives", "half": "halves",
+    "wolf": "wolves", "shelf": "shelves", "thief": "thieves", "loaf": "loaves", "calf": "calves",
+    "self": "selves", "elf": "elves", "potato": "potatoes", "tomato": "tomatoes",
+    "hero": "heroes", "echo": "echoes", "veto": "vetoes", "torpedo": "torpedoes"
+}
+
+# base: (comparative, superlative)
+IRREGULAR_COMPARISON = {
+    "good": ("better", "best"), "well": ("better", "best"), "bad": ("worse", "worst"),
+    "badly": ("worse", "worst"), "far": ("farther", "farthest"), "little": ("less", "least"),
+    "many": ("more", "most"), "much": ("more", "most")
+}
+
+# Multi-syllable verbs stressed on the last syllable double the consonant
+DOUBLING_VERBS = {"begin", "prefer", "occur", "admit", "commit", "refer", "forget", "permit",
+                  "regret", "control", "compel", "expel", "omit", "submit", "transfer", "upset", "equip"}
+
+# Adjectives ending in -ly that compare with -ier / -iest (adverbs in -ly take more / most)
+LY_ADJECTIVES = {"early", "friendly", "lovely", "lonely", "lively", "likely", "silly", "ugly", "holy",
+                 "jolly", "curly", "costly", "deadly", "chilly", "hilly", "smelly"}
+
+VOWELS = "aeiou"
+_VOWEL_GROUPS_RE = re.compile(r"[aeiouy]+")
+
+# Words that put a following past form in the past participle
+_PARTICIPLE_CUES = {"has", "have", "had", "having", "been", "be", "is", "are", "was", "were",
+                    "am", "being", "get", "gets", "got", "getting", "hasn't", "haven't", "hadn't",
+                    "isn't", "aren't", "wasn't", "weren't"}
+
+# Words that put a following verb in the base form
+_BASE_CUES = {"to", "will", "would", "shall", "should", "can", "could", "may", "might", "must",
+              "do", "does", "did", "don't", "doesn't", "didn't", "won't", "wouldn't", "can't",
+              "couldn't", "shouldn't", "mustn't", "let's", "please", "not"}
+
+# Subjects after which a present-tense verb would end in -s
+_THIRD_PERSON_SUBJECTS = {"he", "she", "it"}
+
+_PAST_TIME_RE = re.compile(r"\b(yesterday|ago|last|once|in (1[5-9]|20)\d\d)\b", re.IGNORECASE)
+
+
+def word_class(pos):
+    """
+    Maps a free-text part of speech ("Verb", "phrasal verb", "adj.") to
+    verb / noun / adjective / adverb, or None.
+    """
+    if not isinstance(pos, str):
+        return None
+    pos = pos.lower().strip()
+    if pos.startswith("adv"):
+        return "adverb"
+    if "verb" in pos or pos in ("v", "v."):
+        return "verb"
+    if "noun" in pos or pos in ("n", "n."):
+        return "noun"
+    if pos.startswith("adj"):
+        return "adjective"
+    return None
+
+
+def _syllables(word):
+    return len(_VOWEL_GROUPS_RE.findall(word.rstrip("e") or word))
+
+
+def _ends_cvc(word):
+    """
+    Consonant-vowel-consonant ending whose final consonant doubles (stop, run).
+    """
+    # The u of "qu" is a consonant sound (quit, quiz, squat)
+    return (len(word) >= 3 and word[-1] not in VOWELS + "wxy" and word[-2] in VOWELS
+            and (word[-3] not in VOWELS or word[-4:-2] == "qu"))
+
+
+def _doubles(word):
+    return _ends_cvc(word) and (_syllables(word) == 1 or word in DOUBLING_VERBS)
+
+
+def _add_s(word):
+    if word.endswith("z") and _ends_cvc(word) and _syllables(word) == 1:
+        return word + "zes"
+    if word.endswith(("s", "x", "z", "ch", "sh")):
+        return word + "es"
+    if word.endswith("y") and len(word) > 1 and word[-2] not in VOWELS:
+        return word[:-1] + "ies"
+    return word + "s"
+
+
+def _third_person(word):
+    if word in IRREGULAR_THIRD_PERSON:
+        return IRREGULAR_THIRD_PERSON[word]
+    if word.endswith("o") and len(word) > 1 and word[-2] not in VOWELS:
+        return word + "es"
+    return _add_s(word)
+
+
+def _plural(word):
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    return _add_s(word)
+
+
+def _ing(word):
+    if word == "be":
+        return "being"
+    if word.endswith("ie"):
+        return word[:-2] + "ying"
+    if word.endswith("e") and not word.endswith(("ee", "ye", "oe")) and len(word) > 2:
+        return word[:-1] + "ing"
+    if _doubles(word):
+        return word + word[-1] + "ing"
+    if word.endswith("ic"):
+        return word + "king"
+    return word + "ing"
+
+
+def _regular_past(word):
+    if word.endswith("e"):
+        return word + "d"
+    if word.endswith("y") and len(word) > 1 and word[-2] not in VOWELS:
+        return word[:-1] + "ied"
+    if _doubles(word):
+        return word + word[-1] + "ed"
+    # panic -> panicked
+    if word.endswith("ic"):
+        return word + "ked"
+    return word + "ed"
+
+
+def _past(word):
+    if word in IRREGULAR_VERBS:
+        return IRREGULAR_VERBS[word][0]
+    return _regular_past(word)
+
+
+def _past_participle(word):
+    if word in IRREGULAR_VERBS:
+        return IRREGULAR_VERBS[word][1]
+    return _regular_past(word)
+
+
+def _compare(word, form):
+    if word in IRREGULAR_COMPARISON:
+        return IRREGULAR_COMPARISON[word][0 if form == FORM_COMPARATIVE else 1]
+
+    suffix = "er" if form == FORM_COMPARATIVE else "est"
+    if word in LY_ADJECTIVES:
+        return word[:-1] + "i" + suffix
+    syllables = _syllables(word)
+    if syllables >= 3 or (syllables == 2 and not word.endswith(("y", "er", "le", "ow"))) or word.endswith("ly"):
+        return ("more " if form == FORM_COMPARATIVE else "most ") + word
+    if word.endswith("e"):
+        return word + suffix[1:]
+    if word.endswith("y") and len(word) > 1 and word[-2] not in VOWELS:
+        return word[:-1] + "i" + suffix
+    if _ends_cvc(word) and syllables == 1:
+        return word + word[-1] + suffix
+    return word + suffix
+
+
+_WORD_RULES = {
+    FORM_PAST: _past,
+    FORM_PAST_PARTICIPLE: _past_participle,
+    FORM_ING: _ing,
+    FORM_THIRD_PERSON: _third_person,
+    FORM_PLURAL: _plural
+}
+
+
+def inflect(item, form):
+    """
+    Puts a base-form item into the given form. Multi-word verbs inflect
+    their first word ("look after" -> "looked after"), multi-word nouns
+    their last ("ice cream" -> "ice creams"). Returns the item unchanged
+    for FORM_BASE or an unknown form.
+    """
+    words = item.split()
+    if not words or form not in FORM_CLASS:
+        return item
+
+    if form in (FORM_COMPARATIVE, FORM_SUPERLATIVE):
+        if len(words) > 1:
+            return ("more " if form == FORM_COMPARATIVE else "most ") + item
+        return _compare(words[0].lower(), form)
+
+    rule = _WORD_RULES[form]
+    if form == FORM_PLURAL:
+        words[-1] = rule(words[-1].lower())
+    else:
+        words[0] = rule(words[0].lower())
+    return " ".join(words)
+
+
+def _variants(base, form):
+    forms = {inflect(base, form)}
+    first, rest = (base.split(None, 1) + [""])[:2]
+    if form == FORM_PAST:
+        for variant in PAST_VARIANTS.get(first.lower(), ()):
+            forms.add(f"{variant} {rest}".strip())
+    elif form in (FORM_COMPARATIVE, FORM_SUPERLATIVE):
+        # "more friendly" is accepted as well as "friendlier"
+        forms.add(("more " if form == FORM_COMPARATIVE else "most ") + base)
+    return forms
+
+
+def _preceding_word(sentence, answer):
+    match = re.search(r"([\w']+)\W+" + re.escape(answer) + r"\b", sentence or "", re.IGNORECASE)
+    return match.group(1).lower() if match else ""
+
+
+def _base_spelt_form(sentence, answer):
+    """
+    Form of a verb answer spelt like its base (put, cut, read), which only
+    the sentence can tell: a participle cue before it, a base-form cue, or
+    a third-person subject or past time expression (past). Defaults to
+    FORM_BASE.
+    """
+    previous = _preceding_word(sentence, answer)
+    if previous in _PARTICIPLE_CUES:
+        return FORM_PAST_PARTICIPLE
+    if previous in _BASE_CUES:
+        return FORM_BASE
+    if previous in _THIRD_PERSON_SUBJECTS or _PAST_TIME_RE.search(sentence):
+        return FORM_PAST
+    return FORM_BASE
+
+
+def detect_form(base, answer, pos=None, sentence=None):
+    """
+    Works out which form of `base` the stage-1 answer is (e.g. "blow" /
+    "blew" -> FORM_PAST). Past vs past participle is decided from the word
+    before the answer in the sentence when both spellings are the same, and
+    so is base vs past for verbs whose past is spelt like the base (put).
+    Returns a FORM_* constant, or None if the answer is not a recognised
+    form of the base.
+    """
+    base = " ".join(str(base or "").lower().split())
+    answer_key = " ".join(str(answer or "").lower().split())
+    if not base or not answer_key:
+        return None
+    target_class = word_class(pos)
+    if answer_key == base:
+        if sentence and target_class in (None, "verb") and inflect(base, FORM_PAST) == base:
+            return _base_spelt_form(sentence, answer_key)
+        return FORM_BASE
+
+    classes = [target_class] if target_class else list(FORMS_BY_CLASS)
+    matches = [form for c in classes for form in FORMS_BY_CLASS[c] if answer_key in _variants(base, form)]
+    if not matches:
+        return None
+
+    if FORM_PAST in matches and FORM_PAST_PARTICIPLE in matches:
+        if _preceding_word(sentence, answer_key) in _PARTICIPLE_CUES:
+            return FORM_PAST_PARTICIPLE
+        return FORM_PAST
+    return matches[0]
+
+
+def inflect_like(candidate, form, candidate_pos=None):
+    """
+    Inflects a candidate into the answer's form if its word class fits the
+    form (or is unknown). Returns the inflected candidate, or None if it
+    cannot be put into that form locally.
+    """
+    if form == FORM_BASE:
+        return candidate
+    if form not in FORM_CLASS:
+        return None
+    candidate_class = word_class(candidate_pos)
+    if candidate_class is not None and candidate_class not in FORM_CLASS[form]:
+        return None
+    return inflect(candidate, form)
@@ -0,0 +1,357 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import checkpoint_store
+import pipeline
+
+# -----------------------------------------------------------------
+# Background Job Queue (SQLite)
+# -----------------------------------------------------------------
+# Batches submitted here are run by worker threads owned by this module,
+# not by the Streamlit script thread, so a rerun, a tab switch or a closed
+# browser tab no longer kills them. Every job is a row in a local SQLite
+# file with its inputs, live progress and, once finished, its pickled
+# pipeline results (stage outputs, raw responses, ledger, questions), so
+# any session can poll a job and load its results later.
+#
+# Every job also saves its stage outputs with checkpoint_store as it goes,
+# under the scope it was submitted with or else one of its own, which is
+# cleared once the job is done.
+#
+# API keys are only kept in memory. Jobs that were still queued or running
+# when the app stopped are marked "interrupted" the next time the queue
+# file is opened; resubmit() runs them again from their stored inputs and
+# checkpoints, so finished stages are not generated again.
+# One app process per queue file.
+QUEUE_SETTINGS = {
+    "path": os.environ.get("JOB_QUEUE_PATH", ".job_queue.sqlite"),
+    # Batches processed at the same time (each runs its own chunks in parallel)
+    "workers": int(os.environ.get("JOB_QUEUE_WORKERS", "2")),
+    # Seconds an idle worker waits before checking the queue again
+    "poll_interval": 1.0,
+    # Minimum seconds between two progress writes of one job
+    "progress_interval": 1.0
+}
+
+# Prefix of the checkpoint scope of a job submitted without one
+JOB_SCOPE_PREFIX = "job:"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+STATUS_INTERRUPTED = "interrupted"
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+# job id -> api_key for jobs submitted by this process
+_api_keys = {}
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+_JOB_COLUMNS = "id, kind, label, status, meta, progress, error, created, started, finished"
+
+
+def configure_queue(path=None, workers=None, poll_interval=None, progress_interval=None):
+    """
+    Updates queue settings (e.g. a temporary path for regression tests).
+    A larger worker count starts more workers on the next submit; running
+    workers are never stopped.
+    """
+    if path is not None:
+        QUEUE_SETTINGS["path"] = path
+    if workers is not None:
+        QUEUE_SETTINGS["workers"] = workers
+    if poll_interval is not None:
+        QUEUE_SETTINGS["poll_interval"] = poll_interval
+    if progress_interval is not None:
+        QUEUE_SETTINGS["progress_interval"] = progress_interval
+
+
+def _connect():
+    path = QUEUE_SETTINGS["path"]
+    conn = sqlite3.connect(path, timeout=30)
+    with _init_lock:
+        if path not in _initialized_paths:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, label TEXT, status TEXT NOT NULL, "
+                "payload BLOB NOT NULL, meta TEXT, progress TEXT, results BLOB, error TEXT, "
+                "created REAL NOT NULL, started REAL, finished REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            # Nothing is running this file yet, so active jobs belong to a stopped process
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE status IN (?, ?)",
+                (STATUS_INTERRUPTED, "The app stopped before this job finished.", time.time(), *ACTIVE_STATUSES)
+            )
+            conn.commit()
+            _initialized_paths.add(path)
+    return conn
+
+
+def _update(job_id, **fields):
+    """
+    Writes the given columns of one job row.
+    """
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    try:
+        conn = _connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE WRITE FAILED ({job_id}): {e}")
+
+
+def _row_to_job(row):
+    job = dict(zip(_JOB_COLUMNS.split(", "), row))
+    job["meta"] = json.loads(job["meta"]) if job["meta"] else {}
+    job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+    return job
+
+
+def submit(job_list, kind, config=None, label="", meta=None):
+    """
+    Queues a batch for pipeline.run_batch(job_list, kind, config) and
+    returns its job id straight away. meta is a JSON-serializable dict
+    stored with the job for the UI (e.g. the CEFR level of the batch).
+    config["api_key"] is held in memory only and config["on_update"] is
+    replaced by the queue's own progress tracking. Without a
+    config["checkpoint"] scope the job checkpoints under its own.
+    Raises sqlite3.Error if the job cannot be stored.
+    """
+    config = dict(config or {})
+    api_key = config.pop("api_key", None)
+    config.pop("on_update", None)
+
+    job_id = uuid.uuid4().hex[:12]
+    if not config.get("checkpoint"):
+        config["checkpoint"] = JOB_SCOPE_PREFIX + job_id
+    payload = pickle.dumps({"job_list": job_list, "kind": kind, "config": config})
+    progress = pipeline.new_progress(len(job_list))
+
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, label, status, payload, meta, progress, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, label, STATUS_QUEUED, payload, json.dumps(meta or {}), json.dumps(progress), time.time())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    _api_keys[job_id] = api_key
+    _start_workers()
+    _wakeup.set()
+    return job_id
+
+
+def resubmit(job_id, api_key):
+    """
+    Queues a new job with the stored inputs of an earlier one (e.g. after it
+    was interrupted). It keeps the earlier job's checkpoint scope, so stages
+    that job finished are restored. Returns the new job id, or None if
+    job_id is unknown.
+    """
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT payload, label, meta FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE READ FAILED ({job_id}): {e}")
+        return None
+    if row is None:
+        return None
+
+    payload = pickle.loads(row[0])
+    config = dict(payload["config"], api_key=api_key)
+    return submit(payload["job_list"], payload["kind"], config, label=row[1], meta=json.loads(row[2] or "{}"))
+
+
+def cancel(job_id):
+    """
+    Cancels a job that has not started yet. Running jobs are not
+    interrupted. Returns True if the job was cancelled.
+    """
+    try:
+        conn = _connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (STATUS_CANCELLED, time.time(), job_id, STATUS_QUEUED)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE WRITE FAILED ({job_id}): {e}")
+        return False
+    if cursor.rowcount:
+        _api_keys.pop(job_id, None)
+    return cursor.rowcount > 0
+
+
+def get_job(job_id):
+    """
+    Status record of a job: id, kind, label, status, meta, progress (see
+    pipeline.new_progress), error and timestamps. None if unknown.
+    """
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE READ FAILED ({job_id}): {e}")
+        return None
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(limit=20):
+    """
+    Status records of the most recent jobs, newest first.
+    """
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE READ FAILED: {e}")
+        return []
+    return [_row_to_job(row) for row in rows]
+
+
+def get_results(job_id):
+    """
+    The pipeline.run_batch results of a finished job, or None while it is
+    still queued or running (or if it failed).
+    """
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT results FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE READ FAILED ({job_id}): {e}")
+        return None
+    if row is None or row[0] is None:
+        return None
+    return pickle.loads(row[0])
+
+
+# -----------------------------------------------------------------
+# Workers
+# -----------------------------------------------------------------
+
+def _start_workers():
+    """
+    Starts worker threads up to QUEUE_SETTINGS["workers"]. They are daemon
+    threads, like the llm_service loop, so they never block shutdown.
+    """
+    with _workers_lock:
+        while len(_workers) < max(1, QUEUE_SETTINGS["workers"]):
+            worker = threading.Thread(target=_work, name=f"job-queue-worker-{len(_workers) + 1}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _work():
+    while True:
+        job_id = _claim_next()
+        if job_id is None:
+            _wakeup.wait(QUEUE_SETTINGS["poll_interval"])
+            _wakeup.clear()
+            continue
+        _run_job(job_id)
+
+
+def _claim_next():
+    """
+    Marks the oldest queued job submitted by this process as running and
+    returns its id, or None if there is nothing to do.
+    """
+    try:
+        conn = _connect()
+        try:
+            queued = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created", (STATUS_QUEUED,)
+            ).fetchall()
+            for (job_id,) in queued:
+                if job_id not in _api_keys:
+                    continue
+                # Only one worker can win the status change
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, started = ? WHERE id = ? AND status = ?",
+                    (STATUS_RUNNING, time.time(), job_id, STATUS_QUEUED)
+                )
+                conn.commit()
+                if cursor.rowcount:
+                    return job_id
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"JOB QUEUE CLAIM FAILED: {e}")
+    return None
+
+
+def _run_job(job_id):
+    """
+    Runs one claimed job through pipeline.run_batch, writing its progress
+    while it runs and its results (or traceback) when it ends.
+    """
+    api_key = _api_keys.pop(job_id, None)
+    latest = {}
+    last_write = [0.0]
+
+    def on_update(progress):
+        latest.update(progress)
+        now = time.time()
+        if now - last_write[0] >= QUEUE_SETTINGS["progress_interval"]:
+            last_write[0] = now
+            _update(job_id, progress=json.dumps(latest))
+
+    try:
+        conn = _connect()
+        try:
+            payload = pickle.loads(conn.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+        finally:
+            conn.close()
+        config = dict(payload["config"], api_key=api_key, on_update=on_update)
+        results = pipeline.run_batch(payload["job_list"], payload["kind"], config)
+    except Exception as e:
+        print(f"JOB {job_id} FAILED: {e}")
+        _update(job_id, status=STATUS_FAILED, error=traceback.format_exc(), finished=time.time())
+        return
+
+    fields = {"status": STATUS_DONE, "results": pickle.dumps(results), "finished": time.time()}
+    if latest:
+        fields["progress"] = json.dumps(latest)
+    _update(job_id, **fields)
+    # A job's own checkpoints are not needed once its results are stored
+    scope = payload["config"].get("checkpoint") or ""
+    if scope.startswith(JOB_SCOPE_PREFIX):
+        checkpoint_store.clear(scope)
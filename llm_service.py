@@ -1,34 +1,436 @@
-from openai import OpenAI
+import asyncio
+import atexit
+import threading
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+import output_formatter
+import rate_limiter
+import response_cache
 
 # Standard OpenAI Default
-DEFAULT_MODEL = "gpt-4o" 
+DEFAULT_MODEL = "gpt-4o"
+
+# -----------------------------------------------------------------
+# Client Registry (one pooled client per api_key/base_url)
+# -----------------------------------------------------------------
+# Retries are handled by rate_limiter, so the SDK's own retries are off.
+# Streamlit reruns the script but keeps imported modules alive, so clients
+# stored here keep their keep-alive connections warm across reruns and
+# across the three back-to-back stage calls.
+POOL_LIMITS = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0
+}
+REQUEST_TIMEOUT = 120.0
+
+# Max number of stage requests in flight at once for call_llm_many
+DEFAULT_CONCURRENCY = 4
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Async clients are bound to the event loop they were created on, so they
+# all live on one long-running background loop (see _get_loop).
+_async_clients = {}
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def configure_pool(max_connections=None, max_keepalive_connections=None, keepalive_expiry=None):
+    """
+    Updates the connection pool limits used for new clients.
+    Existing clients are closed so the next call picks up the new limits.
+    """
+    if max_connections is not None:
+        POOL_LIMITS["max_connections"] = max_connections
+    if max_keepalive_connections is not None:
+        POOL_LIMITS["max_keepalive_connections"] = max_keepalive_connections
+    if keepalive_expiry is not None:
+        POOL_LIMITS["keepalive_expiry"] = keepalive_expiry
+    close_clients()
+
+
+def get_client(api_key, base_url=None):
+    """
+    Returns the shared OpenAI client for (api_key, base_url), creating it
+    with a keep-alive connection pool on first use.
+    """
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(**POOL_LIMITS),
+                timeout=REQUEST_TIMEOUT
+            )
+            if base_url:
+                client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            else:
+                client = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(api_key, base_url=None):
+    """
+    Returns the shared AsyncOpenAI client for (api_key, base_url).
+    Must be called from coroutines running on the service loop.
+    """
+    key = (api_key, base_url)
+    client = _async_clients.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(**POOL_LIMITS),
+            timeout=REQUEST_TIMEOUT
+        )
+        if base_url:
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        else:
+            client = AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+        _async_clients[key] = client
+    return client
+
+
+def close_clients():
+    """
+    Closes every pooled client and empties the registry.
+    Registered with atexit so connections are released on shutdown.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    if _loop is not None and _loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_close_async_clients(), _loop).result(timeout=5)
+        except Exception:
+            pass
+
+
+async def _close_async_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_clients)
+
+
+def _result(content="", finish_reason=None, error=None, usage=None):
+    """
+    Detailed outcome of a completion call:
+    content, finish_reason ("stop", "length", ...), error and usage.
+    """
+    return {"content": content or "", "finish_reason": finish_reason, "error": error, "usage": usage}
+
+
+def _usage(usage):
+    """
+    Token usage of a response as a plain dict. cached_tokens is the part of
+    the prompt served from OpenAI's prompt cache (billed at a discount).
+    """
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0
+    }
+
+
+def result_text(result):
+    """
+    Flattens a detailed result into the plain contract used by call_llm:
+    the response text, or an "Error: ..." string.
+    """
+    if result["error"]:
+        return f"Error: {result['error']}"
+    return result["content"]
+
+
+def is_truncated(result):
+    """
+    True when the model stopped because it ran out of max_tokens.
+    """
+    return result["finish_reason"] == "length"
+
+
+def _cache_lookup(request, use_cache):
+    cache_key = response_cache.make_key(request)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cache_key, _result(cached, finish_reason="stop")
+    return cache_key, None
 
-def call_llm(messages, api_key, model=DEFAULT_MODEL, base_url=None, max_tokens=4096):
+
+def _cache_store(cache_key, result):
+    # Truncated output is never cached, so a retry gets a fresh attempt
+    if not result["error"] and result["finish_reason"] != "length":
+        response_cache.put(cache_key, result["content"])
+
+
+def store_in_cache(messages, result, model=DEFAULT_MODEL, max_tokens=4096):
+    """
+    Caches a result that was requested with cache_result=False, once the
+    caller has checked its content is usable.
+    """
+    _cache_store(response_cache.make_key(_build_request(messages, model, max_tokens)), result)
+
+
+async def async_store_in_cache(messages, result, model=DEFAULT_MODEL, max_tokens=4096):
+    """
+    store_in_cache for coroutines on the shared loop (SQLite I/O runs in a
+    worker thread).
+    """
+    await asyncio.to_thread(store_in_cache, messages, result, model, max_tokens)
+
+
+def complete(messages, api_key, model=DEFAULT_MODEL, base_url=None, max_tokens=4096, use_cache=True,
+             cache_result=True):
+    """
+    Sends a message history to the OpenAI API and returns a detailed result
+    (see _result), so callers can detect max_tokens truncation.
+    Identical requests are served from the response cache unless use_cache=False.
+    With cache_result=False the response is not stored; see store_in_cache.
+    Rate limits and transient errors are retried (see rate_limiter).
+    """
+    if not api_key:
+        return _result(error="API Key is missing. Please enter it in the sidebar.")
+
+    try:
+        request = _build_request(messages, model, max_tokens)
+        cache_key, cached = _cache_lookup(request, use_cache)
+        if cached:
+            return cached
+
+        # Pooled client (base_url only needed when using a proxy)
+        client = get_client(api_key, base_url)
+
+        raw = rate_limiter.call_with_retry(
+            lambda r: client.chat.completions.with_raw_response.create(**r), request, api_key
+        )
+        response = raw.parse()
+        result = _result(response.choices[0].message.content, response.choices[0].finish_reason,
+                         usage=_usage(response.usage))
+        if cache_result:
+            _cache_store(cache_key, result)
+        return result
+
+    except Exception as e:
+        return _result(error=str(e))
+
+
+def call_llm(messages, api_key, model=DEFAULT_MODEL, base_url=None, max_tokens=4096, use_cache=True):
     """
     Sends a message history to the OpenAI API.
+    Returns the response text or an "Error: ..." string.
+    """
+    return result_text(complete(messages, api_key, model=model, base_url=base_url,
+                                max_tokens=max_tokens, use_cache=use_cache))
+
+
+def _build_request(messages, model, max_tokens):
+    """
+    Builds the chat completion arguments shared by the sync and async paths.
+    """
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": messages[0]},
+            {"role": "user", "content": messages[1]}
+        ],
+        "temperature": 0.7,
+        "max_tokens": max_tokens,
+        # OpenAI specific flag to force valid JSON
+        "response_format": {"type": "json_object"}
+    }
+
+# -----------------------------------------------------------------
+# Async API (bounded concurrency for chunked batches)
+# -----------------------------------------------------------------
+
+async def async_complete(messages, api_key, model=DEFAULT_MODEL, base_url=None, max_tokens=4096, timeout=None,
+                         use_cache=True, cache_result=True):
+    """
+    Async version of complete. Cancellation is propagated to the caller.
     """
     if not api_key:
-        return "Error: API Key is missing. Please enter it in the sidebar."
+        return _result(error="API Key is missing. Please enter it in the sidebar.")
 
     try:
-        # Standard OpenAI Client (no base_url needed unless using a proxy)
-        if base_url:
-            client = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            client = OpenAI(api_key=api_key)
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": messages[0]},
-                {"role": "user", "content": messages[1]}
-            ],
-            temperature=0.7,
-            max_tokens=max_tokens,
-            # OpenAI specific flag to force valid JSON
-            response_format={"type": "json_object"}
+        request = _build_request(messages, model, max_tokens)
+        cache_key, cached = await asyncio.to_thread(_cache_lookup, request, use_cache)
+        if cached:
+            return cached
+
+        client = get_async_client(api_key, base_url)
+        pending = rate_limiter.async_call_with_retry(
+            lambda r: client.chat.completions.with_raw_response.create(**r), request, api_key
         )
-        return response.choices[0].message.content
-        
+        if timeout:
+            raw = await asyncio.wait_for(pending, timeout)
+        else:
+            raw = await pending
+        response = raw.parse()
+        result = _result(response.choices[0].message.content, response.choices[0].finish_reason,
+                         usage=_usage(response.usage))
+        if cache_result:
+            await asyncio.to_thread(_cache_store, cache_key, result)
+        return result
+
+    except asyncio.TimeoutError:
+        return _result(error=f"Request timed out after {timeout} seconds.")
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        return f"Error: {str(e)}"
+        return _result(error=str(e))
+
+
+async def async_call_llm(messages, api_key, **kwargs):
+    """
+    Async version of call_llm. Returns the response text or an "Error: ..."
+    string, so callers can treat both paths the same way.
+    """
+    return result_text(await async_complete(messages, api_key, **kwargs))
+
+
+async def async_stream_llm(messages, api_key, on_item=None, model=DEFAULT_MODEL, base_url=None, max_tokens=4096,
+                           timeout=None, use_cache=True, cache_result=True):
+    """
+    Streams a response (stream=True) and calls on_item(item) for every array
+    element as soon as it is complete, so callers can act on early items
+    while the rest is still being generated.
+    Returns a detailed result like async_complete.
+    """
+    if not api_key:
+        return _result(error="API Key is missing. Please enter it in the sidebar.")
+
+    parser = output_formatter.StreamingArrayParser()
+
+    def emit(text):
+        for item in parser.feed(text):
+            if on_item:
+                on_item(item)
+
+    try:
+        request = _build_request(messages, model, max_tokens)
+        cache_key, cached = await asyncio.to_thread(_cache_lookup, request, use_cache)
+        if cached:
+            emit(cached["content"])
+            return cached
+
+        client = get_async_client(api_key, base_url)
+
+        async def consume():
+            # include_usage adds a final chunk with the token usage
+            stream = await rate_limiter.async_call_with_retry(
+                lambda r: client.chat.completions.create(
+                    stream=True, stream_options={"include_usage": True}, **r
+                ), request, api_key
+            )
+            parts = []
+            finish_reason = None
+            usage = None
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = _usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    emit(choice.delta.content)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+            return _result("".join(parts), finish_reason, usage=usage)
+
+        if timeout:
+            result = await asyncio.wait_for(consume(), timeout)
+        else:
+            result = await consume()
+        if cache_result:
+            await asyncio.to_thread(_cache_store, cache_key, result)
+        return result
+
+    except asyncio.TimeoutError:
+        return _result(parser.buffer, error=f"Request timed out after {timeout} seconds.")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return _result(parser.buffer, error=str(e))
+
+
+async def call_llm_many(message_list, api_key, model=DEFAULT_MODEL, base_url=None, max_tokens=4096,
+                        concurrency=DEFAULT_CONCURRENCY, timeout=None, use_cache=True):
+    """
+    Runs many [system, user] message pairs at once, with at most
+    `concurrency` requests in flight. Results are returned in input order.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(messages):
+        async with semaphore:
+            return await async_call_llm(
+                messages, api_key, model=model, base_url=base_url,
+                max_tokens=max_tokens, timeout=timeout, use_cache=use_cache
+            )
+
+    return await asyncio.gather(*(run_one(messages) for messages in message_list))
+
+
+def _get_loop():
+    """
+    Starts (once) and returns the background event loop that runs all
+    async LLM work, so the Streamlit script thread is never blocked by it.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or not _loop.is_running():
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            threading.Thread(target=run, name="llm-service-loop", daemon=True).start()
+            started.wait()
+            _loop = loop
+        return _loop
+
+
+def submit(coro):
+    """
+    Schedules a coroutine on the service loop.
+    Returns a concurrent.futures.Future; call .cancel() on it to abort.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def submit_many(message_list, api_key, **kwargs):
+    """
+    Starts call_llm_many in the background and returns its Future.
+    """
+    return submit(call_llm_many(message_list, api_key, **kwargs))
+
+
+def call_llm_many_sync(message_list, api_key, **kwargs):
+    """
+    Blocking helper around submit_many for code that just needs the results.
+    """
+    return submit_many(message_list, api_key, **kwargs).result()
@@ -81,3 +81,121 @@ def extract_array_from_response(data):
         return None, f"Response is a dict but doesn't contain an array. Keys: {list(data.keys())}"
 
     return None, f"Response is neither array nor dict. Type: {type(data)}"
+
+
+def parse_stage_array(raw_response):
+    """
+    Parses a raw stage response and extracts its item array in one step.
+    Returns (array, error_message)
+    """
+    data, error = parse_response(raw_response)
+    if error:
+        return None, error
+    return extract_array_from_response(data)
+
+
+def validate_stage_item(stage, item):
+    """
+    Checks that a single stage item has the fields later stages and assembly
+    rely on. Returns an error message, or None if the item is usable.
+    """
+    if not isinstance(item, dict):
+        return f"Item is not an object: {type(item).__name__}"
+
+    def filled(key):
+        value = item.get(key)
+        return value is not None and str(value).strip() != ""
+
+    if stage == 1:
+        missing = [key for key in ("Complete Sentence", "Correct Answer") if not filled(key)]
+        if missing:
+            return f"Missing {', '.join(missing)}"
+    elif stage == 2:
+        candidates = [key for key in item if key.startswith("Candidate ") and filled(key)]
+        if len(candidates) < 3:
+            return f"Only {len(candidates)} candidates"
+    elif stage == 3:
+        missing = [f"Selected Distractor {k}" for k in "ABC" if not filled(f"Selected Distractor {k}")]
+        if missing:
+            return f"Missing {', '.join(missing)}"
+    return None
+
+
+def salvage_array_items(raw_response):
+    """
+    Recovers the complete array elements from a response that was cut off
+    (e.g. by max_tokens) before the JSON was closed.
+    Returns a list of items (possibly empty).
+    """
+    if not raw_response or raw_response.startswith("Error:"):
+        return []
+    parser = StreamingArrayParser()
+    parser.feed(raw_response)
+    return parser.items
+
+
+class StreamingArrayParser:
+    """
+    Incrementally parses a streamed JSON response such as
+    {"questions": [{...}, {...}]} and returns each array element as soon as
+    its closing brace arrives, before the rest of the response exists.
+
+    Usage: items = parser.feed(text_chunk) for each chunk received.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.items = []
+        self._pos = 0
+        self._depth = 0
+        self._array_depth = None
+        self._item_start = None
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        """
+        Adds a chunk of text and returns the list of newly completed items.
+        """
+        self.buffer += text
+        completed = []
+
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+                # The first array opened is the item array
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = self._pos
+            elif ch in "]}":
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                    item = self._decode(self.buffer[self._item_start:self._pos + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = None
+                self._depth -= 1
+
+            self._pos += 1
+
+        self.items.extend(completed)
+        return completed
+
+    @staticmethod
+    def _decode(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            print(f"FAILED STREAMED ITEM: {text}")
+            return None
@@ -0,0 +1,954 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import batch_data
+import checkpoint_store
+import dedup_index
+import distractor_rules
+import llm_service
+import output_formatter
+import prompt_engineer
+import test_planner
+import token_budget
+
+# -----------------------------------------------------------------
+# Pipeline Configuration
+# -----------------------------------------------------------------
+# Large job lists are split into chunks so no single prompt hits the
+# max_tokens limit, and chunks are sent to the API in parallel. By default
+# chunks are packed from measured prompt tokens (see token_budget);
+# DEFAULT_CHUNK_SIZE is only used for fixed-size chunking (chunk_jobs).
+DEFAULT_CHUNK_SIZE = 8
+
+# When stage 1 is streamed, this many finished stems are sent on to
+# stage 2 together instead of waiting for the whole chunk.
+DEFAULT_STREAM_GROUP_SIZE = 4
+
+# How many times a stage cut off by max_tokens is resubmitted for the
+# items that are still missing.
+MAX_CONTINUATIONS = 2
+
+# How many targeted follow-up calls are made for items that came back
+# missing or malformed. Items that came back fine are never regenerated.
+MAX_ITEM_RETRIES = 1
+
+# Batch kinds (one per generator tab)
+KIND_GRAMMAR = "Grammar"
+KIND_VOCABULARY = "Vocabulary"
+KIND_VOCAB_LIST = "Vocabulary List"
+KIND_GRAMMAR_LIST = "Grammar List"
+# Grammar/Vocabulary jobs of several types and CEFR levels (a test blueprint),
+# run as one homogeneous sub-batch per (type, CEFR); see run_mixed_pipeline
+KIND_MIXED = "Mixed"
+
+# Pipeline modes (Generator tab strategies, see test_planner)
+# - sequential: stage 2 proposes candidates, stage 3 has the model validate them
+# - combined: one call returns scored candidates and the final three are
+#   picked locally (distractor_rules.select_scored), saving a round trip
+MODE_SEQUENTIAL = "Sequential Batch (3-Call)"
+MODE_COMBINED = "Combined Batch (2-Call)"
+
+STAGES = batch_data.STAGES
+
+
+def chunk_jobs(job_list, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits the job list into consecutive chunks of at most chunk_size jobs.
+    """
+    chunk_size = max(1, int(chunk_size))
+    return [job_list[i:i + chunk_size] for i in range(0, len(job_list), chunk_size)]
+
+
+def get_stage_builders(kind, context=None, mode=MODE_SEQUENTIAL):
+    """
+    Returns {stage: builder} for a batch kind. Builders take
+    (jobs, stage1_outputs, stage2_outputs) and return (system_msg, user_msg).
+    In combined mode there is no stage-3 builder (stage 3 runs locally).
+
+    context carries tab-specific inputs:
+    - example_banks (Grammar / Vocabulary)
+    - question_form (Vocabulary List / Grammar List)
+    - vocab_df (Vocabulary List)
+    """
+    context = context or {}
+
+    if mode == MODE_COMBINED:
+        if kind not in (KIND_GRAMMAR, KIND_VOCABULARY):
+            raise ValueError(f"Combined mode is not available for {kind} batches")
+        return {
+            1: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage1_prompt(jobs, context.get('example_banks')),
+            2: lambda jobs, s1, s2: prompt_engineer.create_combined_candidates_prompt(jobs, s1, kind)
+        }
+    if mode != MODE_SEQUENTIAL:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+
+    if kind == KIND_GRAMMAR:
+        return {
+            1: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage1_prompt(jobs, context.get('example_banks')),
+            2: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage2_grammar_prompt(jobs, s1),
+            3: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage3_grammar_prompt(jobs, s1, s2)
+        }
+    if kind == KIND_VOCABULARY:
+        return {
+            1: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage1_prompt(jobs, context.get('example_banks')),
+            2: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage2_vocabulary_prompt(jobs, s1),
+            3: lambda jobs, s1, s2: prompt_engineer.create_sequential_batch_stage3_vocabulary_prompt(jobs, s1, s2)
+        }
+    if kind == KIND_VOCAB_LIST:
+        return {
+            1: lambda jobs, s1, s2: prompt_engineer.create_vocab_list_stage1_prompt(jobs, context.get('question_form')),
+            2: lambda jobs, s1, s2: prompt_engineer.create_vocab_list_stage2_prompt(jobs, s1, context.get('vocab_df')),
+            3: lambda jobs, s1, s2: prompt_engineer.create_vocab_list_stage3_prompt(jobs, s1, s2)
+        }
+    if kind == KIND_GRAMMAR_LIST:
+        return {
+            1: lambda jobs, s1, s2: prompt_engineer.create_grammar_list_stage1_prompt(jobs, context.get('question_form')),
+            2: lambda jobs, s1, s2: prompt_engineer.create_grammar_list_stage2_prompt(jobs, s1),
+            3: lambda jobs, s1, s2: prompt_engineer.create_grammar_list_stage3_prompt(jobs, s1, s2)
+        }
+    raise ValueError(f"Unknown batch kind: {kind}")
+
+
+def new_stats():
+    """
+    Call counters for one run (shared by its chunks), used for latency and
+    cost comparisons. Token counts are estimated from text length when the
+    API reports no usage (e.g. responses served from the response cache);
+    cached_tokens counts prompt tokens served from the provider's prompt cache.
+    """
+    return {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            "requests_by_stage": {stage: 0 for stage in STAGES}}
+
+
+def _count_call(state, stage, messages, result):
+    stats = state["stats"]
+    usage = result.get("usage") or {}
+    stats["requests"] += 1
+    stats["requests_by_stage"][stage] += 1
+    stats["prompt_tokens"] += usage.get("prompt_tokens") or sum(len(m or "") for m in messages) // 4
+    stats["completion_tokens"] += usage.get("completion_tokens") or len(result.get("content") or "") // 4
+    stats["cached_tokens"] += usage.get("cached_tokens") or 0
+
+
+def plan_chunks(items, builders, model, chunk_size=None):
+    """
+    Splits batch items into chunks: fixed-size when chunk_size is given,
+    otherwise packed so each chunk's stage-1 prompt and expected output fit
+    the token budget.
+    """
+    if chunk_size:
+        return chunk_jobs(items, chunk_size)
+
+    def measure(chunk):
+        return token_budget.count_messages(builders[1]([item.job for item in chunk], [], []), model)
+    return token_budget.pack_items(items, measure)
+
+
+def _new_chunk_state(batch, keys, kind, mode=MODE_SEQUENTIAL, stats=None, checkpoint=None, guard=None):
+    return {
+        "kind": kind,
+        "mode": mode,
+        "stats": stats if stats is not None else new_stats(),
+        "checkpoint": checkpoint,
+        # dedup_index.DuplicateGuard shared by the run's chunks (None = off)
+        "guard": guard,
+        "batch": batch,
+        "keys": keys,
+        "raw": {stage: [] for stage in STAGES},
+        "errors": []
+    }
+
+
+def _stage_inputs(state, stage, subset=None):
+    """
+    Returns (items, jobs, stage1, stage2) for the chunk's items that are ready
+    for a stage, i.e. all previous stages produced an output for them and
+    this one has not (e.g. restored from a checkpoint).
+    subset limits this to the given item keys.
+    """
+    items = [item for item in state["batch"].ready_for(stage, subset if subset is not None else state["keys"])
+             if item.output(stage) is None]
+    jobs, s1, s2 = _builder_args(items)
+    return items, jobs, s1, s2
+
+
+def _builder_args(items):
+    """
+    (jobs, stage1, stage2) lists for a stage builder. Stage 2 is the
+    prefiltered candidate set where the stage-3 prefilter has run.
+    """
+    jobs = [item.job for item in items]
+    s1 = [item.stage1 for item in items]
+    s2 = [item.stage3_candidates() for item in items]
+    return jobs, s1, s2
+
+
+def _prefilter_stage3(state, items):
+    """
+    Removes obvious reject candidates before stage 3 and records each drop
+    in the ledger. Items left with exactly the distractors needed are
+    completed locally, items left with too few are dropped; neither is
+    sent to the model. Returns the items that still need the stage-3 call.
+    """
+    if not distractor_rules.PREFILTER_SETTINGS["enabled"]:
+        return items
+
+    needed = distractor_rules.PREFILTER_SETTINGS["distractors_needed"]
+    pending = []
+    for item in items:
+        kept, dropped = distractor_rules.prefilter_candidates(
+            state["kind"], distractor_rules.get_candidates(item.stage2), item.stage1.get("Correct Answer", "")
+        )
+        for candidate, reason in dropped:
+            item.notes.append(f"Stage 3: dropped candidate '{candidate}' ({reason})")
+        item.prefiltered = distractor_rules.filtered_stage2_item(item.stage2, kept)
+
+        if len(kept) < needed:
+            item.mark(3, batch_data.STATUS_MALFORMED, f"only {len(kept)} usable candidates after prefilter")
+        elif len(kept) == needed and distractor_rules.PREFILTER_SETTINGS["select_locally"]:
+            item.set_output(3, distractor_rules.local_selection(item.stage1, kept, dropped))
+            item.mark(3, batch_data.STATUS_OK, "selected locally")
+        else:
+            pending.append(item)
+    return pending
+
+
+def _accept(item, stage, output, guard=None):
+    """
+    Stores one stage output on an item if it is usable. With a guard,
+    stage-1 sentences that are near-duplicates are rejected too, so they
+    are regenerated before stages 2-3 are paid for.
+    Returns True if it was stored.
+    """
+    problem = output_formatter.validate_stage_item(stage, output)
+    if problem:
+        item.mark(stage, batch_data.STATUS_MALFORMED, problem)
+        return False
+    if stage == 1 and guard is not None:
+        duplicate = guard.check(output.get("Complete Sentence"))
+        if duplicate:
+            text, score, source = duplicate
+            item.mark(stage, batch_data.STATUS_DUPLICATE,
+                      f"near-duplicate ({score:.2f}) of {source} sentence '{text}'")
+            item.rejected.append(output.get("Complete Sentence"))
+            return False
+    item.set_output(stage, output)
+    item.mark(stage, batch_data.STATUS_OK)
+    return True
+
+
+def _stage_kwargs(state, stage, llm_kwargs):
+    """
+    llm_service arguments for a stage call. Responses are not cached
+    automatically (see store_in_cache). With the duplicate check on, stage 1
+    is never read from the cache: a cached stem was indexed when it was
+    first accepted, so it would only be rejected as a duplicate of itself.
+    """
+    kwargs = dict(llm_kwargs, cache_result=False)
+    if stage == 1 and state["guard"] is not None:
+        kwargs["use_cache"] = False
+    return kwargs
+
+
+def _exclude_rejected(messages, items):
+    """
+    Adds the stage-1 sentences already rejected as near-duplicates for
+    these items to the end of the prompt, so the regeneration does not
+    write them again. Appending keeps the shared prompt prefix.
+    """
+    rejected = [text for item in items for text in item.rejected]
+    if not rejected:
+        return messages
+    system_msg, user_msg = messages
+    return system_msg, (
+        user_msg + "\nDO NOT REUSE these sentences (too similar to existing questions); write new ones:\n"
+        + "\n".join(f"- {text}" for text in rejected) + "\n"
+    )
+
+
+def _place_items(state, stage, items, outputs, missing_status=batch_data.STATUS_MISSING):
+    """
+    Joins stage outputs onto the items by Item Number and records every
+    item's outcome in the ledger. Malformed outputs are not stored.
+    """
+    expected = [batch_data.item_key(item.job.get('job_id')) if stage == 1 else item.item_number
+                for item in items]
+    for item, output in zip(items, batch_data.align_items(expected, outputs)):
+        if item.output(stage) is not None:
+            continue
+        if output is None:
+            item.mark(stage, missing_status)
+        else:
+            _accept(item, stage, output, state["guard"])
+
+
+def _store_stage_output(state, stage, items, raw):
+    """
+    Parses a stage response into the chunk state.
+    Returns False if the response could not be parsed.
+    """
+    state["raw"][stage].append(raw)
+    outputs, error = output_formatter.parse_stage_array(raw)
+    if error:
+        for item in items:
+            item.mark(stage, batch_data.STATUS_FAILED, error)
+        return False
+    _place_items(state, stage, items, outputs)
+    return True
+
+
+def _select_scored_stage3(state, items):
+    """
+    Combined mode: picks each item's final distractors from its scored
+    candidates locally instead of calling the model for stage 3.
+    """
+    for item in items:
+        selection, dropped = distractor_rules.select_scored(state["kind"], item.stage1, item.stage2)
+        for candidate, reason in dropped:
+            item.notes.append(f"Stage 3: dropped candidate '{candidate}' ({reason})")
+        if selection is None:
+            item.mark(3, batch_data.STATUS_MALFORMED, "fewer than 3 acceptable candidates")
+        else:
+            item.set_output(3, selection)
+            item.mark(3, batch_data.STATUS_OK, "scored locally")
+
+
+async def _call_stage(state, stage, items, builders, semaphore, llm_kwargs):
+    """
+    Calls one stage for the given items and follows up only on the
+    items that did not come back usable:
+    - cut off by max_tokens: complete items are kept and the rest are
+      resubmitted (up to MAX_CONTINUATIONS times)
+    - missing, malformed or failed: targeted retry (up to MAX_ITEM_RETRIES)
+    Returns False if nothing usable came back.
+    """
+    pending = items
+    continuations = 0
+    retries = 0
+    # A response is only cached once an item from it has been accepted
+    call_kwargs = _stage_kwargs(state, stage, llm_kwargs)
+
+    while pending:
+        jobs, s1, s2 = _builder_args(pending)
+        messages = builders[stage](jobs, s1, s2)
+        if stage == 1:
+            messages = _exclude_rejected(messages, pending)
+        for item in pending:
+            item.attempts += 1
+        async with semaphore:
+            result = await llm_service.async_complete(messages, **call_kwargs)
+        _count_call(state, stage, messages, result)
+
+        truncated = llm_service.is_truncated(result)
+        if truncated:
+            state["raw"][stage].append(result["content"])
+            _place_items(state, stage, pending, output_formatter.salvage_array_items(result["content"]),
+                         missing_status=batch_data.STATUS_TRUNCATED)
+        else:
+            _store_stage_output(state, stage, pending, llm_service.result_text(result))
+        if any(item.output(stage) is not None for item in pending):
+            await llm_service.async_store_in_cache(messages, result, model=llm_kwargs["model"])
+
+        pending = [item for item in pending if item.output(stage) is None]
+        if not pending:
+            break
+        # Continuations and retries must not replay the response just rejected
+        call_kwargs["use_cache"] = False
+        if truncated and continuations < MAX_CONTINUATIONS:
+            continuations += 1
+        elif not truncated and retries < MAX_ITEM_RETRIES:
+            retries += 1
+        else:
+            break
+
+    if pending:
+        state["errors"].append(
+            f"Stage {stage}: {len(pending)} items failed "
+            f"({', '.join(str(item.job['job_id']) for item in pending)})"
+        )
+    return any(item.output(stage) is not None for item in items)
+
+
+def _merge_chunks(batch, states):
+    """
+    Collects chunk results. "batch" holds every job with its keyed stage
+    outputs; the stage lists are parallel to job_list (None = missing).
+    """
+    result = {
+        "batch": batch,
+        "jobs": [item.job for item in batch],
+        "stage1": batch.stage_list(1),
+        "stage2": batch.stage_list(2),
+        "stage3": batch.stage_list(3),
+        "ledger": batch.ledger(),
+        "raw": {stage: [] for stage in STAGES},
+        "errors": [],
+        "stats": states[0]["stats"] if states else new_stats(),
+        "chunk_sizes": [len(state["keys"]) for state in states]
+    }
+    for number, state in enumerate(states, start=1):
+        for stage in STAGES:
+            result["raw"][stage].extend(state["raw"][stage])
+        for error in state["errors"]:
+            result["errors"].append(f"Chunk {number}: {error}")
+    return result
+
+
+def new_progress(total):
+    """
+    Creates the progress record updated by a running pipeline.
+    "stage1".."stage3" count items that finished each stage; "finished"
+    counts items that are fully done (assembled or dropped).
+    """
+    return {"total": total, "stage1": 0, "stage2": 0, "stage3": 0, "finished": 0}
+
+
+def _record_progress(progress, stage, items):
+    if progress is None:
+        return
+    completed = sum(1 for item in items if item.output(stage) is not None)
+    progress[f"stage{stage}"] += completed
+    # Items that came back at stage 3, or dropped out at this stage, are done
+    if stage == 3:
+        progress["finished"] += len(items)
+    else:
+        progress["finished"] += len(items) - completed
+
+
+def _save_checkpoint(state, stage, items):
+    if state["checkpoint"]:
+        checkpoint_store.save(state["checkpoint"], stage, items)
+
+
+def _restore_checkpoint(batch, checkpoint, progress):
+    """
+    Puts saved stage outputs back on the batch items (see checkpoint_store)
+    and counts them as done in progress.
+    """
+    for key, outputs in checkpoint_store.load(checkpoint, batch).items():
+        item = batch.get(key)
+        for stage, output in outputs.items():
+            item.set_output(stage, output)
+            item.mark(stage, batch_data.STATUS_OK, "restored from checkpoint")
+            if progress is not None:
+                progress[f"stage{stage}"] += 1
+        if progress is not None and item.is_complete():
+            progress["finished"] += 1
+
+
+async def _run_stages(state, stages, subset, builders, semaphore, progress, llm_kwargs):
+    """
+    Runs the given stages in order for the subset of a chunk's items.
+    Items without a usable output at one stage drop out of the later ones;
+    items restored from a checkpoint join at their first missing stage.
+    """
+    for stage in stages:
+        items, jobs, s1, s2 = _stage_inputs(state, stage, subset)
+        if not jobs:
+            continue
+
+        if stage == 3 and state["mode"] == MODE_COMBINED:
+            _select_scored_stage3(state, items)
+            _record_progress(progress, stage, items)
+            _save_checkpoint(state, stage, items)
+            continue
+
+        pending = _prefilter_stage3(state, items) if stage == 3 else items
+        if pending:
+            await _call_stage(state, stage, pending, builders, semaphore, llm_kwargs)
+        _record_progress(progress, stage, items)
+        _save_checkpoint(state, stage, items)
+
+
+async def _run_chunk(state, builders, semaphore, progress, llm_kwargs):
+    """
+    Moves one chunk through stages 1 -> 2 -> 3 as soon as each stage returns,
+    without waiting for the other chunks.
+    """
+    await _run_stages(state, STAGES, None, builders, semaphore, progress, llm_kwargs)
+
+
+async def _run_chunk_streaming(state, builders, semaphore, progress, llm_kwargs, group_size):
+    """
+    Streams stage 1 for a chunk and sends every `group_size` finished stems
+    on to stages 2 and 3 while the rest of stage 1 is still being generated.
+    """
+    chunk_items = state["batch"].subset(state["keys"])
+    # Items restored from a checkpoint with their stem skip the stage-1 call
+    items = [item for item in chunk_items if item.stage1 is None]
+    # Open slots by the job_id the model is asked to echo as Item Number
+    open_slots = {}
+    for item in items:
+        open_slots.setdefault(batch_data.item_key(item.job.get('job_id')), []).append(item)
+    ready = []
+    tasks = []
+    # Every output place() was given, accepted or rejected
+    emitted = []
+
+    def launch(group):
+        # Stems are checkpointed before their stage-2 outputs can be
+        _save_checkpoint(state, 1, state["batch"].subset(group))
+        tasks.append(asyncio.ensure_future(
+            _run_stages(state, (2, 3), group, builders, semaphore, progress, llm_kwargs)
+        ))
+
+    def take_slot(output):
+        slots = open_slots.get(batch_data.item_key(output.get("Item Number")))
+        if not slots:
+            # Unknown number: take the next open slot in job order
+            slots = next((s for s in open_slots.values() if s), None)
+        if not slots:
+            return None
+        return slots.pop(0)
+
+    def place(output):
+        emitted.append(output)
+        if not isinstance(output, dict):
+            return
+        item = take_slot(output)
+        if item is None:
+            return
+        if not _accept(item, 1, output, state["guard"]):
+            return
+        ready.append(item.key)
+        if progress is not None:
+            progress["stage1"] += 1
+        if len(ready) >= group_size:
+            launch(ready[:])
+            ready.clear()
+
+    restored = [item.key for item in chunk_items if item.stage1 is not None and not item.is_complete()]
+    if restored:
+        tasks.append(asyncio.ensure_future(
+            _run_stages(state, (2, 3), restored, builders, semaphore, progress, llm_kwargs)
+        ))
+    if not items:
+        await asyncio.gather(*tasks)
+        return
+
+    for item in items:
+        item.attempts += 1
+    async with semaphore:
+        messages = builders[1]([item.job for item in items], [], [])
+        result = await llm_service.async_stream_llm(messages, on_item=place, **_stage_kwargs(state, 1, llm_kwargs))
+    _count_call(state, 1, messages, result)
+    truncated = llm_service.is_truncated(result)
+    raw = llm_service.result_text(result)
+    state["raw"][1].append(result["content"] if truncated else raw)
+
+    # Items the streaming parser could not see (e.g. a bare single object).
+    # Outputs it already emitted are never placed again, even if rejected,
+    # so a rejected stem cannot drift into another job's open slot.
+    if not result["error"] and not truncated and any(item.stage1 is None for item in items):
+        outputs, _ = output_formatter.parse_stage_array(raw)
+        for output in outputs or []:
+            if output not in emitted:
+                place(output)
+    if ready:
+        launch(ready[:])
+    if any(item.stage1 is not None for item in items):
+        await llm_service.async_store_in_cache(messages, result, model=llm_kwargs["model"])
+
+    missing = [item for item in items if item.stage1 is None]
+    if missing:
+        if result["error"]:
+            status = batch_data.STATUS_FAILED
+        elif truncated:
+            status = batch_data.STATUS_TRUNCATED
+        else:
+            status = batch_data.STATUS_MISSING
+        for item in missing:
+            if item.status[1] == batch_data.STATUS_SKIPPED:
+                item.mark(1, status)
+        # Follow up only on the items that never arrived usable, without the
+        # cache: for a fully rejected chunk the follow-up prompt is the same
+        tasks.append(asyncio.ensure_future(
+            _run_stages(state, STAGES, [item.key for item in missing], builders, semaphore, progress,
+                        dict(llm_kwargs, use_cache=False))
+        ))
+
+    await asyncio.gather(*tasks)
+
+
+def failed_items(results):
+    """
+    Lists ledger entries of jobs that did not make it through stage 3,
+    as (job_id, stage, status, notes) tuples for reporting.
+    """
+    failures = []
+    for entry in results.get("ledger", []):
+        for stage in STAGES:
+            status = entry[f"stage{stage}"]
+            if status != batch_data.STATUS_OK:
+                failures.append((entry["job_id"], stage, status, "; ".join(entry["notes"])))
+                break
+    return failures
+
+
+async def run_pipeline(job_list, kind, api_key, context=None, chunk_size=None,
+                       concurrency=llm_service.DEFAULT_CONCURRENCY, model=llm_service.DEFAULT_MODEL,
+                       timeout=None, progress=None, use_cache=True, stream=True,
+                       stream_group_size=DEFAULT_STREAM_GROUP_SIZE, mode=MODE_SEQUENTIAL, checkpoint=None,
+                       dedup=None, semaphore=None, guard=None):
+    """
+    Runs the 3-stage pipeline over job_list in parallel chunks.
+
+    Every chunk is its own task: it moves on to stage 2 as soon as its own
+    stage-1 output is parsed, and to stage 3 as soon as its stage-2 output
+    is parsed, so the stages of different chunks overlap. With stream=True,
+    stage 1 is streamed and stems go on to stage 2 in groups of
+    stream_group_size while the rest of the chunk is still being written.
+    Chunks are sized from prompt token counts (see token_budget: tiktoken,
+    or characters / 4 when its encoding files cannot be loaded) unless
+    chunk_size is given. At most `concurrency` requests are in flight; runs
+    started together can share that limit by passing one asyncio.Semaphore
+    as `semaphore`. A chunk that fails a stage drops out without affecting
+    the other chunks. Stage-3 candidates go through distractor_rules first;
+    items it can settle skip the call.
+    mode=MODE_COMBINED replaces stages 2 and 3 with one scored-candidate
+    call and local selection. use_cache=False bypasses the response cache
+    (forces fresh generations). With a checkpoint scope (see
+    checkpoint_store.list_scope), saved stage outputs are restored first and
+    every stage output is saved as soon as its chunk finishes the stage;
+    items that are already complete make no calls at all.
+    dedup (default: dedup_index.DEDUP_SETTINGS["enabled"]) rejects stage-1
+    sentences that are near-duplicates of indexed questions or of earlier
+    sentences in the run; rejected items are regenerated like malformed ones,
+    and the sentences of completed items are added to the index. With dedup
+    on, stage 1 is always generated fresh (not read from the cache). Runs
+    started together can share one dedup_index.DuplicateGuard as `guard`.
+    Returns a dict with the keyed batch_data.Batch ("batch"), stage lists
+    parallel to job_list (None = missing), raw responses, per-chunk errors
+    and call stats.
+    """
+    builders = get_stage_builders(kind, context, mode)
+    batch = batch_data.Batch(job_list)
+    if checkpoint:
+        _restore_checkpoint(batch, checkpoint, progress)
+    if dedup is None:
+        dedup = dedup_index.DEDUP_SETTINGS["enabled"]
+    if not dedup:
+        guard = None
+    elif guard is None:
+        guard = dedup_index.DuplicateGuard()
+    stats = new_stats()
+    pending = [item for item in batch if not item.is_complete()]
+    states = [_new_chunk_state(batch, [item.key for item in chunk], kind, mode, stats, checkpoint, guard)
+              for chunk in plan_chunks(pending, builders, model, chunk_size)]
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+    llm_kwargs = {"api_key": api_key, "model": model, "timeout": timeout, "use_cache": use_cache}
+
+    if stream:
+        runs = (_run_chunk_streaming(state, builders, semaphore, progress, llm_kwargs, max(1, stream_group_size))
+                for state in states)
+    else:
+        runs = (_run_chunk(state, builders, semaphore, progress, llm_kwargs) for state in states)
+    await asyncio.gather(*runs)
+
+    if dedup:
+        dedup_index.add([item.stage1.get("Complete Sentence") for item in batch.completed()], source=kind)
+    return _merge_chunks(batch, states)
+
+
+def _add_stats(total, stats):
+    for key, value in stats.items():
+        if key == "requests_by_stage":
+            for stage, count in value.items():
+                total[key][stage] += count
+        else:
+            total[key] += value
+
+
+async def run_mixed_pipeline(job_list, api_key, progress=None, **kwargs):
+    """
+    Runs a job list with several question types and CEFR levels (e.g. from
+    test_planner.create_blueprint_jobs) as homogeneous sub-batches, see
+    test_planner.group_jobs. The sub-batches go through run_pipeline at the
+    same time and share one progress record, one `concurrency` limit and
+    one duplicate check, so near-duplicates across sub-batches are caught.
+    Returns run_pipeline results over all sub-batches, plus "sub_batches"
+    with the type, CEFR level and size of each.
+    """
+    groups = test_planner.group_jobs(job_list)
+    semaphore = asyncio.Semaphore(max(1, kwargs.pop("concurrency", llm_service.DEFAULT_CONCURRENCY)))
+    dedup = kwargs.pop("dedup", None)
+    if dedup is None:
+        dedup = dedup_index.DEDUP_SETTINGS["enabled"]
+    guard = dedup_index.DuplicateGuard() if dedup else None
+    outputs = await asyncio.gather(*(
+        run_pipeline(jobs, q_type, api_key, progress=progress, semaphore=semaphore, dedup=dedup, guard=guard, **kwargs)
+        for q_type, _, jobs in groups
+    ))
+
+    batch = batch_data.Batch.merge(output["batch"] for output in outputs)
+    result = {
+        "batch": batch,
+        "jobs": [item.job for item in batch],
+        "stage1": batch.stage_list(1),
+        "stage2": batch.stage_list(2),
+        "stage3": batch.stage_list(3),
+        "ledger": batch.ledger(),
+        "raw": {stage: [] for stage in STAGES},
+        "errors": [],
+        "stats": new_stats(),
+        "chunk_sizes": [],
+        "sub_batches": []
+    }
+    for (q_type, cefr, jobs), output in zip(groups, outputs):
+        for stage in STAGES:
+            result["raw"][stage].extend(output["raw"][stage])
+        result["errors"].extend(f"{q_type} {cefr}: {error}" for error in output["errors"])
+        _add_stats(result["stats"], output["stats"])
+        result["chunk_sizes"].extend(output["chunk_sizes"])
+        result["sub_batches"].append({"type": q_type, "cefr": cefr, "size": len(jobs)})
+    return result
+
+
+def start_pipeline(job_list, kind, api_key, **kwargs):
+    """
+    Starts run_pipeline (run_mixed_pipeline for KIND_MIXED) on the
+    llm_service loop without blocking.
+    Returns (future, progress); see wait_for_pipeline.
+    """
+    progress = new_progress(len(job_list))
+    if kind == KIND_MIXED:
+        run = run_mixed_pipeline(job_list, api_key, progress=progress, **kwargs)
+    else:
+        run = run_pipeline(job_list, kind, api_key, progress=progress, **kwargs)
+    future = llm_service.submit(run)
+    return future, progress
+
+
+def wait_for_pipeline(future, progress, on_update=None, poll_interval=0.25):
+    """
+    Polls a started pipeline from the calling (e.g. Streamlit script) thread,
+    calling on_update(progress) on every tick, and returns its result.
+    """
+    while not future.done():
+        if on_update:
+            on_update(progress)
+        time.sleep(poll_interval)
+    if on_update:
+        on_update(progress)
+    return future.result()
+
+
+def run_pipeline_sync(job_list, kind, api_key, **kwargs):
+    """
+    Blocking wrapper that runs run_pipeline on the llm_service loop.
+    """
+    return llm_service.submit(run_pipeline(job_list, kind, api_key, **kwargs)).result()
+
+
+# -----------------------------------------------------------------
+# Headless Batch API (no Streamlit)
+# -----------------------------------------------------------------
+# run_batch is shared by the generator tabs and the command line:
+#
+#   python pipeline.py vocab_list.csv --kind vocabulary --cefr B1 --output questions.jsonl
+#
+# config holds run_pipeline options plus the api_key and an optional
+# on_update(progress) callback; missing keys fall back to BATCH_DEFAULTS.
+BATCH_DEFAULTS = {
+    "api_key": None,
+    "context": None,
+    "model": llm_service.DEFAULT_MODEL,
+    "mode": MODE_SEQUENTIAL,
+    "chunk_size": None,
+    "concurrency": llm_service.DEFAULT_CONCURRENCY,
+    "timeout": None,
+    "use_cache": True,
+    "stream": True,
+    "checkpoint": None,
+    "dedup": None,
+    "on_update": None
+}
+
+
+def assemble_question(kind, item):
+    """
+    Final question row for a completed BatchItem: the stem with the answer
+    blanked out, the answer as option A and the three distractors.
+    """
+    stage1_data, stage3_data = item.stage1, item.stage3
+    correct_answer = stage1_data.get("Correct Answer", "")
+    question = {
+        "Question Prompt": stage1_data.get("Complete Sentence", "").replace(correct_answer, "____"),
+        "Answer A": correct_answer,
+        "Answer B": stage3_data.get("Selected Distractor A", ""),
+        "Answer C": stage3_data.get("Selected Distractor B", ""),
+        "Answer D": stage3_data.get("Selected Distractor C", ""),
+        "Correct Answer": "A"
+    }
+
+    if kind == KIND_VOCAB_LIST:
+        return {"ConceptID": item.job['job_id'], "Base Vocabulary Item": item.job['target_vocabulary'], **question}
+    if kind == KIND_GRAMMAR_LIST:
+        return {"ConceptID": item.job['job_id'], "Base Grammar Item": item.job['base_grammar'],
+                "Subtype": item.job['subtype'], **question}
+    return {
+        "Item Number": stage1_data.get("Item Number", ""),
+        "Assessment Focus": stage1_data.get("Assessment Focus", ""),
+        **question,
+        "CEFR rating": stage1_data.get("CEFR rating", ""),
+        "Category": stage1_data.get("Category", "")
+    }
+
+
+def assemble_questions(results, kind):
+    """
+    Question rows for every completed item of a pipeline run, in job order.
+    Stems and distractors are joined by item key, never by position.
+    Items of a KIND_MIXED run are assembled by their own job type.
+    """
+    return [assemble_question(item.job['type'] if kind == KIND_MIXED else kind, item)
+            for item in results["batch"].completed()]
+
+
+def run_batch(job_list, kind, config=None):
+    """
+    Runs a batch through the pipeline and assembles the questions, without
+    any UI. Blocks until the batch is done, calling config["on_update"]
+    with the progress dict while it runs.
+    Returns the run_pipeline results plus "questions" (assembled rows).
+    """
+    settings = dict(BATCH_DEFAULTS, **(config or {}))
+    api_key = settings.pop("api_key")
+    on_update = settings.pop("on_update")
+
+    future, progress = start_pipeline(job_list, kind, api_key, **settings)
+    results = wait_for_pipeline(future, progress, on_update=on_update)
+    results["questions"] = assemble_questions(results, kind)
+    return results
+
+
+def _run_shard(args):
+    """
+    Worker process entry point for run_batch_parallel. Returns only the
+    picklable parts of the results.
+    """
+    job_list, kind, config = args
+    results = run_batch(job_list, kind, config)
+    return {key: results[key] for key in ("questions", "ledger", "errors", "stats")}
+
+
+def run_batch_parallel(job_list, kind, config=None, workers=1):
+    """
+    Splits a large batch into `workers` consecutive shards and runs each
+    with run_batch in its own process (each with its own event loop and
+    connection pool). Workers are spawned, not forked: a forked child would
+    inherit a handle to the llm_service loop without the thread running it.
+    Returns {"questions", "ledger", "errors", "stats"}
+    combined over the shards, in job order.
+    """
+    config = dict(config or {}, on_update=None)
+    workers = max(1, min(workers, len(job_list)))
+    shard_size = -(-len(job_list) // workers) if job_list else 1
+    shards = [(shard, kind, config) for shard in chunk_jobs(job_list, shard_size)]
+
+    if workers == 1:
+        outputs = [_run_shard(shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            outputs = list(executor.map(_run_shard, shards))
+
+    combined = {"questions": [], "ledger": [], "errors": [], "stats": new_stats()}
+    for output in outputs:
+        for key in ("questions", "ledger", "errors"):
+            combined[key].extend(output[key])
+        _add_stats(combined["stats"], output["stats"])
+    return combined
+
+
+def write_questions(questions, path):
+    """
+    Writes question rows to path: JSON Lines for .jsonl, CSV otherwise.
+    """
+    if path.lower().endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for question in questions:
+                f.write(json.dumps(question, ensure_ascii=False) + "\n")
+    else:
+        pd.DataFrame(questions).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate questions from a vocabulary or grammar list CSV.")
+    parser.add_argument("input", help="vocabulary or grammar list CSV")
+    parser.add_argument("--kind", required=True, choices=("vocabulary", "grammar"))
+    parser.add_argument("--output", default="questions.csv", help=".csv or .jsonl")
+    parser.add_argument("--cefr", default="B1")
+    parser.add_argument("--question-form", default="Random Mix")
+    parser.add_argument("--no-definitions", action="store_true", help="leave definitions out of vocabulary prompts")
+    parser.add_argument("--start-row", type=int, default=1, help="first row to use (1-based)")
+    parser.add_argument("--end-row", type=int, default=None, help="last row to use (inclusive)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--concurrency", type=int, default=llm_service.DEFAULT_CONCURRENCY,
+                        help="requests in flight per worker")
+    parser.add_argument("--model", default=llm_service.DEFAULT_MODEL)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="neither restore nor save stage checkpoints (see checkpoint_store)")
+    parser.add_argument("--skip-accepted", action="store_true",
+                        help="leave out ConceptIDs that already have an accepted question")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or OPENAI_API_KEY)")
+
+    list_df = pd.read_csv(args.input)
+    if args.kind == "vocabulary":
+        kind, required = KIND_VOCAB_LIST, test_planner.VOCAB_LIST_COLUMNS
+    else:
+        kind, required = KIND_GRAMMAR_LIST, test_planner.GRAMMAR_LIST_COLUMNS
+    missing = test_planner.missing_columns(list_df, required)
+    if missing:
+        parser.error(f"{args.input} is missing required columns: {', '.join(missing)}")
+
+    selected = list_df.iloc[args.start_row - 1:args.end_row]
+    if kind == KIND_VOCAB_LIST:
+        job_list, skipped = test_planner.create_vocab_list_jobs(selected, args.cefr, not args.no_definitions)
+        # The whole list is the distractor pool, not just the selected rows
+        context = {"question_form": args.question_form, "vocab_df": list_df}
+    else:
+        job_list, skipped = test_planner.create_grammar_list_jobs(selected, args.cefr)
+        context = {"question_form": args.question_form}
+    for message in skipped:
+        print(message)
+
+    checkpoint = None if args.no_checkpoint else checkpoint_store.list_scope(kind, args.question_form)
+    if checkpoint and args.skip_accepted:
+        accepted = set(checkpoint_store.accepted_ids(checkpoint, job_list))
+        job_list = [job for job in job_list if job['job_id'] not in accepted]
+        print(f"Skipping {len(accepted)} ConceptIDs that already have accepted questions")
+
+    config = {
+        "api_key": args.api_key,
+        "context": context,
+        "model": args.model,
+        "concurrency": args.concurrency,
+        "use_cache": not args.no_cache,
+        "checkpoint": checkpoint
+    }
+    start = time.perf_counter()
+    results = run_batch_parallel(job_list, kind, config, workers=args.workers)
+    for error in results["errors"]:
+        print(error)
+
+    write_questions(results["questions"], args.output)
+    stats = results["stats"]
+    print(f"Wrote {len(results['questions'])} of {len(job_list)} questions to {args.output} "
+          f"in {time.perf_counter() - start:.1f}s ({stats['requests']} API requests)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,49 +2,160 @@ import json
 import random
 import pandas as pd
 import re
+import weakref
+import zlib
+
+import batch_data
+import inflector
+import semantic_index
+import token_budget
+
+# --------------------------------------------------------------------------
+# Prompt Layout (provider-side prompt caching)
+# --------------------------------------------------------------------------
+# OpenAI caches the longest prompt prefix it has already seen (from 1024
+# tokens on) and bills it at a discount with a faster first token. Every
+# builder therefore keeps its system message and the start of its user
+# message identical across chunks: rules, output schema and style examples
+# come first, and the counts and per-chunk data go in the TASK block at the
+# end. For the same reason style examples are drawn with a fixed seed per
+# type and CEFR level (see example_seed).
+
+def example_seed(job):
+    """
+    Stable sampling seed for a job's style examples.
+    """
+    return zlib.crc32(f"{job['type']}|{job['cefr']}".encode("utf-8"))
 
 # --------------------------------------------------------------------------
 # Helper: Get Examples
 # --------------------------------------------------------------------------
-def get_few_shot_examples(job, example_banks):
+EXAMPLE_FIELDS = ["Question Prompt", "Answer A", "Answer B", "Answer C", "Answer D", "Correct Answer"]
+
+def normalize_focus(focus):
+    """
+    Lookup form of an assessment focus: lowercased, without parenthesised
+    examples, single-spaced ("Adverb of manner ('well')" -> "adverb of manner").
+    """
+    if not isinstance(focus, str):
+        return ""
+    return " ".join(_PARENS_RE.sub(" ", focus).lower().split())
+
+class ExampleIndex:
     """
-    Retrieves 2-3 examples from the CSV based on CEFR and Type.
+    Style examples of one bank (one question type), built once per bank:
+    every row is serialized to its prompt snippet up front and row
+    positions are grouped by CEFR level and by (CEFR level, focus).
+    """
+    def __init__(self, bank):
+        # Strip header whitespace without touching the shared dataframe
+        columns = {str(c).strip(): c for c in bank.columns}
+
+        def column(name):
+            if name in columns:
+                return bank[columns[name]].tolist()
+            return ["N/A"] * len(bank)
+
+        fields = {name: column(name) for name in EXAMPLE_FIELDS}
+        self.snippets = [
+            "### EXAMPLE:\n" + json.dumps({name: fields[name][i] for name in EXAMPLE_FIELDS}) + "\n\n"
+            for i in range(len(bank))
+        ]
+
+        # Without a CEFR column every lookup falls through to the whole bank
+        self.by_cefr = {}
+        self.by_focus = {}
+        if "CEFR rating" in columns:
+            cefrs = [str(c).strip() for c in column("CEFR rating")]
+            focuses = [normalize_focus(f) for f in column("Assessment Focus")]
+            for i, (cefr, focus) in enumerate(zip(cefrs, focuses)):
+                self.by_cefr.setdefault(cefr, []).append(i)
+                if focus:
+                    self.by_focus.setdefault((cefr, focus), []).append(i)
+
+    def __len__(self):
+        return len(self.snippets)
+
+    def examples(self, cefr, focus=None, count=2, seed=None):
+        """
+        Prompt snippets for `count` examples: same CEFR level and focus when
+        the bank has enough of them, else same CEFR level, else any level.
+        Returns "" if the bank is too small.
+        """
+        cefr = str(cefr).strip()
+        tiers = [
+            self.by_focus.get((cefr, normalize_focus(focus)), []),
+            self.by_cefr.get(cefr, []),
+            range(len(self.snippets))
+        ]
+
+        rng = random.Random(seed) if seed is not None else random
+        for rows in tiers:
+            if len(rows) >= count:
+                return "".join(self.snippets[i] for i in rng.sample(rows, count))
+        return ""
+
+
+_example_indexes = {}
+
+def get_example_index(bank):
+    """
+    Returns the ExampleIndex for an example bank dataframe, building it on
+    first use. The index lives as long as the dataframe does.
+    """
+    cached = _example_indexes.get(id(bank))
+    if cached is not None and cached[0]() is bank and len(cached[1]) == len(bank):
+        return cached[1]
+
+    index = ExampleIndex(bank)
+    _example_indexes[id(bank)] = (weakref.ref(bank), index)
+    weakref.finalize(bank, _example_indexes.pop, id(bank), None)
+    return index
+
+def get_few_shot_examples(job, example_banks, seed=None, count=2):
+    """
+    Retrieves `count` examples from the bank for the job's type, matched on
+    CEFR and assessment focus where possible (see ExampleIndex).
+    With a seed the same examples are returned on every call.
     """
     bank = example_banks.get(job['type'].lower())
     if bank is None or bank.empty: 
         return ""
-    
-    bank.columns = [c.strip() for c in bank.columns]
-    
-    if 'CEFR rating' in bank.columns:
-        relevant = bank[bank['CEFR rating'].astype(str).str.strip() == str(job['cefr']).strip()]
-    else:
-        relevant = bank
+    return get_example_index(bank).examples(job['cefr'], job.get('focus'), count=count, seed=seed)
 
-    if len(relevant) >= 2:
-        samples = relevant.sample(2)
-    elif len(bank) >= 2:
-        samples = bank.sample(2) 
-    else:
-        return "" 
-
-    output = ""
-    for _, row in samples.iterrows():
-        ex_dict = {
-            "Question Prompt": row.get("Question Prompt", "N/A"),
-            "Answer A": row.get("Answer A", "N/A"),
-            "Answer B": row.get("Answer B", "N/A"),
-            "Answer C": row.get("Answer C", "N/A"),
-            "Answer D": row.get("Answer D", "N/A"),
-            "Correct Answer": row.get("Correct Answer", "N/A")
-        }
-        output += "### EXAMPLE:\n" + json.dumps(ex_dict) + "\n\n"
-    return output
+# Most style examples one batch prompt may carry (a chunk can mix many foci)
+MAX_BATCH_EXAMPLES = 6
+
+def get_batch_examples(job_list, example_banks):
+    """
+    Style examples for a batch prompt, matched to every distinct assessment
+    focus in job_list: 2 for a single-focus batch, otherwise 1 per focus,
+    at most MAX_BATCH_EXAMPLES. Foci are taken in sorted order so chunks
+    with the same foci share the prompt prefix.
+    """
+    jobs_by_focus = {}
+    for job in job_list:
+        jobs_by_focus.setdefault((job['type'], job['cefr'], normalize_focus(job.get('focus'))), job)
+    count = 2 if len(jobs_by_focus) == 1 else 1
+
+    snippets = []
+    for key in sorted(jobs_by_focus):
+        job = jobs_by_focus[key]
+        snippet = get_few_shot_examples(job, example_banks, seed=example_seed(job), count=count)
+        # Foci without their own examples fall back to the same level-wide ones
+        if snippet and snippet not in snippets:
+            snippets.append(snippet)
+        if len(snippets) >= MAX_BATCH_EXAMPLES:
+            break
+    return "".join(snippets)
 
 # =============================================================================
 # HELPER FUNCTIONS FOR VOCABULARY SELECTION
 # =============================================================================
 
+# Parentheses and their content (belong (to) -> belong)
+_PARENS_RE = re.compile(r'\([^)]*\)')
+
 def clean_vocab_item(text):
     """
     Aggressively cleans vocabulary items for distractor generation.
@@ -59,10 +170,30 @@ def clean_vocab_item(text):
         text = text.split('/')[0]
         
     # Remove parentheses and content (belong (to) -> belong)
-    text = re.sub(r'\([^)]*\)', '', text)
+    text = _PARENS_RE.sub('', text)
     
     return text.strip()
 
+def clean_vocab_column(series):
+    """
+    Vectorized clean_vocab_item over a whole column (same rules, no
+    per-row Python calls). Non-string values become their str() form.
+    """
+    text = series.astype(str)
+    # Newer pandas keeps missing values as NA through astype(str)
+    missing = text.isna()
+    if missing.any():
+        text = text.mask(missing, series[missing].map(str))
+    return text.str.split('/', n=1).str[0].str.replace(_PARENS_RE, '', regex=True).str.strip()
+
+def first_word_column(cleaned):
+    """Vectorized get_first_word over an already cleaned column."""
+    return cleaned.str.split(n=1).str[0].fillna(cleaned)
+
+def initial_letter_column(cleaned):
+    """Vectorized get_initial_letter over an already cleaned column."""
+    return first_word_column(cleaned).str[0].str.lower().fillna('')
+
 def get_first_word(vocab_item):
     """Extract the first word from multi-word vocabulary items."""
     cleaned = clean_vocab_item(vocab_item)
@@ -88,86 +219,189 @@ def get_phonetic_similar_letters(letter):
     }
     return phonetic_groups.get(letter.lower(), [])
 
+class VocabIndex:
+    """
+    Precomputed lookup tables over an uploaded vocabulary list, built once
+    per upload so distractor selection does not re-scan the whole list for
+    every job:
+    - cleaned / lowercased form of every 'Base Vocabulary Item'
+    - row positions bucketed by part of speech and by initial letter
+    """
+    def __init__(self, vocab_df):
+        # Cleaned once for the whole column; reused by every lookup
+        self.cleaned = clean_vocab_column(vocab_df['Base Vocabulary Item'])
+        self.items = self.cleaned.tolist()
+        self.keys = self.cleaned.str.lower().tolist()
+
+        positions = pd.Series(range(len(vocab_df)))
+        pos = vocab_df['Part of Speech'].astype('string').str.lower().str.strip()
+        letters = initial_letter_column(self.cleaned)
+        self.by_pos = {key: rows.tolist() for key, rows in positions.groupby(pos.to_numpy()).indices.items()}
+        self.by_letter = {key: rows.tolist() for key, rows in positions.groupby(letters.to_numpy()).indices.items()}
+
+        # First row of each word, for looking up a target's own embedding
+        # and a candidate's part of speech
+        self.row_of = {}
+        for i, key in enumerate(self.keys):
+            self.row_of.setdefault(key, i)
+        self.pos = vocab_df['Part of Speech'].tolist()
+        if 'Definition' in vocab_df.columns:
+            self.definitions = vocab_df['Definition'].tolist()
+        else:
+            self.definitions = None
+        self._semantic = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, bucket, max_items, exclude=()):
+        """
+        Randomly picks up to max_items cleaned items from a bucket of row
+        positions, skipping items whose lowercased form is in exclude.
+        Draws only a few extra rows instead of filtering the whole bucket.
+        """
+        exclude = set(exclude)
+        draw = min(len(bucket), max_items + len(exclude))
+        picked = [i for i in random.sample(bucket, draw) if self.keys[i] not in exclude]
+
+        # Excluded words repeated in the bucket can starve the draw
+        if len(picked) < max_items and draw < len(bucket):
+            pool = [i for i in bucket if self.keys[i] not in exclude]
+            picked = random.sample(pool, min(max_items, len(pool)))
+
+        return [self.items[i] for i in picked[:max_items]]
+
+    def semantic(self):
+        """
+        The SemanticIndex over this list, embedded on first use.
+        """
+        if self._semantic is None:
+            self._semantic = semantic_index.SemanticIndex(self.items, self.definitions)
+        return self._semantic
+
+    def pos_of(self, item):
+        """
+        Part of speech listed for a (cleaned) item, or None if not in the list.
+        """
+        row = self.row_of.get(item.lower())
+        return self.pos[row] if row is not None else None
+
+
+_vocab_indexes = {}
+
+def get_vocab_index(vocab_df):
+    """
+    Returns the VocabIndex for a vocabulary dataframe, building it on first
+    use. The index lives as long as the dataframe does.
+    """
+    if isinstance(vocab_df, VocabIndex):
+        return vocab_df
+
+    cached = _vocab_indexes.get(id(vocab_df))
+    if cached is not None and cached[0]() is vocab_df and len(cached[1]) == len(vocab_df):
+        return cached[1]
+
+    index = VocabIndex(vocab_df)
+    _vocab_indexes[id(vocab_df)] = (weakref.ref(vocab_df), index)
+    weakref.finalize(vocab_df, _vocab_indexes.pop, id(vocab_df), None)
+    return index
+
+def get_clean_vocab_column(vocab_df):
+    """
+    Cleaned 'Base Vocabulary Item' column of a vocabulary dataframe,
+    computed once and cached with the dataframe's VocabIndex.
+    """
+    return get_vocab_index(vocab_df).cleaned
+
 def python_select_by_pos(vocab_df, target_vocab, target_pos, max_items=4):
     """
     Select distractors by matching part of speech.
+    Accepts the vocabulary dataframe or its VocabIndex.
     Returns CLEANED items.
     """
+    index = get_vocab_index(vocab_df)
     target_vocab_clean = clean_vocab_item(target_vocab).lower()
     target_pos_lower = target_pos.lower().strip()
     
-    # Filter by same part of speech
-    same_pos = vocab_df[
-        vocab_df['Part of Speech'].str.lower().str.strip() == target_pos_lower
-    ]
+    same_pos = index.by_pos.get(target_pos_lower, [])
+    return index.sample(same_pos, max_items, exclude=[target_vocab_clean])
+
+def python_select_by_similarity(vocab_df, target_vocab, target_pos, max_items=4, exclude_items=None):
+    """
+    Select distractors by part of speech, ranked by semantic closeness to the
+    target (nearest same-POS neighbours in the local embedding index).
+    Accepts the vocabulary dataframe or its VocabIndex.
+    Returns CLEANED items.
+    """
+    if exclude_items is None:
+        exclude_items = []
     
-    # Filter out target
-    same_pos = same_pos[
-        same_pos['Base Vocabulary Item'].apply(clean_vocab_item).str.lower() != target_vocab_clean
-    ]
+    index = get_vocab_index(vocab_df)
+    same_pos = index.by_pos.get(target_pos.lower().strip(), [])
+    if not same_pos:
+        return []
     
-    if len(same_pos) >= max_items:
-        selected = same_pos.sample(n=max_items)
+    semantic = index.semantic()
+    target_vocab_clean = clean_vocab_item(target_vocab)
+    row = index.row_of.get(target_vocab_clean.lower())
+    if row is not None:
+        query = semantic.vector(row)
     else:
-        selected = same_pos
+        query = semantic.embed(target_vocab_clean)
     
-    # Return cleaned items
-    return [clean_vocab_item(x) for x in selected['Base Vocabulary Item'].tolist()]
+    exclude_clean = {clean_vocab_item(x).lower() for x in exclude_items + [target_vocab]}
+    
+    def pick(ranked):
+        selected = []
+        seen = set(exclude_clean)
+        for i in ranked:
+            if index.keys[i] in seen:
+                continue
+            seen.add(index.keys[i])
+            selected.append(index.items[i])
+            if len(selected) >= max_items:
+                break
+        return selected
+    
+    # Only the top few are ranked; the full ranking is needed only when
+    # excluded or repeated words crowd out the nearest neighbours
+    selected = pick(semantic.nearest(query, same_pos, k=2 * max_items + len(exclude_clean)))
+    if len(selected) < max_items:
+        selected = pick(semantic.nearest(query, same_pos))
+    return selected
 
 def python_select_by_initial_letter(vocab_df, target_vocab, max_items=4, exclude_items=None):
     """
     Select distractors by matching initial letter of first word (with phonetic fallback).
+    Accepts the vocabulary dataframe or its VocabIndex.
     Returns CLEANED items.
     """
     if exclude_items is None:
         exclude_items = []
     
+    index = get_vocab_index(vocab_df)
     target_vocab_clean = clean_vocab_item(target_vocab)
     target_letter = get_initial_letter(target_vocab_clean)
     
-    # Helper to check letter match
-    def matches_initial_letter(vocab_item):
-        return get_initial_letter(vocab_item) == target_letter
-    
-    same_letter = vocab_df[
-        vocab_df['Base Vocabulary Item'].apply(matches_initial_letter)
-    ]
-    
     # Exclude target and already selected
     exclude_clean = [clean_vocab_item(x).lower() for x in exclude_items + [target_vocab]]
-    same_letter = same_letter[
-        ~same_letter['Base Vocabulary Item'].apply(clean_vocab_item).str.lower().isin(exclude_clean)
-    ]
+    same_letter = index.by_letter.get(target_letter, [])
     
     # Selection logic
-    if len(same_letter) >= max_items:
-        selected = same_letter.sample(n=max_items)
-        return [clean_vocab_item(x) for x in selected['Base Vocabulary Item'].tolist()]
+    candidates = index.sample(same_letter, max_items, exclude=exclude_clean)
+    if len(candidates) >= max_items:
+        return candidates
     
     # Fallback logic (Phonetic)
-    candidates = [clean_vocab_item(x) for x in same_letter['Base Vocabulary Item'].tolist()]
-    phonetic_letters = get_phonetic_similar_letters(target_letter)
-    
-    for phon_letter in phonetic_letters:
+    for phon_letter in get_phonetic_similar_letters(target_letter):
         if len(candidates) >= max_items:
             break
         
-        def matches_phonetic_letter(vocab_item):
-            return get_initial_letter(vocab_item) == phon_letter
-        
-        phonetic_matches = vocab_df[
-            vocab_df['Base Vocabulary Item'].apply(matches_phonetic_letter)
-        ]
-        
-        # Filter exclusions again
-        phonetic_matches = phonetic_matches[
-            ~phonetic_matches['Base Vocabulary Item'].apply(clean_vocab_item).str.lower().isin(exclude_clean + [c.lower() for c in candidates])
-        ]
-        
         needed = max_items - len(candidates)
-        if len(phonetic_matches) > 0:
-            additional = phonetic_matches.sample(n=min(needed, len(phonetic_matches)))
-            candidates.extend([clean_vocab_item(x) for x in additional['Base Vocabulary Item'].tolist()])
+        candidates.extend(index.sample(
+            index.by_letter.get(phon_letter, []), needed,
+            exclude=exclude_clean + [c.lower() for c in candidates]
+        ))
     
     return candidates[:max_items]
 
@@ -191,9 +425,9 @@ def create_vocab_list_stage1_prompt(job_list, question_form):
     
     form_instruction = question_form_instructions.get(question_form, question_form_instructions["Random Mix"])
     
-    system_msg = f"""You are an expert ELT content creator. You will generate exactly {len(job_list)} complete test questions in a single JSON response targeting specific vocabulary items.
+    system_msg = """You are an expert ELT content creator. You will generate complete test questions in a single JSON response targeting specific vocabulary items.
 
-CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array of exactly {len(job_list)} question objects."""
+CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array with exactly one question object per vocabulary target."""
     
     job_specs = []
     for job in job_list:
@@ -209,11 +443,6 @@ CRITICAL: Your entire response must be a JSON object with a "questions" key cont
         })
  
     user_msg = f"""
-TASK: Create exactly {len(job_list)} vocabulary test questions.
-
-VOCABULARY TARGETS:
-{json.dumps(job_specs, indent=2)}
-
 {form_instruction}
 
 GENERATION INSTRUCTIONS:
@@ -240,6 +469,11 @@ MANDATORY OUTPUT FORMAT:
     ... 
   ]
 }}
+
+TASK: Create exactly {len(job_list)} vocabulary test questions.
+
+VOCABULARY TARGETS:
+{token_budget.serialize(job_specs)}
 """
     return system_msg, user_msg
 
@@ -250,56 +484,71 @@ MANDATORY OUTPUT FORMAT:
 def create_vocab_list_stage2_prompt(job_list, stage1_outputs, vocabulary_list_df):
     """
     Generates candidates.
-    CRITICAL: Forces LLM to inflect the Python-selected candidates.
+    Python-selected candidates are inflected locally (inflector) to the form
+    of the Correct Answer where it can be detected; only the rest are left
+    for the LLM to adapt, plus the additional candidates needed.
     API FIX: System prompt now explicitly mentions 'JSON'.
     """
-    system_msg = f"""You are an expert ELT test designer. You will create exactly 8 candidate distractors for exactly {len(job_list)} questions in JSON format.
+    system_msg = """You are an expert ELT test designer. You will create exactly 8 candidate distractors for every question in JSON format.
     
 CRITICAL: You must ADAPT the input words to match the grammatical context of the sentences."""
     
     pre_selected_data = []
+    vocab_index = get_vocab_index(vocabulary_list_df)
     
-    for i, job in enumerate(job_list):
-        stage1_data = stage1_outputs[i]
+    for job, stage1_data, _ in batch_data.join_stage_outputs(job_list, stage1_outputs):
         target_vocab = clean_vocab_item(job['target_vocabulary'])
         target_pos = job['part_of_speech']
         
-        # PYTHON SELECTION (Cleaned items)
-        pos_selected = python_select_by_pos(
-            vocabulary_list_df, target_vocab, target_pos, max_items=4
+        # PYTHON SELECTION (Cleaned items): nearest same-POS neighbours first
+        pos_selected = python_select_by_similarity(
+            vocab_index, target_vocab, target_pos, max_items=4
         )
         
         letter_selected = python_select_by_initial_letter(
-            vocabulary_list_df, target_vocab, max_items=4, exclude_items=pos_selected
+            vocab_index, target_vocab, max_items=4, exclude_items=pos_selected
         )
         
         total_python = len(pos_selected) + len(letter_selected)
         needed_from_llm = max(0, 8 - total_python)
         
+        # LOCAL INFLECTION: match the form of the Correct Answer
+        form = inflector.detect_form(
+            target_vocab, stage1_data.get("Correct Answer"), target_pos, stage1_data.get("Complete Sentence")
+        )
+        ready, raw = [], []
+        for candidate in pos_selected + letter_selected:
+            inflected = None
+            if form is not None:
+                candidate_pos = target_pos if candidate in pos_selected else vocab_index.pos_of(candidate)
+                inflected = inflector.inflect_like(candidate, form, candidate_pos)
+            if inflected is None:
+                raw.append(candidate)
+            else:
+                ready.append(inflected)
+        
         pre_selected_data.append({
             "Item Number": stage1_data.get("Item Number"),
             "Target (Base)": target_vocab,
             "Complete Sentence": stage1_data.get("Complete Sentence"),
             "Correct Answer (In Sentence)": stage1_data.get("Correct Answer"),
-            "Raw Candidates (from Database)": pos_selected + letter_selected,
+            "Ready Candidates (already inflected)": ready,
+            "Raw Candidates (from Database)": raw,
             "Additional Candidates Needed": needed_from_llm
         })
     
     user_msg = f"""
-TASK: Create a final pool of exactly 8 candidates for each question.
 OUTPUT FORMAT: JSON
 
-INPUT DATA:
-{json.dumps(pre_selected_data, indent=2)}
-
 INSTRUCTIONS FOR CANDIDATE GENERATION:
 
 1. **SOURCE MATERIAL:** 
-   - Start with the "Raw Candidates (from Database)".
+   - Copy the "Ready Candidates (already inflected)" EXACTLY as given into the first candidate slots. Do NOT change them.
+   - Then add the "Raw Candidates (from Database)", adapted as described below.
    - Generate "Additional Candidates" to reach exactly 8 total.
    - Priority for additional candidates: Antonyms of target, then synonyms of the raw candidates.
 
-2. **MORPHOLOGICAL ADAPTATION (CRITICAL):** 
+2. **MORPHOLOGICAL ADAPTATION (CRITICAL, Raw and Additional Candidates only):** 
    - The "Raw Candidates" are in BASE DICTIONARY FORM (e.g., "burn", "slip").
    - You MUST CONJUGATE/MODIFY these words to match the "Correct Answer (In Sentence)".
    - **TENSE MATCHING:** If Correct Answer is "blew" (past), "burn" must become "burned".
@@ -334,6 +583,11 @@ MANDATORY OUTPUT FORMAT:
     ... 
   ]
 }}
+
+TASK: Create a final pool of exactly 8 candidates for each of these {len(pre_selected_data)} questions.
+
+INPUT DATA:
+{token_budget.serialize(pre_selected_data)}
 """
     return system_msg, user_msg
 
@@ -346,10 +600,10 @@ def create_vocab_list_stage3_prompt(job_list, stage1_outputs, stage2_outputs):
     STAGE THREE: Validation with MORPHOLOGICAL PARITY enforcement.
     API FIX: System prompt now explicitly mentions 'JSON'.
     """
-    system_msg = f"""You are an expert English vocabulary validator. You will filter candidate distractors using strict morphological rules. Output results in JSON format."""
+    system_msg = """You are an expert English vocabulary validator. You will filter candidate distractors using strict morphological rules. Output results in JSON format."""
     
     validation_input = []
-    for i, (job, s1, s2) in enumerate(zip(job_list, stage1_outputs, stage2_outputs)):
+    for job, s1, s2 in batch_data.join_stage_outputs(job_list, stage1_outputs, stage2_outputs):
         # Safe extraction of candidates list
         candidates = []
         if isinstance(s2, dict):
@@ -367,12 +621,8 @@ def create_vocab_list_stage3_prompt(job_list, stage1_outputs, stage2_outputs):
         })
     
     user_msg = f"""
-TASK: Validate candidates and select the final 3 distractors per question.
 OUTPUT FORMAT: JSON
 
-INPUT:
-{json.dumps(validation_input, indent=2)}
-
 VALIDATION PROTOCOL (Apply in Order):
 
 **STEP 1: MORPHOLOGICAL PARITY CHECK (The "Shape" Test)**
@@ -420,6 +670,11 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Validate candidates and select the final 3 distractors for each of these {len(validation_input)} questions.
+
+INPUT:
+{token_budget.serialize(validation_input)}
 """
     return system_msg, user_msg
 
@@ -430,10 +685,10 @@ MANDATORY OUTPUT FORMAT:
 
 def create_sequential_batch_stage1_prompt(job_list, example_banks):
     # This remains unchanged from your existing file
-    examples = get_few_shot_examples(job_list[0], example_banks) if job_list else ""
-    system_msg = f"""You are an expert ELT content creator. You will generate exactly {len(job_list)} complete test questions in a single JSON response. 
+    examples = get_batch_examples(job_list, example_banks)
+    system_msg = """You are an expert ELT content creator. You will generate complete test questions in a single JSON response. 
 
-CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array of exactly {len(job_list)} question objects. Do not generate fewer questions than requested."""
+CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array with exactly one question object per job specification. Do not generate fewer questions than requested."""
     
     job_specs = []
     has_grammar_distinction = False
@@ -463,13 +718,6 @@ CRITICAL: Your entire response must be a JSON object with a "questions" key cont
         constraint_instruction += "SEMANTIC EXCLUSIVITY RULE: Include semantic context clues."
 
     user_msg = f"""
-TASK: Create exactly {len(job_list)} complete, original test questions from scratch.
-
-JOB SPECIFICATIONS:
-{json.dumps(job_specs, indent=2)}
-
-{constraint_instruction}
-
 MANDATORY OUTPUT FORMAT:
 {{
   "questions": [
@@ -489,18 +737,19 @@ MANDATORY OUTPUT FORMAT:
 
 STYLE REFERENCE:
 {examples}
+TASK: Create exactly {len(job_list)} complete, original test questions from scratch.
+
+{constraint_instruction}
+
+JOB SPECIFICATIONS:
+{token_budget.serialize(job_specs)}
 """
     return system_msg, user_msg
 
 def create_sequential_batch_stage2_grammar_prompt(job_list, stage1_outputs):
-    system_msg = f"""You are an expert ELT test designer specializing in grammar assessment. You will generate candidate distractors for exactly {len(job_list)} grammar questions in a single JSON response with a "candidates" key."""
+    system_msg = """You are an expert ELT test designer specializing in grammar assessment. You will generate candidate distractors for every grammar question in a single JSON response with a "candidates" key."""
     
     user_msg = f"""
-TASK: Generate 5 candidate distractors for ALL {len(job_list)} GRAMMAR questions.
-
-INPUT FROM STAGE 1:
-{json.dumps(stage1_outputs, indent=2)}
-
 GENERATION INSTRUCTIONS:
 1. WORD COUNT LIMIT: Max 3 words.
 2. GRAMMATICAL PARALLELISM: Match word count and construction type of correct answer.
@@ -521,18 +770,18 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Generate 5 candidate distractors for ALL {len(job_list)} GRAMMAR questions.
+
+INPUT FROM STAGE 1:
+{token_budget.serialize(stage1_outputs)}
 """
     return system_msg, user_msg
 
 def create_sequential_batch_stage2_vocabulary_prompt(job_list, stage1_outputs):
-    system_msg = f"""You are an expert ELT test designer specializing in vocabulary assessment. You will generate candidate distractors for exactly {len(job_list)} vocabulary questions in a single JSON response with a "candidates" key."""
+    system_msg = """You are an expert ELT test designer specializing in vocabulary assessment. You will generate candidate distractors for every vocabulary question in a single JSON response with a "candidates" key."""
     
     user_msg = f"""
-TASK: Generate 5 candidate distractors for ALL {len(job_list)} VOCABULARY questions.
-
-INPUT FROM STAGE 1:
-{json.dumps(stage1_outputs, indent=2)}
-
 GENERATION INSTRUCTIONS:
 1. WORD COUNT LIMIT: Max 3 words.
 2. EXACT INFLECTIONAL FORM MATCHING: Candidates must match the grammatical form of the correct answer (e.g., if answer is "running", candidates must be gerunds).
@@ -552,27 +801,29 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Generate 5 candidate distractors for ALL {len(job_list)} VOCABULARY questions.
+
+INPUT FROM STAGE 1:
+{token_budget.serialize(stage1_outputs)}
 """
     return system_msg, user_msg
 
 def create_sequential_batch_stage3_grammar_prompt(job_list, stage1_outputs, stage2_outputs):
-    system_msg = f"""You are an expert English grammar validator. You will evaluate candidate distractors for exactly {len(job_list)} grammar questions and return your validated selections in a JSON object with a "validated" key."""
+    system_msg = """You are an expert English grammar validator. You will evaluate candidate distractors for every grammar question and return your validated selections in a JSON object with a "validated" key."""
     
     validation_input = []
-    for i, (job, s1, s2) in enumerate(zip(job_list, stage1_outputs, stage2_outputs)):
+    for job, s1, s2 in batch_data.join_stage_outputs(job_list, stage1_outputs, stage2_outputs):
+        if s2 is None:
+            continue
         validation_input.append({
             "Item Number": s1.get("Item Number", ""),
             "Complete Sentence": s1.get("Complete Sentence", ""),
             "Correct Answer": s1.get("Correct Answer", ""),
-            "Candidates": [s2.get(f"Candidate {k}", "") for k in "ABCDE"]
+            "Candidates": [c for c in (s2.get(f"Candidate {k}", "") for k in "ABCDE") if c]
         })
     
     user_msg = f"""
-TASK: Validate candidate distractors for ALL {len(job_list)} GRAMMAR questions and select the final three distractors.
-
-INPUT:
-{json.dumps(validation_input, indent=2)}
-
 VALIDATION PROCEDURE:
 1. GRAMMATICAL CORRECTNESS TEST: Distractor must make the sentence grammatically INCORRECT.
 2. PROFICIENCY CHECK: Errors must be appropriate for the CEFR level.
@@ -590,27 +841,29 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Validate candidate distractors for ALL {len(validation_input)} GRAMMAR questions and select the final three distractors.
+
+INPUT:
+{token_budget.serialize(validation_input)}
 """
     return system_msg, user_msg
 
 def create_sequential_batch_stage3_vocabulary_prompt(job_list, stage1_outputs, stage2_outputs):
-    system_msg = f"""You are an expert English vocabulary validator. You will evaluate candidate distractors for exactly {len(job_list)} vocabulary questions and return your validated selections in a JSON object with a "validated" key."""
+    system_msg = """You are an expert English vocabulary validator. You will evaluate candidate distractors for every vocabulary question and return your validated selections in a JSON object with a "validated" key."""
     
     validation_input = []
-    for i, (job, s1, s2) in enumerate(zip(job_list, stage1_outputs, stage2_outputs)):
+    for job, s1, s2 in batch_data.join_stage_outputs(job_list, stage1_outputs, stage2_outputs):
+        if s2 is None:
+            continue
         validation_input.append({
             "Item Number": s1.get("Item Number", ""),
             "Complete Sentence": s1.get("Complete Sentence", ""),
             "Correct Answer": s1.get("Correct Answer", ""),
-            "Candidates": [s2.get(f"Candidate {k}", "") for k in "ABCDE"]
+            "Candidates": [c for c in (s2.get(f"Candidate {k}", "") for k in "ABCDE") if c]
         })
     
     user_msg = f"""
-TASK: Validate candidate distractors for ALL {len(job_list)} VOCABULARY questions and select the final three distractors.
-
-INPUT:
-{json.dumps(validation_input, indent=2)}
-
 VALIDATION PROCEDURE:
 1. EXAMINER ACCEPTANCE TEST: Distractor must NOT be a valid correct answer.
 2. UNIQUENESS CHECK: Distractor must be grammatically correct but semantically wrong.
@@ -628,6 +881,61 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Validate candidate distractors for ALL {len(validation_input)} VOCABULARY questions and select the final three distractors.
+
+INPUT:
+{token_budget.serialize(validation_input)}
+"""
+    return system_msg, user_msg
+
+def create_combined_candidates_prompt(job_list, stage1_outputs, q_type):
+    """
+    Combined mode: one call replaces stages 2 and 3. The model proposes
+    scored candidates and distractor_rules.select_scored picks the final 3
+    locally.
+    """
+    system_msg = f"""You are an expert ELT test designer specializing in {q_type.lower()} assessment. You will generate and score candidate distractors for every {q_type.lower()} question in a single JSON response with a "candidates" key."""
+    
+    if q_type == "Grammar":
+        generation_rules = """1. WORD COUNT LIMIT: Max 3 words.
+2. GRAMMATICAL PARALLELISM: Match word count and construction type of correct answer.
+3. NO LEXICAL OVERLAP: Do NOT repeat words from the question stem.
+4. DEFINITELY WRONG: Each candidate must make the sentence grammatically INCORRECT."""
+    else:
+        generation_rules = """1. WORD COUNT LIMIT: Max 3 words.
+2. EXACT INFLECTIONAL FORM MATCHING: Candidates must match the grammatical form of the correct answer.
+3. SEMANTIC FIELD PROXIMITY: Candidates should be from the same semantic field.
+4. DEFINITELY WRONG: No candidate may be an acceptable answer in the sentence."""
+    
+    user_msg = f"""
+GENERATION INSTRUCTIONS:
+{generation_rules}
+
+SCORING:
+For every candidate give a "Score" from 0 to 10 for how good a distractor it is:
+10 = plausible to a learner at this CEFR level AND certainly wrong; 0 = could be accepted as correct, or obviously absurd.
+
+MANDATORY OUTPUT FORMAT:
+{{
+  "candidates": [
+    {{
+      "Item Number": "...",
+      "Candidate A": "...", "Score A": 0,
+      "Candidate B": "...", "Score B": 0,
+      "Candidate C": "...", "Score C": 0,
+      "Candidate D": "...", "Score D": 0,
+      "Candidate E": "...", "Score E": 0,
+      "Candidate F": "...", "Score F": 0
+    }},
+    ...
+  ]
+}}
+
+TASK: Generate 6 scored candidate distractors for ALL {len(job_list)} {q_type.upper()} questions.
+
+INPUT FROM STAGE 1:
+{token_budget.serialize(stage1_outputs)}
 """
     return system_msg, user_msg
 
@@ -659,9 +967,9 @@ def create_grammar_list_stage1_prompt(job_list, question_form):
     # Default to gap fill if not specified or complex
     form_instruction = question_form_instructions.get(question_form, question_form_instructions["Simple gap fill"])
     
-    system_msg = f"""You are an expert ELT content creator. You will generate exactly {len(job_list)} complete test questions in a single JSON response targeting specific grammar items.
+    system_msg = """You are an expert ELT content creator. You will generate complete test questions in a single JSON response targeting specific grammar items.
 
-CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array of exactly {len(job_list)} question objects."""
+CRITICAL: Your entire response must be a JSON object with a "questions" key containing an array with exactly one question object per grammar target."""
     
     job_specs = []
     for job in job_list:
@@ -673,11 +981,6 @@ CRITICAL: Your entire response must be a JSON object with a "questions" key cont
         })
  
     user_msg = f"""
-TASK: Create exactly {len(job_list)} grammar test questions.
-
-GRAMMAR TARGETS:
-{json.dumps(job_specs, indent=2)}
-
 {form_instruction}
 
 GENERATION INSTRUCTIONS:
@@ -704,6 +1007,11 @@ MANDATORY OUTPUT FORMAT:
     ... 
   ]
 }}
+
+TASK: Create exactly {len(job_list)} grammar test questions.
+
+GRAMMAR TARGETS:
+{token_budget.serialize(job_specs)}
 """
     return system_msg, user_msg
 
@@ -711,13 +1019,11 @@ def create_grammar_list_stage2_prompt(job_list, stage1_outputs):
     """
     Generates distractors for Grammar List items.
     """
-    system_msg = f"""You are an expert ELT test designer. You will create exactly 4 candidate distractors for exactly {len(job_list)} grammar questions in JSON format."""
+    system_msg = """You are an expert ELT test designer. You will create exactly 4 candidate distractors for every grammar question in JSON format."""
     
     pre_selected_data = []
     
-    for i, job in enumerate(job_list):
-        stage1_data = stage1_outputs[i]
-        
+    for job, stage1_data, _ in batch_data.join_stage_outputs(job_list, stage1_outputs):
         pre_selected_data.append({
             "Item Number": stage1_data.get("Item Number"),
             "Target Grammar": job['base_grammar'],
@@ -727,12 +1033,8 @@ def create_grammar_list_stage2_prompt(job_list, stage1_outputs):
         })
     
     user_msg = f"""
-TASK: Create a pool of exactly 4 candidate distractors for each question.
 OUTPUT FORMAT: JSON
 
-INPUT DATA:
-{json.dumps(pre_selected_data, indent=2)}
-
 INSTRUCTIONS FOR DISTRACTOR GENERATION:
 1. **COMMON ERRORS:** Focus on common learner mistakes for the specific CEFR level and grammar point.
 2. **PLAUSIBILITY:** Distractors should look grammatically possible but be incorrect in the specific context.
@@ -755,6 +1057,11 @@ MANDATORY OUTPUT FORMAT:
     ... 
   ]
 }}
+
+TASK: Create a pool of exactly 4 candidate distractors for each of these {len(pre_selected_data)} questions.
+
+INPUT DATA:
+{token_budget.serialize(pre_selected_data)}
 """
     return system_msg, user_msg
 
@@ -762,10 +1069,10 @@ def create_grammar_list_stage3_prompt(job_list, stage1_outputs, stage2_outputs):
     """
     Validates Grammar List distractors.
     """
-    system_msg = f"""You are an expert English grammar validator. You will filter candidate distractors using strict grammatical rules. Output results in JSON format."""
+    system_msg = """You are an expert English grammar validator. You will filter candidate distractors using strict grammatical rules. Output results in JSON format."""
     
     validation_input = []
-    for i, (job, s1, s2) in enumerate(zip(job_list, stage1_outputs, stage2_outputs)):
+    for job, s1, s2 in batch_data.join_stage_outputs(job_list, stage1_outputs, stage2_outputs):
         candidates = []
         if isinstance(s2, dict):
             # Try to get candidate fields A-D
@@ -781,12 +1088,8 @@ def create_grammar_list_stage3_prompt(job_list, stage1_outputs, stage2_outputs):
         })
     
     user_msg = f"""
-TASK: Validate candidates and select the final 3 distractors per question.
 OUTPUT FORMAT: JSON
 
-INPUT:
-{json.dumps(validation_input, indent=2)}
-
 VALIDATION PROTOCOL:
 1. **DEFINITELY INCORRECT:** Ensure the distractor is not a valid alternative answer.
 2. **CONTEXTUAL FIT:** The distractor might fit grammatically but be semantically weird (optional), or fit semantically but be grammatically wrong (preferred for grammar tests).
@@ -804,5 +1107,10 @@ MANDATORY OUTPUT FORMAT:
     ...
   ]
 }}
+
+TASK: Validate candidates and select the final 3 distractors for each of these {len(validation_input)} questions.
+
+INPUT:
+{token_budget.serialize(validation_input)}
 """
     return system_msg, user_msg
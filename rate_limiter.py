@@ -0,0 +1,245 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import openai
+
+# -----------------------------------------------------------------
+# Rate-Limit-Aware Scheduling & Retry
+# -----------------------------------------------------------------
+# Requests wait for room in a per-minute request/token budget instead of
+# failing with 429s. Budgets start from these defaults and are corrected
+# from the x-ratelimit-* headers on every response.
+DEFAULT_LIMITS = {
+    "requests_per_minute": 500,
+    "tokens_per_minute": 30000
+}
+
+RETRY_SETTINGS = {
+    "max_attempts": 6,
+    "base_delay": 1.0,
+    "max_delay": 60.0
+}
+
+WINDOW_SECONDS = 60.0
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+class RateBudget:
+    """
+    Sliding one-minute window of request and token usage for one
+    (api_key, model) pair.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.blocked_until = 0.0
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._window.popleft()
+
+    def try_acquire(self, tokens):
+        """
+        Reserves budget for a request. Returns 0 on success, otherwise the
+        number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._trim(now)
+
+            used_tokens = sum(t for _, t in self._window)
+            # A single request larger than the whole budget is let through
+            # on an empty window, otherwise it would wait forever.
+            fits_tokens = used_tokens + tokens <= self.tokens_per_minute or not self._window
+            if len(self._window) < self.requests_per_minute and fits_tokens:
+                self._window.append((now, tokens))
+                return 0
+            return max(0.05, WINDOW_SECONDS - (now - self._window[0][0]))
+
+    def acquire_sync(self, tokens):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire(self, tokens):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """
+        Adopts the account limits reported by the API and pauses the budget
+        until the reset time when a limit is exhausted.
+        """
+        if not headers:
+            return
+        with self._lock:
+            limit_requests = _to_int(headers.get("x-ratelimit-limit-requests"))
+            limit_tokens = _to_int(headers.get("x-ratelimit-limit-tokens"))
+            if limit_requests:
+                self.requests_per_minute = limit_requests
+            if limit_tokens:
+                self.tokens_per_minute = limit_tokens
+
+            for kind in ("requests", "tokens"):
+                remaining = _to_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining == 0 and reset:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def block_for(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def configure_limits(requests_per_minute=None, tokens_per_minute=None):
+    """
+    Sets the starting budget for new (api_key, model) pairs.
+    """
+    if requests_per_minute is not None:
+        DEFAULT_LIMITS["requests_per_minute"] = requests_per_minute
+    if tokens_per_minute is not None:
+        DEFAULT_LIMITS["tokens_per_minute"] = tokens_per_minute
+
+
+def get_budget(api_key, model):
+    key = (api_key, model)
+    with _budgets_lock:
+        budget = _budgets.get(key)
+        if budget is None:
+            budget = RateBudget(DEFAULT_LIMITS["requests_per_minute"], DEFAULT_LIMITS["tokens_per_minute"])
+            _budgets[key] = budget
+        return budget
+
+
+def estimate_tokens(request):
+    """
+    Rough token cost of a request as the API counts it against the limit:
+    prompt characters / 4 plus the max_tokens reservation.
+    """
+    chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+    return chars // 4 + request.get("max_tokens", 0)
+
+
+def _response_headers(raw):
+    # Raw responses expose .headers, streams expose .response.headers
+    headers = getattr(raw, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(raw, "response", None), "headers", None)
+    return headers
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_duration(value):
+    """
+    Parses OpenAI reset durations such as "1s", "6m0s", "120ms" or "0.5s".
+    Returns seconds as a float, or None.
+    """
+    if not value:
+        return None
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", str(value)):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    if matched:
+        return total
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def is_retryable(error):
+    """
+    429s, 5xx responses, timeouts and connection drops are worth retrying.
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409)
+    return False
+
+
+def retry_delay(error, attempt):
+    """
+    Seconds to wait before the next attempt: the server's retry-after or
+    reset hint when present, otherwise jittered exponential backoff.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    hinted = parse_duration(headers.get("retry-after")) or \
+        parse_duration(headers.get("x-ratelimit-reset-requests")) or \
+        parse_duration(headers.get("x-ratelimit-reset-tokens"))
+
+    if hinted:
+        return min(RETRY_SETTINGS["max_delay"], hinted + random.uniform(0, 0.5))
+
+    backoff = min(RETRY_SETTINGS["max_delay"], RETRY_SETTINGS["base_delay"] * (2 ** attempt))
+    return random.uniform(backoff / 2, backoff)
+
+
+def call_with_retry(send, request, api_key):
+    """
+    Runs send(request) -> raw response under the rate budget, retrying
+    transient failures. Returns the raw (with_raw_response) response or stream.
+    """
+    budget = get_budget(api_key, request.get("model"))
+    tokens = estimate_tokens(request)
+    for attempt in range(RETRY_SETTINGS["max_attempts"]):
+        budget.acquire_sync(tokens)
+        try:
+            raw = send(request)
+            budget.update_from_headers(_response_headers(raw))
+            return raw
+        except Exception as e:
+            if not is_retryable(e) or attempt == RETRY_SETTINGS["max_attempts"] - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                budget.block_for(delay)
+            time.sleep(delay)
+
+
+async def async_call_with_retry(send, request, api_key):
+    """
+    Async version of call_with_retry; send(request) must be a coroutine.
+    """
+    budget = get_budget(api_key, request.get("model"))
+    tokens = estimate_tokens(request)
+    for attempt in range(RETRY_SETTINGS["max_attempts"]):
+        await budget.acquire(tokens)
+        try:
+            raw = await send(request)
+            budget.update_from_headers(_response_headers(raw))
+            return raw
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not is_retryable(e) or attempt == RETRY_SETTINGS["max_attempts"] - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                budget.block_for(delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# -----------------------------------------------------------------
+# Persistent LLM Response Cache (SQLite)
+# -----------------------------------------------------------------
+# Responses are stored under a hash of the full request (model, messages,
+# temperature, max_tokens, response_format), so re-running an identical
+# prompt returns instantly and costs nothing. Set LLM_CACHE=off to disable.
+CACHE_SETTINGS = {
+    "enabled": os.environ.get("LLM_CACHE", "on").lower() not in ("off", "0", "false"),
+    "path": os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite"),
+    "max_bytes": 200 * 1024 * 1024,
+    "ttl_seconds": 7 * 24 * 3600
+}
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def configure_cache(enabled=None, path=None, max_bytes=None, ttl_seconds=None):
+    """
+    Updates cache settings (e.g. a temporary path for regression tests).
+    """
+    if enabled is not None:
+        CACHE_SETTINGS["enabled"] = enabled
+    if path is not None:
+        CACHE_SETTINGS["path"] = path
+    if max_bytes is not None:
+        CACHE_SETTINGS["max_bytes"] = max_bytes
+    if ttl_seconds is not None:
+        CACHE_SETTINGS["ttl_seconds"] = ttl_seconds
+
+
+def make_key(request):
+    """
+    Content hash of a chat completion request dict.
+    """
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _connect():
+    path = CACHE_SETTINGS["path"]
+    conn = sqlite3.connect(path, timeout=30)
+    with _init_lock:
+        if path not in _initialized_paths:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.commit()
+            _initialized_paths.add(path)
+    return conn
+
+
+def get(key):
+    """
+    Returns the cached response for key, or None on a miss or expired entry.
+    """
+    if not CACHE_SETTINGS["enabled"]:
+        return None
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > CACHE_SETTINGS["ttl_seconds"]:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CACHE READ FAILED: {e}")
+        return None
+
+
+def put(key, value):
+    """
+    Stores a response and evicts least-recently-used entries over max_bytes.
+    """
+    if not CACHE_SETTINGS["enabled"] or not value:
+        return
+    try:
+        conn = _connect()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            _evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CACHE WRITE FAILED: {e}")
+
+
+def _evict(conn):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= CACHE_SETTINGS["max_bytes"]:
+        return
+    stale = []
+    for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+        if total <= CACHE_SETTINGS["max_bytes"]:
+            break
+        stale.append((key,))
+        total -= size
+    conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+
+def clear():
+    """
+    Deletes every cached response.
+    """
+    try:
+        conn = _connect()
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"CACHE CLEAR FAILED: {e}")
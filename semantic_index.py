@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# -----------------------------------------------------------------
+# Semantic Similarity Index (local embeddings)
+# -----------------------------------------------------------------
+# Embeds every item of an uploaded vocabulary list once, so distractor
+# pre-selection can rank same-POS words by closeness to the target instead
+# of picking at random. A local sentence-transformers model is used when
+# the package is installed; otherwise items are embedded with hashed TF-IDF
+# over the words of their definition plus character n-grams of the item.
+# Embeddings are saved to cache_dir under a hash of the list, so uploading
+# the same list again does not re-embed it.
+EMBEDDING_SETTINGS = {
+    "model": os.environ.get("VOCAB_EMBEDDING_MODEL", "all-MiniLM-L6-v2"),
+    "use_model": SentenceTransformer is not None,
+    "cache_dir": os.environ.get("VOCAB_EMBEDDING_DIR", ".vocab_embeddings"),
+    "dimensions": 2048,
+    "ngram_sizes": (2, 3, 4),
+    # Weight of the item's own spelling relative to its definition words
+    "spelling_weight": 0.3
+}
+
+_WORD_RE = re.compile(r"[a-z]+")
+_STOPWORDS = {
+    "the", "and", "for", "that", "with", "from", "this", "you", "are", "was",
+    "something", "someone", "which", "who", "not", "but", "can", "your", "its",
+    "has", "have", "into", "when", "what", "used", "very", "way", "make"
+}
+
+_models = {}
+
+
+def configure_embeddings(use_model=None, model=None, cache_dir=None):
+    """
+    Updates embedding settings (e.g. force the TF-IDF fallback).
+    """
+    if use_model is not None:
+        EMBEDDING_SETTINGS["use_model"] = use_model and SentenceTransformer is not None
+    if model is not None:
+        EMBEDDING_SETTINGS["model"] = model
+    if cache_dir is not None:
+        EMBEDDING_SETTINGS["cache_dir"] = cache_dir
+
+
+def _get_model():
+    name = EMBEDDING_SETTINGS["model"]
+    if name not in _models:
+        _models[name] = SentenceTransformer(name)
+    return _models[name]
+
+
+def _features(item, definition):
+    """
+    Hashed (bucket, weight) features for one item: definition words plus
+    character n-grams of the padded item.
+    """
+    dims = EMBEDDING_SETTINGS["dimensions"]
+    features = []
+    for word in _WORD_RE.findall(str(definition or "").lower()):
+        if len(word) > 2 and word not in _STOPWORDS:
+            features.append((zlib.crc32(f"d:{word}".encode("utf-8")) % dims, 1.0))
+
+    padded = f"<{item.lower()}>"
+    weight = EMBEDDING_SETTINGS["spelling_weight"]
+    for n in EMBEDDING_SETTINGS["ngram_sizes"]:
+        for i in range(len(padded) - n + 1):
+            features.append((zlib.crc32(f"c:{padded[i:i + n]}".encode("utf-8")) % dims, weight))
+    return features
+
+
+def _count_matrix(items, definitions):
+    counts = np.zeros((len(items), EMBEDDING_SETTINGS["dimensions"]), dtype=np.float32)
+    for row, (item, definition) in enumerate(zip(items, definitions)):
+        for column, weight in _features(item, definition):
+            counts[row, column] += weight
+    return counts
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _embed_tfidf(items, definitions):
+    counts = _count_matrix(items, definitions)
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = (np.log((1 + len(items)) / (1 + document_frequency)) + 1).astype(np.float32)
+    return _normalize(counts * idf), idf
+
+
+def _embed_model(items, definitions):
+    texts = [f"{item}: {definition}" if definition else item for item, definition in zip(items, definitions)]
+    vectors = _get_model().encode(texts, convert_to_numpy=True, show_progress_bar=False)
+    return _normalize(vectors.astype(np.float32)), None
+
+
+def _cache_path(backend, items, definitions):
+    payload = json.dumps([backend, EMBEDDING_SETTINGS["dimensions"], EMBEDDING_SETTINGS["ngram_sizes"],
+                          EMBEDDING_SETTINGS["spelling_weight"], items, definitions], ensure_ascii=False)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(EMBEDDING_SETTINGS["cache_dir"], f"{digest}.npz")
+
+
+def _load_or_build(backend, items, definitions):
+    """
+    Returns (vectors, idf) for the list, from disk when it was embedded before.
+    """
+    path = _cache_path(backend, items, definitions)
+    try:
+        with np.load(path) as saved:
+            idf = saved["idf"] if saved["idf"].size else None
+            return saved["vectors"], idf
+    except (OSError, KeyError, ValueError):
+        pass
+
+    if backend == "tfidf":
+        vectors, idf = _embed_tfidf(items, definitions)
+    else:
+        vectors, idf = _embed_model(items, definitions)
+
+    try:
+        os.makedirs(EMBEDDING_SETTINGS["cache_dir"], exist_ok=True)
+        np.savez(path, vectors=vectors, idf=idf if idf is not None else np.zeros(0, dtype=np.float32))
+    except OSError as e:
+        print(f"EMBEDDING CACHE WRITE FAILED: {e}")
+    return vectors, idf
+
+
+class SemanticIndex:
+    """
+    Normalized embeddings for a list of (cleaned) vocabulary items.
+    Rows line up with the items passed in.
+    """
+    def __init__(self, items, definitions=None):
+        self.items = list(items)
+        self.definitions = [d if isinstance(d, str) else "" for d in (definitions or [""] * len(self.items))]
+        self.backend = EMBEDDING_SETTINGS["model"] if EMBEDDING_SETTINGS["use_model"] else "tfidf"
+        self.vectors, self.idf = _load_or_build(self.backend, self.items, self.definitions)
+        self._blocks = {}
+
+    def embed(self, item, definition=""):
+        """
+        Embeds a word that is not in the list (same space as the list).
+        """
+        if self.backend == "tfidf":
+            return _normalize(_count_matrix([item], [definition])[0] * self.idf)
+        return _embed_model([item], [definition])[0][0]
+
+    def vector(self, row):
+        return self.vectors[row]
+
+    def _block(self, rows):
+        # Bucket sub-matrices are cached so repeated queries skip the gather
+        cached = self._blocks.get(id(rows))
+        if cached is None or cached[0] is not rows:
+            positions = np.asarray(rows)
+            cached = (rows, positions, np.ascontiguousarray(self.vectors[positions]))
+            self._blocks[id(rows)] = cached
+        return cached[1], cached[2]
+
+    def nearest(self, query, rows, k=None):
+        """
+        Returns the given rows ordered from most to least similar to query
+        (only the top k when k is given).
+        """
+        if not rows:
+            return []
+        positions, block = self._block(rows)
+        scores = block @ query
+        if k is not None and k < len(positions):
+            top = np.argpartition(-scores, k)[:k]
+            return positions[top[np.argsort(-scores[top], kind="stable")]].tolist()
+        return positions[np.argsort(-scores, kind="stable")].tolist()
@@ -4,9 +4,12 @@ import random
 import json
 import time
 import test_planner
-import prompt_engineer
-import llm_service
-import output_formatter
+import example_bank
+import pipeline
+import token_budget
+import job_queue
+import checkpoint_store
+import dedup_index
 
 # -----------------------------------------------------------------
 # App Configuration & Styling
@@ -174,18 +177,11 @@ st.markdown("""
 # -----------------------------------------------------------------
 # Data Loader
 # -----------------------------------------------------------------
-@st.cache_data
+# Not wrapped in st.cache_data: example_bank caches each file until it
+# changes on disk, so replaced banks are picked up on the next rerun.
 def load_example_banks():
     try:
-        df_g = pd.read_csv("grammar_bank.csv")
-        df_v = pd.read_csv("vocab_bank.csv")
-        
-        if "GSE Score" in df_g.columns:
-            df_g = df_g.drop(columns=["GSE Score"])
-        if "GSE Score" in df_v.columns:
-            df_v = df_v.drop(columns=["GSE Score"])
-            
-        return {"grammar": df_g, "vocab": df_v}
+        return example_bank.load_example_banks()
     except FileNotFoundError:
         st.error("Error: Example bank CSVs not found.")
         return None
@@ -193,6 +189,115 @@ def load_example_banks():
         st.error(f"Error loading CSVs: {e}")
         return None
 
+# -----------------------------------------------------------------
+# Background Jobs
+# -----------------------------------------------------------------
+# Batches run on job_queue workers, so reruns and disconnects don't stop
+# them. Each tab keeps the id of its current job in session state. While a
+# job is active only its status panels (fragments) re-run, every
+# JOB_POLL_SECONDS; the page re-runs once, when the job has finished.
+JOB_POLL_SECONDS = 2
+
+# Session state key of the tab that shows each kind of job
+JOB_STATE_KEYS = {
+    pipeline.KIND_GRAMMAR: "generator_job",
+    pipeline.KIND_VOCABULARY: "generator_job",
+    pipeline.KIND_MIXED: "generator_job",
+    pipeline.KIND_VOCAB_LIST: "vocab_list_job",
+    pipeline.KIND_GRAMMAR_LIST: "grammar_list_job"
+}
+
+def describe_progress(progress):
+    return (
+        f"Completed {progress['finished']} of {progress['total']} items "
+        f"(stems: {progress['stage1']}, candidates: {progress['stage2']}, validated: {progress['stage3']})"
+    )
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_status_panel(job_id):
+    """
+    Progress of an active job, refreshed on its own. Re-runs the whole page
+    once the job has left the queue, so its tab can handle the results.
+    """
+    job = job_queue.get_job(job_id)
+    if job is None or job["status"] not in job_queue.ACTIVE_STATUSES:
+        st.rerun()
+
+    progress = job["progress"] or pipeline.new_progress(0)
+    st.progress(progress["finished"] / max(progress["total"], 1))
+    if job["status"] == job_queue.STATUS_QUEUED:
+        st.info(f"⏳ {job['label']} is queued and will start when a worker is free.")
+        st.button("Cancel", key=f"cancel_{job_id}", on_click=job_queue.cancel, args=(job_id,))
+    else:
+        st.info(f"⚙️ {job['label']}: {describe_progress(progress)}. You can switch tabs or close the page; the job keeps running.")
+
+def track_job(state_key):
+    """
+    Shows the status of the job whose id is in st.session_state[state_key].
+    Returns (job, results) once it has finished successfully, and forgets
+    the id so the results are handled exactly once. Returns None otherwise.
+    """
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return None
+
+    job = job_queue.get_job(job_id)
+    if job is None:
+        st.session_state[state_key] = None
+        st.warning("The background job could not be found.")
+        return None
+
+    if job["status"] in job_queue.ACTIVE_STATUSES:
+        job_status_panel(job_id)
+        return None
+
+    st.session_state[state_key] = None
+    if job["status"] != job_queue.STATUS_DONE:
+        st.error(f"{job['label']} {job['status']}.")
+        if job["error"]:
+            st.session_state.debug_logs.append(f"\nJOB {job_id} {job['status'].upper()}:\n{job['error']}")
+            with st.expander("🔍 DEBUG: Job Error", expanded=False):
+                st.code(job["error"])
+        return None
+    return job, job_queue.get_results(job_id)
+
+def open_job(job):
+    st.session_state[JOB_STATE_KEYS[job["kind"]]] = job["id"]
+
+def retry_job(job):
+    new_id = job_queue.resubmit(job["id"], user_api_key)
+    if new_id:
+        st.session_state[JOB_STATE_KEYS[job["kind"]]] = new_id
+
+def job_list_panel():
+    """
+    Recent jobs with Open / Retry buttons. Returns True if any of them is
+    still queued or running.
+    """
+    recent_jobs = job_queue.list_jobs(limit=10)
+    if not recent_jobs:
+        st.caption("No jobs yet.")
+    for job in recent_jobs:
+        progress = job["progress"] or pipeline.new_progress(0)
+        st.markdown(f"**{job['label']}** — {job['status']}")
+        st.caption(f"{time.strftime('%H:%M:%S', time.localtime(job['created']))} · {progress['finished']}/{progress['total']} items")
+        # Buttons re-run the whole page, so the tab shows the job they select
+        if job["status"] in (job_queue.STATUS_FAILED, job_queue.STATUS_INTERRUPTED):
+            if st.button("Retry", key=f"retry_{job['id']}"):
+                retry_job(job)
+                st.rerun()
+        elif job["status"] != job_queue.STATUS_CANCELLED:
+            if st.button("Open", key=f"open_{job['id']}"):
+                open_job(job)
+                st.rerun()
+    return any(job["status"] in job_queue.ACTIVE_STATUSES for job in recent_jobs)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def polling_job_list_panel():
+    # The page re-runs (and polling stops) once no listed job is active
+    if not job_list_panel():
+        st.rerun()
+
 # -----------------------------------------------------------------
 # Helper Functions
 # -----------------------------------------------------------------
@@ -317,6 +422,31 @@ def get_topic_suggestions(cefr):
     
     return ["No topics loaded for this level"]
 
+def default_blueprint():
+    """
+    Starting point for the blueprint editor: a placement test with 5
+    questions per type and level, mixing every focus of the level.
+    """
+    return pd.DataFrame([
+        {"Type": q_type, "CEFR": level, "Focus": "", "Count": 5}
+        for level in test_planner.CEFR_LEVELS for q_type in test_planner.QUESTION_TYPES
+    ])
+
+def blueprint_rows(blueprint_df):
+    """
+    Planner rows (see test_planner.create_blueprint_jobs) from the blueprint
+    editor. An empty Focus means every focus offered for that type and level.
+    """
+    rows = []
+    for row in blueprint_df.to_dict("records"):
+        if not row.get("Type") or not row.get("CEFR") or pd.isna(row.get("Count")):
+            continue
+        focus = row.get("Focus")
+        if not isinstance(focus, str) or not focus.strip():
+            focus = get_focus_options(row["Type"], row["CEFR"])
+        rows.append({"type": row["Type"], "cefr": row["CEFR"], "focus": focus, "count": int(row["Count"])})
+    return rows
+
 # Initialize session state
 if 'last_batch' not in st.session_state:
     st.session_state.last_batch = None
@@ -330,6 +460,10 @@ if 'sequential_stage3_data' not in st.session_state:
     st.session_state.sequential_stage3_data = None
 if 'debug_logs' not in st.session_state:
     st.session_state.debug_logs = []
+# Ids of the background jobs shown by each tab (see JOB_STATE_KEYS)
+for job_state_key in set(JOB_STATE_KEYS.values()):
+    if job_state_key not in st.session_state:
+        st.session_state[job_state_key] = None
 # Tab 4 vocabulary upload session state
 if 'uploaded_vocab_df' not in st.session_state:
     st.session_state.uploaded_vocab_df = None
@@ -350,6 +484,27 @@ if example_banks is None:
 
 st.write("This version implements architectural separation of generation and validation.")
 
+use_llm_cache = st.checkbox(
+    "Reuse cached responses for identical prompts",
+    value=True,
+    help="Identical stage prompts are answered from the local response cache. Untick to force fresh generations.",
+    key="use_llm_cache"
+)
+
+use_dedup = st.checkbox(
+    "Regenerate near-duplicates of earlier questions",
+    value=dedup_index.DEDUP_SETTINGS["enabled"],
+    help="Stage-1 sentences that are near-duplicates of previously generated questions (or of each other) are regenerated before distractors are made.",
+    key="use_dedup"
+)
+
+with st.sidebar:
+    st.subheader("Background Jobs")
+    if any(job["status"] in job_queue.ACTIVE_STATUSES for job in job_queue.list_jobs(limit=10)):
+        polling_job_list_panel()
+    else:
+        job_list_panel()
+
 # Initialize tab persistence in session state
 if 'file_upload_processed' not in st.session_state:
     st.session_state.file_upload_processed = False
@@ -390,9 +545,12 @@ with tab1:
             key="cefr"
         )
 
-        # Removed Strategy Selector - Hardcoded to Sequential Batch
-        st.info("Strategy: Sequential Batch (3-Stage Architecture)")
-        strategy = "Sequential Batch (3-Call)"
+        strategy = st.selectbox(
+            "Generation Strategy",
+            test_planner.GENERATION_STRATEGIES,
+            key="generation_strategy",
+            help="Combined mode makes one call for scored candidates and picks the final 3 distractors locally (faster for short batches)."
+        )
 
         batch_size = st.selectbox(
             "Batch Size",
@@ -416,14 +574,42 @@ with tab1:
     
     st.divider()
 
+    st.subheader("Test Blueprint")
+    use_blueprint = st.checkbox(
+        "Generate a whole test from a blueprint instead of a single batch",
+        key="use_blueprint",
+        help="Each question type and CEFR level becomes its own sub-batch, and the sub-batches run in parallel."
+    )
+    if use_blueprint:
+        st.caption("One row per type, level and focus. Leave Focus empty to mix every focus of that level.")
+        blueprint_df = st.data_editor(
+            default_blueprint(),
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                "Type": st.column_config.SelectboxColumn("Type", options=test_planner.QUESTION_TYPES, required=True),
+                "CEFR": st.column_config.SelectboxColumn("CEFR", options=test_planner.CEFR_LEVELS, required=True),
+                "Count": st.column_config.NumberColumn("Count", min_value=0, max_value=100, step=1)
+            },
+            key="blueprint_editor"
+        )
+    
+    st.divider()
+
     if st.button("Generate Batch", type="primary", use_container_width=True):
-        if not selected_focus:
+        if not use_blueprint and not selected_focus:
             st.error("Please select at least one 'Assessment Focus'.")
         else:
             st.session_state.debug_logs = []
             
-            with st.spinner(f"Generating {batch_size} questions..."):
-                try:
+            try:
+                if use_blueprint:
+                    job_list = test_planner.create_blueprint_jobs(
+                        blueprint_rows(blueprint_df),
+                        context_topic=context_topic,
+                        generation_strategy=strategy
+                    )
+                else:
                     job_list = test_planner.create_job_list(
                         total_questions=batch_size,
                         q_type=q_type,
@@ -432,209 +618,116 @@ with tab1:
                         context_topic=context_topic if context_topic else "General",
                         generation_strategy=strategy 
                     )
+                
+                st.success(f"Planner created {len(job_list)} jobs!")
+                st.subheader("Planned Job List:")
+                st.dataframe(pd.DataFrame(job_list))
+                
+                if not job_list:
+                    st.error("The blueprint does not ask for any questions.")
+                elif not user_api_key:
+                    st.error("⛔ No API Key provided.")
+                elif strategy not in test_planner.GENERATION_STRATEGIES:
+                    # Fallback or error if unknown strategy
+                    st.error(f"Unknown strategy: {strategy}")
+                else:
+                    # NEW THREE-STAGE ARCHITECTURE (stage 3 is local in combined mode)
+                    st.session_state.debug_logs.append("="*80)
+                    st.session_state.debug_logs.append(f"{strategy.upper()} MODE - STARTING")
+                    st.session_state.debug_logs.append(f"Batch size: {len(job_list)} questions")
+                    st.session_state.debug_logs.append(f"Chunk budget: {token_budget.BUDGET_SETTINGS['max_input_tokens']} prompt tokens")
+                    st.session_state.debug_logs.append("="*80)
                     
-                    st.success(f"Planner created {len(job_list)} jobs!")
-                    st.subheader("Planned Job List:")
-                    st.dataframe(pd.DataFrame(job_list))
-                    
-                    if not user_api_key:
-                        st.error("⛔ No API Key provided.")
+                    # One sub-batch per question type and CEFR level, run in parallel
+                    sub_batches = test_planner.group_jobs(job_list)
+                    for sub_type, sub_cefr, sub_jobs in sub_batches:
+                        st.session_state.debug_logs.append(f"Sub-batch: {sub_type} {sub_cefr} ({len(sub_jobs)} questions)")
+                    levels = list(dict.fromkeys(job['cefr'] for job in job_list))
+                    if len(sub_batches) == 1:
+                        job_label = f"{sub_batches[0][0]} {sub_batches[0][1]} ({len(job_list)} questions)"
                     else:
-                        generated_questions = []
-                        stage1_data_list = []
-                        stage2_data_list = []
-                        stage3_data_list = []
-                        
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
+                        job_label = f"Test blueprint {'-'.join(levels)} ({len(job_list)} questions)"
+                    
+                    # ===== STAGES 1-3: PIPELINED CHUNKS (background job) =====
+                    # Each chunk moves to the next stage as soon as its own output is parsed
+                    st.session_state.generator_job = job_queue.submit(job_list, pipeline.KIND_MIXED, {
+                        "api_key": user_api_key,
+                        "context": {"example_banks": example_banks},
+                        "use_cache": use_llm_cache,
+                        "dedup": use_dedup,
+                        "mode": strategy
+                    }, label=job_label,
+                       meta={"strategy": strategy, "cefr": "-".join(levels), "batch_size": len(job_list)})
+                
+            except Exception as e:
+                st.session_state.debug_logs.append(f"\nCRITICAL EXCEPTION: {str(e)}")
+                import traceback
+                st.session_state.debug_logs.append(f"Traceback:\n{traceback.format_exc()}")
+                st.error(f"Error: {e}")
+                with st.expander("🔍 DEBUG: Exception Details", expanded=True):
+                    st.error(str(e))
+                    st.code(traceback.format_exc())
 
-                        for index, job in enumerate(job_list):
-                            status_text.text(f"Processing question {index + 1} of {len(job_list)}...")
-                            
-                            if job['strategy'] == "Sequential Batch (3-Call)":
-                                # NEW THREE-STAGE ARCHITECTURE
-                                if index == 0:
-                                    st.session_state.debug_logs.append("="*80)
-                                    st.session_state.debug_logs.append("NEW SEQUENTIAL BATCH MODE - STARTING")
-                                    st.session_state.debug_logs.append(f"Batch size: {len(job_list)} questions")
-                                    st.session_state.debug_logs.append("="*80)
-                                    
-                                    # ===== STAGE 1: GENERATE SENTENCES =====
-                                    status_text.text(f"Stage 1: Generating stems with context clues...")
-                                    st.session_state.debug_logs.append("\n--- STAGE 1: SENTENCE GENERATION ---")
-                                    
-                                    sys_msg_1, user_msg_1 = prompt_engineer.create_sequential_batch_stage1_prompt(job_list, example_banks)
-                                    raw_stage1 = llm_service.call_llm([sys_msg_1, user_msg_1], user_api_key)
-                                    
-                                    with st.expander("🔍 DEBUG: Stage 1 Raw Response", expanded=False):
-                                        st.text_area("Complete Raw LLM Response", raw_stage1, height=300, key="debug_stage1_raw")
-                                    
-                                    stage1_data, stage1_error = output_formatter.parse_response(raw_stage1)
-                                    if stage1_error:
-                                        st.error(f"Stage 1 failed: {stage1_error}")
-                                        break
-                                    
-                                    if isinstance(stage1_data, dict) and "questions" in stage1_data:
-                                        stage1_data_list = stage1_data["questions"]
-                                    else:
-                                        stage1_data_list, extract_error = output_formatter.extract_array_from_response(stage1_data)
-                                        if extract_error:
-                                            st.error(f"Stage 1 extraction failed: {extract_error}")
-                                            break
-                                    
-                                    st.session_state.debug_logs.append(f"Stage 1: Generated {len(stage1_data_list)} sentences")
-                                    
-                                    # ===== STAGE 2: GENERATE CANDIDATES =====
-                                    status_text.text(f"Stage 2: Generating candidate distractors...")
-                                    st.session_state.debug_logs.append("\n--- STAGE 2: CANDIDATE GENERATION ---")
-                                    
-                                    question_type = job_list[0]['type']
-                                    st.session_state.debug_logs.append(f"Question type: {question_type}")
-                                    
-                                    if question_type == 'Grammar':
-                                        st.session_state.debug_logs.append("Using grammar candidate generation")
-                                        sys_msg_2, user_msg_2 = prompt_engineer.create_sequential_batch_stage2_grammar_prompt(
-                                            job_list, stage1_data_list
-                                        )
-                                    elif question_type == 'Vocabulary':
-                                        st.session_state.debug_logs.append("Using vocabulary candidate generation")
-                                        sys_msg_2, user_msg_2 = prompt_engineer.create_sequential_batch_stage2_vocabulary_prompt(
-                                            job_list, stage1_data_list
-                                        )
-                                    else:
-                                        st.error(f"Unknown question type: {question_type}")
-                                        break
-                                    
-                                    raw_stage2 = llm_service.call_llm([sys_msg_2, user_msg_2], user_api_key)
-                                    
-                                    with st.expander("🔍 DEBUG: Stage 2 Raw Response", expanded=False):
-                                        st.text_area("Complete Raw LLM Response", raw_stage2, height=300, key="debug_stage2_raw")
-                                    
-                                    stage2_data, stage2_error = output_formatter.parse_response(raw_stage2)
-                                    if stage2_error:
-                                        st.error(f"Stage 2 failed: {stage2_error}")
-                                        break
-                                    
-                                    if isinstance(stage2_data, dict) and "candidates" in stage2_data:
-                                        stage2_data_list = stage2_data["candidates"]
-                                    else:
-                                        stage2_data_list, extract_error = output_formatter.extract_array_from_response(stage2_data)
-                                        if extract_error:
-                                            st.error(f"Stage 2 extraction failed: {extract_error}")
-                                            break
-                                    
-                                    st.session_state.debug_logs.append(f"Stage 2: Generated {len(stage2_data_list)} candidate sets")
-                                    
-                                    # ===== STAGE 3: VALIDATE AND FILTER =====
-                                    status_text.text(f"Stage 3: Validating candidates and selecting final distractors...")
-                                    st.session_state.debug_logs.append("\n--- STAGE 3: VALIDATION & FILTERING ---")
-                                    
-                                    if question_type == 'Grammar':
-                                        st.session_state.debug_logs.append("Using grammar validation")
-                                        sys_msg_3, user_msg_3 = prompt_engineer.create_sequential_batch_stage3_grammar_prompt(
-                                            job_list, stage1_data_list, stage2_data_list
-                                        )
-                                    elif question_type == 'Vocabulary':
-                                        st.session_state.debug_logs.append("Using vocabulary validation")
-                                        sys_msg_3, user_msg_3 = prompt_engineer.create_sequential_batch_stage3_vocabulary_prompt(
-                                            job_list, stage1_data_list, stage2_data_list
-                                        )
-                                    
-                                    raw_stage3 = llm_service.call_llm([sys_msg_3, user_msg_3], user_api_key)
-                                    
-                                    with st.expander("🔍 DEBUG: Stage 3 Raw Response", expanded=False):
-                                        st.text_area("Complete Raw LLM Response", raw_stage3, height=300, key="debug_stage3_raw")
-                                    
-                                    stage3_data, stage3_error = output_formatter.parse_response(raw_stage3)
-                                    if stage3_error:
-                                        st.error(f"Stage 3 failed: {stage3_error}")
-                                        break
-                                    
-                                    if isinstance(stage3_data, dict) and "validated" in stage3_data:
-                                        stage3_data_list = stage3_data["validated"]
-                                    else:
-                                        stage3_data_list, extract_error = output_formatter.extract_array_from_response(stage3_data)
-                                        if extract_error:
-                                            st.error(f"Stage 3 extraction failed: {extract_error}")
-                                            break
-                                    
-                                    st.session_state.debug_logs.append(f"Stage 3: Validated {len(stage3_data_list)} distractor sets")
-                                    
-                                    # ===== FINAL ASSEMBLY =====
-                                    st.session_state.debug_logs.append("\n--- FINAL ASSEMBLY ---")
-                                    for i in range(len(stage1_data_list)):
-                                        if i < len(stage3_data_list):
-                                            stage1_data = stage1_data_list[i]
-                                            stage3_data = stage3_data_list[i]
-                                            
-                                            complete_sentence = stage1_data.get("Complete Sentence", "")
-                                            correct_answer = stage1_data.get("Correct Answer", "")
-                                            question_prompt = complete_sentence.replace(correct_answer, "____")
-                                            
-                                            options = [
-                                                stage3_data.get("Selected Distractor A", ""),
-                                                stage3_data.get("Selected Distractor B", ""),
-                                                stage3_data.get("Selected Distractor C", ""),
-                                                correct_answer
-                                            ]
-                                            
-                                            final_question = {
-                                                "Item Number": stage1_data.get("Item Number", ""),
-                                                "Assessment Focus": stage1_data.get("Assessment Focus", ""),
-                                                "Question Prompt": question_prompt,
-                                                "Answer A": correct_answer,
-                                                "Answer B": stage3_data.get("Selected Distractor A", ""),
-                                                "Answer C": stage3_data.get("Selected Distractor B", ""),
-                                                "Answer D": stage3_data.get("Selected Distractor C", ""),
-                                                "Correct Answer": "A",
-                                                "CEFR rating": stage1_data.get("CEFR rating", ""),
-                                                "Category": stage1_data.get("Category", "")
-                                            }
-                                            generated_questions.append(final_question)
-                                            st.session_state.debug_logs.append(f"Assembled question {i+1}")
-                                    
-                                    st.session_state.debug_logs.append(f"\nTOTAL ASSEMBLED: {len(generated_questions)}")
-                                    break
-                                
-                            else:
-                                # Fallback or error if unknown strategy
-                                st.error(f"Unknown strategy for job {job['job_id']}: {job['strategy']}")
+    finished_job = track_job("generator_job")
+    if finished_job is not None:
+        job, results = finished_job
+        job_strategy = job["meta"]["strategy"]
+        
+        for stage in pipeline.STAGES:
+            with st.expander(f"🔍 DEBUG: Stage {stage} Raw Response", expanded=False):
+                st.text_area("Complete Raw LLM Response", "\n\n".join(results["raw"][stage]), height=300, key=f"debug_stage{stage}_raw")
+        
+        for error in results["errors"]:
+            st.error(error)
+            st.session_state.debug_logs.append(error)
 
-                            progress_bar.progress((index + 1) / len(job_list))
-                        
-                        progress_bar.empty()
-                        status_text.empty()
-                        
-                        if generated_questions:
-                            st.success(f"Successfully generated {len(generated_questions)} questions!")
-                            
-                            final_df = pd.DataFrame(generated_questions)
-                            st.dataframe(final_df)
-                            
-                            st.session_state.last_batch = final_df
-                            st.session_state.last_batch_strategy = strategy
-                            
-                            if strategy == "Sequential Batch (3-Call)":
-                                st.session_state.sequential_stage1_data = pd.DataFrame(stage1_data_list) if stage1_data_list else None
-                                st.session_state.sequential_stage2_data = pd.DataFrame(stage2_data_list) if stage2_data_list else None
-                                st.session_state.sequential_stage3_data = pd.DataFrame(stage3_data_list) if stage3_data_list else None
-                            
-                            csv = final_df.to_csv(index=False).encode('utf-8')
-                            st.download_button(
-                                label="📥 Download Questions as CSV",
-                                data=csv,
-                                file_name=f"generated_test_{cefr}_{batch_size}q.csv",
-                                mime="text/csv",
-                            )
-                    
-                except Exception as e:
-                    st.session_state.debug_logs.append(f"\nCRITICAL EXCEPTION: {str(e)}")
-                    import traceback
-                    st.session_state.debug_logs.append(f"Traceback:\n{traceback.format_exc()}")
-                    st.error(f"Error: {e}")
-                    with st.expander("🔍 DEBUG: Exception Details", expanded=True):
-                        st.error(str(e))
-                        st.code(traceback.format_exc())
+        with st.expander("📋 DEBUG: Item Ledger (per-stage status)", expanded=False):
+            st.dataframe(pd.DataFrame(results["ledger"]), use_container_width=True)
+        for job_id, stage, status, notes in pipeline.failed_items(results):
+            st.session_state.debug_logs.append(f"Item {job_id} dropped at stage {stage}: {status} {notes}")
+        
+        stage1_data_list = [s for s in results["stage1"] if s is not None]
+        stage2_data_list = [s for s in results["stage2"] if s is not None]
+        stage3_data_list = [s for s in results["stage3"] if s is not None]
+        st.session_state.debug_logs.append(f"Stage 1: Generated {len(stage1_data_list)} sentences")
+        st.session_state.debug_logs.append(f"Stage 2: Generated {len(stage2_data_list)} candidate sets")
+        st.session_state.debug_logs.append(f"Stage 3: Validated {len(stage3_data_list)} distractor sets")
+        stats = results["stats"]
+        st.session_state.debug_logs.append(f"Chunk sizes: {results['chunk_sizes']}")
+        st.session_state.debug_logs.append(
+            f"API requests: {stats['requests']} "
+            f"(~{stats['prompt_tokens']} prompt / ~{stats['completion_tokens']} completion tokens, "
+            f"{stats['cached_tokens']} prompt tokens from the provider cache)"
+        )
+        
+        # ===== FINAL ASSEMBLY =====
+        st.session_state.debug_logs.append("\n--- FINAL ASSEMBLY ---")
+        # Stems and distractors are joined by Item Number, never by position
+        generated_questions = results["questions"]
+        
+        st.session_state.debug_logs.append(f"\nTOTAL ASSEMBLED: {len(generated_questions)}")
+        
+        if generated_questions:
+            st.success(f"Successfully generated {len(generated_questions)} questions!")
+            
+            final_df = pd.DataFrame(generated_questions)
+            st.dataframe(final_df)
+            
+            st.session_state.last_batch = final_df
+            st.session_state.last_batch_strategy = job_strategy
+            
+            if job_strategy in test_planner.GENERATION_STRATEGIES:
+                st.session_state.sequential_stage1_data = pd.DataFrame(stage1_data_list) if stage1_data_list else None
+                st.session_state.sequential_stage2_data = pd.DataFrame(stage2_data_list) if stage2_data_list else None
+                st.session_state.sequential_stage3_data = pd.DataFrame(stage3_data_list) if stage3_data_list else None
+            
+            csv = final_df.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label="📥 Download Questions as CSV",
+                data=csv,
+                file_name=f"generated_test_{job['meta']['cefr']}_{job['meta']['batch_size']}q.csv",
+                mime="text/csv",
+            )
 
 
 # =============================
@@ -661,7 +754,7 @@ with tab2:
             st.caption(f"Strategy used: {st.session_state.last_batch_strategy}")
             
             working_batch = st.session_state.last_batch.copy()
-            is_sequential_batch = (st.session_state.last_batch_strategy == "Sequential Batch (3-Call)")
+            is_sequential_batch = (st.session_state.last_batch_strategy in test_planner.GENERATION_STRATEGIES)
         else:
             st.warning("No recent batch found. Please generate a batch first.")
     
@@ -675,6 +768,47 @@ with tab2:
             except Exception as e:
                 st.error(f"Error reading CSV: {e}")
     
+    if working_batch is not None:
+        with st.expander("🔁 Near-Duplicate Check", expanded=False):
+            st.caption("Compares the Complete Sentence of every question with the rest of the batch and, optionally, with previously generated questions.")
+            # Questions from the Generator are indexed as soon as they are made
+            compare_index = st.checkbox(
+                "Also compare with previously generated questions",
+                value=(input_source == "Upload CSV file"),
+                key=f"dedup_compare_index_{input_source}"
+            )
+            batch_sentences = [dedup_index.question_sentence(row) for row in working_batch.to_dict("records")]
+            # The check only runs on request; its result is kept until the batch or the option changes
+            check_key = (hash(tuple(batch_sentences)), compare_index)
+            if st.button("Check for near-duplicates", key="dedup_check_run"):
+                st.session_state.dedup_check = {
+                    "key": check_key,
+                    "duplicates": dedup_index.find_duplicates(batch_sentences, use_index=compare_index)
+                }
+            dedup_check = st.session_state.get("dedup_check")
+            
+            if dedup_check is None or dedup_check["key"] != check_key:
+                st.info("Not checked yet.")
+            else:
+                duplicates = dedup_check["duplicates"]
+                duplicate_rows = [i for i, match in enumerate(duplicates) if match]
+                if duplicate_rows:
+                    st.warning(f"Found {len(duplicate_rows)} near-duplicate questions.")
+                    st.dataframe(pd.DataFrame([
+                        {"Row": i + 1, "Sentence": batch_sentences[i], "Similar To": duplicates[i][0],
+                         "Similarity": round(duplicates[i][1], 2), "Found In": duplicates[i][2]}
+                        for i in duplicate_rows
+                    ]), use_container_width=True)
+                    if st.checkbox("Remove near-duplicates from this batch", key="dedup_remove"):
+                        working_batch = working_batch.drop(working_batch.index[duplicate_rows]).reset_index(drop=True)
+                        st.caption(f"{len(working_batch)} questions left.")
+                else:
+                    st.success("No near-duplicates found.")
+            
+            if st.button("Add this batch to the duplicate index", key="dedup_add"):
+                added = dedup_index.add(batch_sentences, source="Refinement Workshop")
+                st.success(f"Indexed {added} new sentences.")
+    
     st.divider()
     
     if working_batch is not None:
@@ -808,8 +942,7 @@ with tab5:
                 st.session_state.last_uploaded_grammar_id = file_id
                 
                 # VALIDATE REQUIRED COLUMNS
-                required_columns = ['ConceptID', 'Base Grammar Item', 'Grammar Subtype']
-                missing_columns = [col for col in required_columns if col not in grammar_df.columns]
+                missing_columns = test_planner.missing_columns(grammar_df, test_planner.GRAMMAR_LIST_COLUMNS)
                 
                 if missing_columns:
                     st.error(f"Missing required columns: {', '.join(missing_columns)}")
@@ -849,6 +982,19 @@ with tab5:
                 key="question_form_g"
             )
             
+            resume_g = st.checkbox(
+                "Resume from checkpoints",
+                value=True,
+                help="Reuse stage outputs saved by earlier runs of these ConceptIDs (same question form and CEFR level), so an interrupted run continues where it stopped.",
+                key="resume_g"
+            )
+            skip_accepted_g = st.checkbox(
+                "Skip ConceptIDs that already have accepted questions",
+                value=False,
+                disabled=not resume_g,
+                key="skip_accepted_g"
+            )
+            
         with col2:
             batch_selection_mode_g = st.radio(
                 "Batch Selection Method",
@@ -905,115 +1051,58 @@ with tab5:
                 with st.expander("Selected Grammar Items", expanded=True):
                     st.dataframe(selected_grammar[['ConceptID', 'Base Grammar Item', 'Grammar Subtype']], use_container_width=True)
                 
-                with st.spinner(f"Processing {len(selected_grammar)} items..."):
-                    try:
-                        grammar_job_list = []
-                        for idx, row in selected_grammar.iterrows():
-                            concept_id = row.get('ConceptID', f"G-{idx}")
-                            
-                            # Safe string conversion to handle NaN/float values
-                            base_grammar_val = row.get('Base Grammar Item', '')
-                            base_grammar = str(base_grammar_val).strip() if pd.notna(base_grammar_val) else ''
-                            
-                            subtype_val = row.get('Grammar Subtype', '')
-                            subtype = str(subtype_val).strip() if pd.notna(subtype_val) else ''
-                            
-                            if not base_grammar:
-                                continue
-                                
-                            job = {
-                                "job_id": concept_id,
-                                "type": "Grammar List",
-                                "cefr": grammar_cefr,
-                                "base_grammar": base_grammar,
-                                "subtype": subtype,
-                                "strategy": "Sequential Batch (3-Call)"
-                            }
-                            grammar_job_list.append(job)
-                            
-                        if not grammar_job_list:
-                            st.error("No valid grammar items found.")
-                            st.stop()
-                            
-                        # Import prompts
-                        from prompt_engineer import (
-                            create_grammar_list_stage1_prompt,
-                            create_grammar_list_stage2_prompt,
-                            create_grammar_list_stage3_prompt
-                        )
+                try:
+                    grammar_job_list, _ = test_planner.create_grammar_list_jobs(selected_grammar, grammar_cefr)
+                    
+                    grammar_checkpoint = checkpoint_store.list_scope(pipeline.KIND_GRAMMAR_LIST, question_form_g) if resume_g else None
+                    if grammar_checkpoint and skip_accepted_g:
+                        accepted_g = set(checkpoint_store.accepted_ids(grammar_checkpoint, grammar_job_list))
+                        grammar_job_list = [job for job in grammar_job_list if job['job_id'] not in accepted_g]
+                        st.info(f"Skipping {len(accepted_g)} ConceptIDs that already have accepted questions.")
                         
-                        # STAGE 1
-                        sys_msg_1, user_msg_1 = create_grammar_list_stage1_prompt(grammar_job_list, question_form_g)
-                        raw_stage1 = llm_service.call_llm([sys_msg_1, user_msg_1], user_api_key)
-                        stage1_data, _ = output_formatter.parse_response(raw_stage1)
-                        if isinstance(stage1_data, dict) and "questions" in stage1_data:
-                            stage1_data_list = stage1_data["questions"]
-                        else:
-                            stage1_data_list, _ = output_formatter.extract_array_from_response(stage1_data)
-                            
-                        if not stage1_data_list: # Error handling
-                             st.error("Stage 1 failed to return questions.")
-                             st.stop()
-
-                        # STAGE 2
-                        sys_msg_2, user_msg_2 = create_grammar_list_stage2_prompt(grammar_job_list, stage1_data_list)
-                        raw_stage2 = llm_service.call_llm([sys_msg_2, user_msg_2], user_api_key)
-                        stage2_data, _ = output_formatter.parse_response(raw_stage2)
+                    if not grammar_job_list:
+                        st.error("No valid grammar items found.")
+                        st.stop()
                         
-                        if isinstance(stage2_data, dict) and "candidates" in stage2_data:
-                            stage2_data_list = stage2_data["candidates"]
-                        else:
-                            stage2_data_list, _ = output_formatter.extract_array_from_response(stage2_data)
-
-                        # STAGE 3
-                        sys_msg_3, user_msg_3 = create_grammar_list_stage3_prompt(grammar_job_list, stage1_data_list, stage2_data_list)
-                        raw_stage3 = llm_service.call_llm([sys_msg_3, user_msg_3], user_api_key)
-                        stage3_data, _ = output_formatter.parse_response(raw_stage3)
+                    # STAGES 1-3 (chunked, parallel) as a background job
+                    st.session_state.grammar_list_job = job_queue.submit(grammar_job_list, pipeline.KIND_GRAMMAR_LIST, {
+                        "api_key": user_api_key,
+                        "context": {"question_form": question_form_g},
+                        "use_cache": use_llm_cache,
+                        "dedup": use_dedup,
+                        "checkpoint": grammar_checkpoint
+                    }, label=f"Grammar List {grammar_cefr} ({len(grammar_job_list)} items)",
+                       meta={"cefr": grammar_cefr, "total": len(selected_grammar)})
                         
-                        if isinstance(stage3_data, dict) and "validated" in stage3_data:
-                            stage3_data_list = stage3_data["validated"]
-                        else:
-                            stage3_data_list, _ = output_formatter.extract_array_from_response(stage3_data)
-                            
-                        # ASSEMBLY
-                        grammar_questions = []
-                        for i in range(len(stage1_data_list)):
-                             if i < len(stage3_data_list) and i < len(selected_grammar):
-                                s1 = stage1_data_list[i]
-                                s3 = stage3_data_list[i]
-                                row = selected_grammar.iloc[i]
-                                
-                                complete = s1.get("Complete Sentence", "")
-                                answer = s1.get("Correct Answer", "")
-                                prompt = complete.replace(answer, "____")
-                                
-                                q = {
-                                    "ConceptID": row.get('ConceptID', ''),
-                                    "Base Grammar Item": row.get('Base Grammar Item', ''),
-                                    "Subtype": row.get('Grammar Subtype', ''),
-                                    "Question Prompt": prompt,
-                                    "Answer A": answer,
-                                    "Answer B": s3.get("Selected Distractor A", ""),
-                                    "Answer C": s3.get("Selected Distractor B", ""),
-                                    "Answer D": s3.get("Selected Distractor C", ""),
-                                    "Correct Answer": "A"
-                                }
-                                grammar_questions.append(q)
-                                
-                        if grammar_questions:
-                            st.success(f"Generated {len(grammar_questions)} grammar questions!")
-                            
-                            st.session_state.generated_grammar_questions = {
-                                'df': pd.DataFrame(grammar_questions),
-                                'cefr': grammar_cefr,
-                                'count': len(grammar_questions),
-                                'total': len(selected_grammar)
-                            }
-                            
-                    except Exception as e:
-                        st.error(f"Error: {e}")
-                        import traceback
-                        st.code(traceback.format_exc())
+                except Exception as e:
+                    st.error(f"Error: {e}")
+                    import traceback
+                    st.code(traceback.format_exc())
+
+    finished_job = track_job("grammar_list_job")
+    if finished_job is not None:
+        job, results = finished_job
+        for error in results["errors"]:
+            st.warning(error)
+
+        with st.expander("📋 Item Ledger (per-stage status)", expanded=False):
+            st.dataframe(pd.DataFrame(results["ledger"]), use_container_width=True)
+            
+        if not any(results["stage1"]): # Error handling
+            st.error("Stage 1 failed to return questions.")
+            
+        # ASSEMBLY
+        grammar_questions = results["questions"]
+                
+        if grammar_questions:
+            st.success(f"Generated {len(grammar_questions)} grammar questions!")
+            
+            st.session_state.generated_grammar_questions = {
+                'df': pd.DataFrame(grammar_questions),
+                'cefr': job["meta"]["cefr"],
+                'count': len(grammar_questions),
+                'total': job["meta"]["total"]
+            }
 
     # Persistent Display outside button
     if st.session_state.generated_grammar_questions is not None:
@@ -1073,8 +1162,7 @@ with tab4:
                 st.session_state.last_uploaded_file_id = file_id
                 
                 # VALIDATE REQUIRED COLUMNS
-                required_columns = ['ConceptID', 'Base Vocabulary Item', 'Part of Speech', 'Definition']
-                missing_columns = [col for col in required_columns if col not in vocab_df.columns]
+                missing_columns = test_planner.missing_columns(vocab_df, test_planner.VOCAB_LIST_COLUMNS)
                 
                 if missing_columns:
                     st.error(f"Missing required columns: {', '.join(missing_columns)}")
@@ -1126,6 +1214,19 @@ with tab4:
                 help="Include vocabulary definitions to guide question generation. Recommended for specialized or technical vocabulary.",
                 key="use_definitions"
             )
+            
+            resume_vocab = st.checkbox(
+                "Resume from checkpoints",
+                value=True,
+                help="Reuse stage outputs saved by earlier runs of these ConceptIDs (same question form, CEFR level and definitions), so an interrupted run continues where it stopped.",
+                key="resume_vocab"
+            )
+            skip_accepted_vocab = st.checkbox(
+                "Skip ConceptIDs that already have accepted questions",
+                value=False,
+                disabled=not resume_vocab,
+                key="skip_accepted_vocab"
+            )
         
         with col2:
             # UPDATED: Changed "ConceptID range" to "Row Range" to fix sorting bug
@@ -1194,231 +1295,140 @@ with tab4:
                     display_cols = ['ConceptID', 'Base Vocabulary Item', 'Part of Speech']
                     st.dataframe(selected_vocab[display_cols], use_container_width=True)
                 
-                with st.spinner(f"Processing {len(selected_vocab)} vocabulary items..."):
-                    try:
-                        # Build job list for vocabulary items with EXPLICIT field extraction
-                        vocab_job_list = []
-                        for idx, row in selected_vocab.iterrows():
-                            # EXPLICIT extraction of all required fields
-                            concept_id = row.get('ConceptID', f"V-{idx}")
-                            base_vocab = row.get('Base Vocabulary Item', '').strip()
-                            part_of_speech = row.get('Part of Speech', '').strip()
-                            definition = row.get('Definition', '').strip() if use_definitions else ''
-                            
-                            # Validate essential fields
-                            if not base_vocab:
-                                st.warning(f"Skipping row {idx}: Missing Base Vocabulary Item")
-                                continue
-                            if not part_of_speech:
-                                st.warning(f"Skipping row {idx} ({base_vocab}): Missing Part of Speech")
-                                continue
-                            
-                            job = {
-                                "job_id": concept_id,
-                                "type": "Vocabulary",
-                                "cefr": vocab_cefr,
-                                "target_vocabulary": base_vocab,
-                                "definition": definition,
-                                "part_of_speech": part_of_speech,
-                                "strategy": "Sequential Batch (3-Call)"
-                            }
-                            vocab_job_list.append(job)
-                        
-                        if len(vocab_job_list) == 0:
-                            st.error("No valid vocabulary items to process after validation.")
-                            st.stop()
-                        
-                        st.session_state.debug_logs = []
-                        st.session_state.debug_logs.append("="*80)
-                        st.session_state.debug_logs.append("VOCABULARY LIST GENERATION - STARTING")
-                        st.session_state.debug_logs.append(f"Vocabulary items: {len(vocab_job_list)}")
-                        st.session_state.debug_logs.append(f"Question form: {question_form}")
-                        st.session_state.debug_logs.append(f"Using definitions: {use_definitions}")
-                        st.session_state.debug_logs.append("="*80)
-                        
-                        # Log extracted fields for first item (debugging)
-                        if len(vocab_job_list) > 0:
-                            sample_job = vocab_job_list[0]
-                            st.session_state.debug_logs.append("\nSample extracted fields:")
-                            st.session_state.debug_logs.append(f"  ConceptID: {sample_job['job_id']}")
-                            st.session_state.debug_logs.append(f"  Target Vocabulary: {sample_job['target_vocabulary']}")
-                            st.session_state.debug_logs.append(f"  Part of Speech: {sample_job['part_of_speech']}")
-                            st.session_state.debug_logs.append(f"  Definition: {sample_job['definition'][:50] if sample_job['definition'] else 'Not included'}")
-                        
-                        # Import the vocabulary list functions
-                        from prompt_engineer import (
-                            create_vocab_list_stage1_prompt,
-                            create_vocab_list_stage2_prompt,
-                            create_vocab_list_stage3_prompt
-                        )
-                        
-                        # ===== STAGE 1: GENERATE SENTENCES =====
-                        status_text = st.empty()
-                        status_text.text("Stage 1: Generating sentences with target vocabulary...")
-                        st.session_state.debug_logs.append("\n--- STAGE 1: SENTENCE GENERATION ---")
-                        
-                        sys_msg_1, user_msg_1 = create_vocab_list_stage1_prompt(vocab_job_list, question_form)
-                        raw_stage1 = llm_service.call_llm([sys_msg_1, user_msg_1], user_api_key)
-                        
-                        stage1_data, stage1_error = output_formatter.parse_response(raw_stage1)
-                        if stage1_error:
-                            st.error(f"Stage 1 failed: {stage1_error}")
-                            st.stop()
-                        
-                        if isinstance(stage1_data, dict) and "questions" in stage1_data:
-                            stage1_data_list = stage1_data["questions"]
-                        else:
-                            stage1_data_list, extract_error = output_formatter.extract_array_from_response(stage1_data)
-                            if extract_error:
-                                st.error(f"Stage 1 extraction failed: {extract_error}")
-                                st.stop()
-                        
-                        st.session_state.debug_logs.append(f"Stage 1: Generated {len(stage1_data_list)} sentences")
-                        
-                        # ===== STAGE 2: GENERATE CANDIDATES =====
-                        status_text.text("Stage 2: Generating candidate distractors (hybrid sourcing)...")
-                        st.session_state.debug_logs.append("\n--- STAGE 2: HYBRID DISTRACTOR GENERATION ---")
-                        st.session_state.debug_logs.append(f"Vocabulary pool size: {len(vocab_df)} items")
-                        
-                        sys_msg_2, user_msg_2 = create_vocab_list_stage2_prompt(
-                            vocab_job_list, stage1_data_list, vocab_df
-                        )
-                        raw_stage2 = llm_service.call_llm([sys_msg_2, user_msg_2], user_api_key)
-                        
-                        stage2_data, stage2_error = output_formatter.parse_response(raw_stage2)
-                        if stage2_error:
-                            st.error(f"Stage 2 failed: {stage2_error}")
-                            st.stop()
-                        
-                        if isinstance(stage2_data, dict) and "candidates" in stage2_data:
-                            stage2_data_list = stage2_data["candidates"]
-                        else:
-                            stage2_data_list, extract_error = output_formatter.extract_array_from_response(stage2_data)
-                            if extract_error:
-                                st.error(f"Stage 2 extraction failed: {extract_error}")
-                                st.stop()
-                        
-                        st.session_state.debug_logs.append(f"Stage 2: Generated {len(stage2_data_list)} candidate sets")
-                        
-                        # ===== STAGE 3: VALIDATE AND FILTER =====
-                        status_text.text("Stage 3: Validating and selecting final distractors...")
-                        st.session_state.debug_logs.append("\n--- STAGE 3: VALIDATION & FILTERING ---")
-                        
-                        sys_msg_3, user_msg_3 = create_vocab_list_stage3_prompt(
-                            vocab_job_list, stage1_data_list, stage2_data_list
-                        )
-                        raw_stage3 = llm_service.call_llm([sys_msg_3, user_msg_3], user_api_key)
-                        
-                        stage3_data, stage3_error = output_formatter.parse_response(raw_stage3)
-                        if stage3_error:
-                            st.error(f"Stage 3 failed: {stage3_error}")
-                            st.stop()
-                        
-                        if isinstance(stage3_data, dict) and "validated" in stage3_data:
-                            stage3_data_list = stage3_data["validated"]
-                        else:
-                            stage3_data_list, extract_error = output_formatter.extract_array_from_response(stage3_data)
-                            if extract_error:
-                                st.error(f"Stage 3 extraction failed: {extract_error}")
-                                st.stop()
-                        
-                        st.session_state.debug_logs.append(f"Stage 3: Validated {len(stage3_data_list)} distractor sets")
-                        
-                        # ===== FINAL ASSEMBLY =====
-                        st.session_state.debug_logs.append("\n--- FINAL ASSEMBLY ---")
-                        vocab_questions = []
-                        
-                        for i in range(len(stage1_data_list)):
-                            if i < len(stage3_data_list) and i < len(selected_vocab):
-                                stage1_data = stage1_data_list[i]
-                                stage3_data = stage3_data_list[i]
-                                vocab_row = selected_vocab.iloc[i]
-                                
-                                complete_sentence = stage1_data.get("Complete Sentence", "")
-                                correct_answer = stage1_data.get("Correct Answer", "")
-                                question_prompt = complete_sentence.replace(correct_answer, "____")
-                                
-                                options = [
-                                    stage3_data.get("Selected Distractor A", ""),
-                                    stage3_data.get("Selected Distractor B", ""),
-                                    stage3_data.get("Selected Distractor C", ""),
-                                    correct_answer
-                                ]
-                                
-                                vocab_question = {
-                                    "ConceptID": vocab_row.get('ConceptID', ''),
-                                    "Base Vocabulary Item": vocab_row.get('Base Vocabulary Item', ''),
-                                    "Question Prompt": question_prompt,
-                                    "Answer A": correct_answer,
-                                    "Answer B": stage3_data.get("Selected Distractor A", ""),
-                                    "Answer C": stage3_data.get("Selected Distractor B", ""),
-                                    "Answer D": stage3_data.get("Selected Distractor C", ""),
-                                    "Correct Answer": "A"
-                                }
-                                vocab_questions.append(vocab_question)
-                                
-                                log_entry = f"Assembled question {i+1} for '{vocab_row.get('Base Vocabulary Item', '')}' ({vocab_row.get('Part of Speech', '')})"
-                                st.session_state.debug_logs.append(log_entry)
-                        
-                        status_text.empty()
-                        
-                        st.session_state.debug_logs.append(f"\nTOTAL ASSEMBLED: {len(vocab_questions)}")
-                        
-                        # Display results
-                        if vocab_questions:
-                            st.success(f"Successfully generated {len(vocab_questions)} vocabulary questions!")
-                            
-                            vocab_questions_df = pd.DataFrame(vocab_questions)
-                            
-                            # STORE IN SESSION STATE instead of displaying immediately
-                            st.session_state.generated_vocab_questions = {
-                                'df': vocab_questions_df,
-                                'cefr': vocab_cefr,
-                                'count': len(vocab_questions),
-                                'total': len(selected_vocab),
-                                'form': question_form,
-                                'use_def': use_definitions
-                            }
-                        
-                    except Exception as e:
-                        st.session_state.debug_logs.append(f"\nCRITICAL EXCEPTION: {str(e)}")
-                        import traceback
-                        st.session_state.debug_logs.append(f"Traceback:\n{traceback.format_exc()}")
-                        st.error(f"Error: {e}")
-                        with st.expander("🔍 DEBUG: Exception Details", expanded=True):
-                            st.error(str(e))
-                            st.code(traceback.format_exc())
+                try:
+                    # Build job list for vocabulary items (rows missing essential fields are skipped)
+                    vocab_job_list, skipped_rows = test_planner.create_vocab_list_jobs(
+                        selected_vocab, vocab_cefr, use_definitions
+                    )
+                    for message in skipped_rows:
+                        st.warning(message)
+                    
+                    vocab_checkpoint = checkpoint_store.list_scope(pipeline.KIND_VOCAB_LIST, question_form) if resume_vocab else None
+                    if vocab_checkpoint and skip_accepted_vocab:
+                        accepted_vocab = set(checkpoint_store.accepted_ids(vocab_checkpoint, vocab_job_list))
+                        vocab_job_list = [job for job in vocab_job_list if job['job_id'] not in accepted_vocab]
+                        st.info(f"Skipping {len(accepted_vocab)} ConceptIDs that already have accepted questions.")
+                    
+                    if len(vocab_job_list) == 0:
+                        st.error("No valid vocabulary items to process after validation.")
+                        st.stop()
+                    
+                    st.session_state.debug_logs = []
+                    st.session_state.debug_logs.append("="*80)
+                    st.session_state.debug_logs.append("VOCABULARY LIST GENERATION - STARTING")
+                    st.session_state.debug_logs.append(f"Vocabulary items: {len(vocab_job_list)}")
+                    st.session_state.debug_logs.append(f"Question form: {question_form}")
+                    st.session_state.debug_logs.append(f"Using definitions: {use_definitions}")
+                    st.session_state.debug_logs.append("="*80)
+                    
+                    # Log extracted fields for first item (debugging)
+                    if len(vocab_job_list) > 0:
+                        sample_job = vocab_job_list[0]
+                        st.session_state.debug_logs.append("\nSample extracted fields:")
+                        st.session_state.debug_logs.append(f"  ConceptID: {sample_job['job_id']}")
+                        st.session_state.debug_logs.append(f"  Target Vocabulary: {sample_job['target_vocabulary']}")
+                        st.session_state.debug_logs.append(f"  Part of Speech: {sample_job['part_of_speech']}")
+                        st.session_state.debug_logs.append(f"  Definition: {sample_job['definition'][:50] if sample_job['definition'] else 'Not included'}")
+                    
+                    # ===== STAGES 1-3: CHUNKED PIPELINE (background job) =====
+                    st.session_state.debug_logs.append(f"\nChunk budget: {token_budget.BUDGET_SETTINGS['max_input_tokens']} prompt tokens")
+                    st.session_state.debug_logs.append(f"Vocabulary pool size: {len(vocab_df)} items")
+                    
+                    st.session_state.vocab_list_job = job_queue.submit(vocab_job_list, pipeline.KIND_VOCAB_LIST, {
+                        "api_key": user_api_key,
+                        "context": {"question_form": question_form, "vocab_df": vocab_df},
+                        "use_cache": use_llm_cache,
+                        "dedup": use_dedup,
+                        "checkpoint": vocab_checkpoint
+                    }, label=f"Vocabulary List {vocab_cefr} ({len(vocab_job_list)} items)",
+                       meta={"cefr": vocab_cefr, "total": len(selected_vocab), "form": question_form,
+                             "use_def": use_definitions})
+                    
+                except Exception as e:
+                    st.session_state.debug_logs.append(f"\nCRITICAL EXCEPTION: {str(e)}")
+                    import traceback
+                    st.session_state.debug_logs.append(f"Traceback:\n{traceback.format_exc()}")
+                    st.error(f"Error: {e}")
+                    with st.expander("🔍 DEBUG: Exception Details", expanded=True):
+                        st.error(str(e))
+                        st.code(traceback.format_exc())
 
-        # MOVE DISPLAY LOGIC OUTSIDE THE BUTTON BLOCK
-        if st.session_state.generated_vocab_questions is not None:
-            data = st.session_state.generated_vocab_questions
-            vocab_questions_df = data['df']
-            
-            # Display results with highlighting
-            st.divider()
-            st.subheader("Generated Questions")
-            
-            # UPDATED: Allow editing
-            # Use data_editor with key to maintain state during interaction
-            edited_vocab_df = st.data_editor(
-                vocab_questions_df, 
-                use_container_width=True, 
-                key="vocab_editor_persistent" # Fixed key for persistence
+    finished_job = track_job("vocab_list_job")
+    if finished_job is not None:
+        job, results = finished_job
+        for error in results["errors"]:
+            st.warning(error)
+            st.session_state.debug_logs.append(error)
+
+        with st.expander("📋 Item Ledger (per-stage status)", expanded=False):
+            st.dataframe(pd.DataFrame(results["ledger"]), use_container_width=True)
+        for job_id, stage, status, notes in pipeline.failed_items(results):
+            st.session_state.debug_logs.append(f"Item {job_id} dropped at stage {stage}: {status} {notes}")
+        
+        if not any(results["stage1"]):
+            st.error("Stage 1 failed to return questions.")
+        
+        st.session_state.debug_logs.append(f"Stage 1: Generated {sum(s is not None for s in results['stage1'])} sentences")
+        st.session_state.debug_logs.append(f"Stage 2: Generated {sum(s is not None for s in results['stage2'])} candidate sets")
+        st.session_state.debug_logs.append(f"Stage 3: Validated {sum(s is not None for s in results['stage3'])} distractor sets")
+        
+        # ===== FINAL ASSEMBLY =====
+        st.session_state.debug_logs.append("\n--- FINAL ASSEMBLY ---")
+        vocab_questions = results["questions"]
+        for i, item in enumerate(results["batch"].completed()):
+            job_data = item.job
+            st.session_state.debug_logs.append(
+                f"Assembled question {i+1} for '{job_data['target_vocabulary']}' ({job_data['part_of_speech']})"
             )
+        
+        st.session_state.debug_logs.append(f"\nTOTAL ASSEMBLED: {len(vocab_questions)}")
+        
+        # Display results
+        if vocab_questions:
+            st.success(f"Successfully generated {len(vocab_questions)} vocabulary questions!")
             
-            # Download button uses EDITED dataframe
-            csv_output = edited_vocab_df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Download Vocabulary Questions CSV",
-                data=csv_output,
-                file_name=f"vocab_questions_{data['cefr']}_{data['count']}items.csv",
-                mime="text/csv",
-            )
+            vocab_questions_df = pd.DataFrame(vocab_questions)
             
-            # Generation summary
-            with st.expander("Generation Summary", expanded=False):
-                st.write(f"**CEFR Level:** {data['cefr']}")
-                st.write(f"**Question Form:** {data['form']}")
-                st.write(f"**Definitions Used:** {'Yes' if data['use_def'] else 'No'}")
-                st.write(f"**Total Questions:** {data['count']}")
-                st.write(f"**Success Rate:** {data['count']}/{data['total']} ({100*data['count']/data['total']:.1f}%)")
+            # STORE IN SESSION STATE instead of displaying immediately
+            st.session_state.generated_vocab_questions = {
+                'df': vocab_questions_df,
+                'cefr': job["meta"]["cefr"],
+                'count': len(vocab_questions),
+                'total': job["meta"]["total"],
+                'form': job["meta"]["form"],
+                'use_def': job["meta"]["use_def"]
+            }
+
+    # MOVE DISPLAY LOGIC OUTSIDE THE BUTTON BLOCK
+    if st.session_state.generated_vocab_questions is not None:
+        data = st.session_state.generated_vocab_questions
+        vocab_questions_df = data['df']
+
+        # Display results with highlighting
+        st.divider()
+        st.subheader("Generated Questions")
+
+        # UPDATED: Allow editing
+        # Use data_editor with key to maintain state during interaction
+        edited_vocab_df = st.data_editor(
+            vocab_questions_df, 
+            use_container_width=True, 
+            key="vocab_editor_persistent" # Fixed key for persistence
+        )
+
+        # Download button uses EDITED dataframe
+        csv_output = edited_vocab_df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="📥 Download Vocabulary Questions CSV",
+            data=csv_output,
+            file_name=f"vocab_questions_{data['cefr']}_{data['count']}items.csv",
+            mime="text/csv",
+        )
+
+        # Generation summary
+        with st.expander("Generation Summary", expanded=False):
+            st.write(f"**CEFR Level:** {data['cefr']}")
+            st.write(f"**Question Form:** {data['form']}")
+            st.write(f"**Definitions Used:** {'Yes' if data['use_def'] else 'No'}")
+            st.write(f"**Total Questions:** {data['count']}")
+            st.write(f"**Success Rate:** {data['count']}/{data['total']} ({100*data['count']/data['total']:.1f}%)")
@@ -1,5 +1,27 @@
 import random
 
+import pandas as pd
+
+# Generation strategies offered in the Generator tab (see pipeline.MODE_*)
+STRATEGY_SEQUENTIAL = "Sequential Batch (3-Call)"
+STRATEGY_COMBINED = "Combined Batch (2-Call)"
+GENERATION_STRATEGIES = (STRATEGY_SEQUENTIAL, STRATEGY_COMBINED)
+
+QUESTION_TYPES = ("Grammar", "Vocabulary")
+CEFR_LEVELS = ("A1", "A2", "B1", "B2", "C1")
+
+# Topic Variance (Semantic Domains) - prevents thematic repetition
+TOPIC_DOMAINS = [
+    "Health & Fitness", "Technology & Computers", "Cooking & Food", 
+    "Money & Shopping", "Daily Routine", "Art & Music", 
+    "Weather & Nature", "Work & Jobs", "Education & Learning", 
+    "Transport & Cities", "Family & Relationships", "Current Events"
+]
+
+# Columns an uploaded list needs for the list generators
+VOCAB_LIST_COLUMNS = ['ConceptID', 'Base Vocabulary Item', 'Part of Speech', 'Definition']
+GRAMMAR_LIST_COLUMNS = ['ConceptID', 'Base Grammar Item', 'Grammar Subtype']
+
 def create_job_list(
     total_questions, 
     q_type, 
@@ -15,16 +37,14 @@ def create_job_list(
     Topic variance is the primary anti-repetition mechanism, leveraging the 
     batch processing model's cross-question awareness. Style micro-contexts 
     have been removed to prevent contamination of Assessment Focus labels.
+    
+    generation_strategy must be one of GENERATION_STRATEGIES; it is stored
+    on every job so the batch can be traced back to the mode that made it.
     """
-    job_list = []
+    if generation_strategy not in GENERATION_STRATEGIES:
+        raise ValueError(f"Unknown generation strategy: {generation_strategy}")
     
-    # Topic Variance (Semantic Domains) - prevents thematic repetition
-    random_domains = [
-        "Health & Fitness", "Technology & Computers", "Cooking & Food", 
-        "Money & Shopping", "Daily Routine", "Art & Music", 
-        "Weather & Nature", "Work & Jobs", "Education & Learning", 
-        "Transport & Cities", "Family & Relationships", "Current Events"
-    ]
+    job_list = []
     
     # Check if user provided a specific topic
     user_provided_topic = True
@@ -40,7 +60,7 @@ def create_job_list(
             main_topic = context_topic
         else:
             # Cycle through random domains to ensure topic diversity
-            current_domain = random_domains[i % len(random_domains)]
+            current_domain = TOPIC_DOMAINS[i % len(TOPIC_DOMAINS)]
             main_topic = current_domain
         
         job = {
@@ -55,3 +75,138 @@ def create_job_list(
         job_list.append(job)
         
     return job_list
+
+
+def create_blueprint_jobs(blueprint, context_topic, generation_strategy):
+    """
+    Builds the jobs for a whole test from a blueprint: rows of
+    {"type", "cefr", "focus", "count"}, where focus is one Assessment Focus
+    or a list to pick from at random (like create_job_list).
+    Each (type, CEFR) group is numbered and cycles topics on its own, so job
+    ids stay unique across the test; the foci of a group are interleaved.
+    Returns one job list with mixed types and levels (see group_jobs).
+    Raises ValueError for an unknown type, level or strategy, or a row
+    without a focus.
+    """
+    if generation_strategy not in GENERATION_STRATEGIES:
+        raise ValueError(f"Unknown generation strategy: {generation_strategy}")
+
+    groups = {}
+    for row in blueprint:
+        q_type, cefr_target, count = row["type"], row["cefr"], int(row["count"])
+        if q_type not in QUESTION_TYPES:
+            raise ValueError(f"Unknown question type: {q_type}")
+        if cefr_target not in CEFR_LEVELS:
+            raise ValueError(f"Unknown CEFR level: {cefr_target}")
+        focus = row["focus"]
+        focus_list = [focus] if isinstance(focus, str) else list(focus)
+        if not any(focus_list):
+            raise ValueError(f"No Assessment Focus for {q_type} {cefr_target}")
+        if count > 0:
+            groups.setdefault((q_type, cefr_target), []).append([focus_list, count])
+
+    job_list = []
+    for (q_type, cefr_target), rows in groups.items():
+        # Round-robin over the group's rows so every chunk mixes foci
+        foci = []
+        while any(count for _, count in rows):
+            for row in rows:
+                if row[1]:
+                    foci.append(random.choice(row[0]))
+                    row[1] -= 1
+
+        for i, current_focus in enumerate(foci):
+            job_list.append({
+                "job_id": f"{q_type[0].upper()}{cefr_target}-{i+1}",
+                "type": q_type,
+                "cefr": cefr_target,
+                "focus": current_focus,
+                "context": context_topic if context_topic and context_topic.strip() else TOPIC_DOMAINS[i % len(TOPIC_DOMAINS)],
+                "strategy": generation_strategy
+            })
+    return job_list
+
+
+def group_jobs(job_list):
+    """
+    Splits a job list into homogeneous sub-batches, one per (type, CEFR)
+    in order of first appearance, so each runs with one set of prompts.
+    Returns [(type, cefr, jobs)].
+    """
+    groups = {}
+    for job in job_list:
+        groups.setdefault((job['type'], job['cefr']), []).append(job)
+    return [(q_type, cefr_target, jobs) for (q_type, cefr_target), jobs in groups.items()]
+
+
+def missing_columns(df, required_columns):
+    """
+    Required columns that an uploaded list does not have.
+    """
+    return [col for col in required_columns if col not in df.columns]
+
+
+def _cell(row, column):
+    # Safe string conversion to handle NaN/float values
+    value = row.get(column, '')
+    return str(value).strip() if pd.notna(value) else ''
+
+
+def create_vocab_list_jobs(vocab_df, cefr_target, use_definitions=True):
+    """
+    Builds Vocabulary List jobs from the rows of a vocabulary list
+    (see VOCAB_LIST_COLUMNS), one job per row, keyed by ConceptID.
+    Returns (job_list, skipped) where skipped holds a message for every row
+    without a Base Vocabulary Item or Part of Speech.
+    """
+    job_list = []
+    skipped = []
+    for idx, row in vocab_df.iterrows():
+        concept_id = row.get('ConceptID', f"V-{idx}")
+        base_vocab = _cell(row, 'Base Vocabulary Item')
+        part_of_speech = _cell(row, 'Part of Speech')
+
+        if not base_vocab:
+            skipped.append(f"Skipping row {idx}: Missing Base Vocabulary Item")
+            continue
+        if not part_of_speech:
+            skipped.append(f"Skipping row {idx} ({base_vocab}): Missing Part of Speech")
+            continue
+
+        job_list.append({
+            "job_id": concept_id,
+            "type": "Vocabulary",
+            "cefr": cefr_target,
+            "target_vocabulary": base_vocab,
+            "definition": _cell(row, 'Definition') if use_definitions else '',
+            "part_of_speech": part_of_speech,
+            "strategy": STRATEGY_SEQUENTIAL
+        })
+    return job_list, skipped
+
+
+def create_grammar_list_jobs(grammar_df, cefr_target):
+    """
+    Builds Grammar List jobs from the rows of a grammar list
+    (see GRAMMAR_LIST_COLUMNS), one job per row, keyed by ConceptID.
+    Returns (job_list, skipped) like create_vocab_list_jobs.
+    """
+    job_list = []
+    skipped = []
+    for idx, row in grammar_df.iterrows():
+        concept_id = row.get('ConceptID', f"G-{idx}")
+        base_grammar = _cell(row, 'Base Grammar Item')
+
+        if not base_grammar:
+            skipped.append(f"Skipping row {idx}: Missing Base Grammar Item")
+            continue
+
+        job_list.append({
+            "job_id": concept_id,
+            "type": "Grammar List",
+            "cefr": cefr_target,
+            "base_grammar": base_grammar,
+            "subtype": _cell(row, 'Grammar Subtype'),
+            "strategy": STRATEGY_SEQUENTIAL
+        })
+    return job_list, skipped
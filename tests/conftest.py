@@ -0,0 +1,87 @@
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup_index
+import rate_limiter
+import response_cache
+
+
+def _job_ids(text):
+    """
+    job_ids (or Item Numbers) of the data table in a stage prompt.
+    """
+    lines = text.split("\n")
+    for number, line in enumerate(lines):
+        columns = next(csv.reader([line]), [])
+        for name in ("job_id", "Item Number"):
+            if name in columns:
+                ids = []
+                for row in csv.reader(lines[number + 1:]):
+                    if len(row) != len(columns):
+                        break
+                    ids.append(row[columns.index(name)])
+                return ids
+    # Nested stage inputs are sent as JSON
+    return [number for number in re.findall(r'"Item Number":\s*"(.*?)"', text) if number != "..."]
+
+
+class FakeModel:
+    """
+    Answers stage prompts like the model would, with a new sentence for
+    every stage-1 item it writes. `requests` holds every request sent.
+    """
+    WORDS = "apple river mountain teacher window garden bicycle kitchen doctor market island winter".split()
+
+    def __init__(self):
+        self.requests = []
+        self._sentences = itertools.count()
+
+    def sentence(self):
+        number = next(self._sentences)
+        words = [self.WORDS[(number + step * 5) % len(self.WORDS)] for step in range(6)]
+        return f"Sentence {number} about the {' '.join(words)} and a word."
+
+    def respond(self, user_msg):
+        ids = _job_ids(user_msg)
+        if '"questions"' in user_msg:
+            items = [{"Item Number": i, "Complete Sentence": self.sentence(), "Correct Answer": "word",
+                      "CEFR rating": "B1", "Category": "Grammar", "Assessment Focus": "focus"} for i in ids]
+            return {"questions": items}
+        if '"candidates"' in user_msg:
+            return {"candidates": [{"Item Number": i, **{f"Candidate {k}": f"{k.lower()}cand" for k in "ABCDEFGH"}}
+                                   for i in ids]}
+        return {"validated": [{"Item Number": i, "Selected Distractor A": "acand", "Selected Distractor B": "bcand",
+                               "Selected Distractor C": "ccand"} for i in ids]}
+
+    async def call(self, create, request, api_key):
+        self.requests.append(request)
+        content = json.dumps(self.respond(request["messages"][-1]["content"]))
+        response = types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content), finish_reason="stop")],
+            usage=None
+        )
+        return types.SimpleNamespace(parse=lambda: response)
+
+
+@pytest.fixture
+def fake_model(monkeypatch, tmp_path):
+    """
+    Replaces the OpenAI transport below llm_service, with the response
+    cache and the duplicate index in temporary files.
+    """
+    model = FakeModel()
+    monkeypatch.setattr(rate_limiter, "async_call_with_retry", model.call)
+    monkeypatch.setitem(response_cache.CACHE_SETTINGS, "enabled", True)
+    monkeypatch.setitem(response_cache.CACHE_SETTINGS, "path", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setitem(dedup_index.DEDUP_SETTINGS, "enabled", True)
+    monkeypatch.setitem(dedup_index.DEDUP_SETTINGS, "path", str(tmp_path / "dedup.sqlite"))
+    return model
@@ -0,0 +1,46 @@
+import batch_data
+import pipeline
+import test_planner
+
+
+def _run(jobs):
+    return pipeline.run_batch(jobs, pipeline.KIND_GRAMMAR, {
+        "api_key": "test-key", "context": {"example_banks": {}}, "stream": False, "use_cache": True, "dedup": True
+    })
+
+
+def test_rerun_with_cache_does_not_reject_its_own_sentences(fake_model):
+    jobs = test_planner.create_job_list(6, "Grammar", "B1", ["focus"], "", test_planner.STRATEGY_SEQUENTIAL)
+    first = _run(jobs)
+    second = _run(jobs)
+
+    assert len(first["questions"]) == len(second["questions"]) == 6
+    assert second["stats"]["requests_by_stage"][1] == first["stats"]["requests_by_stage"][1]
+    for item in second["batch"]:
+        assert item.status[1] == batch_data.STATUS_OK
+        assert not item.rejected
+    # Stage 1 was generated again, so the rerun's sentences are new
+    sentences = {item.stage1["Complete Sentence"] for item in first["batch"]}
+    assert sentences.isdisjoint(item.stage1["Complete Sentence"] for item in second["batch"])
+
+
+def test_mixed_sub_batches_share_one_duplicate_check(fake_model):
+    repeated = "The same sentence about the river and the garden with a word."
+    fresh = fake_model.sentence
+    calls = []
+
+    def sentence():
+        calls.append(None)
+        return repeated if len(calls) <= 2 else fresh()
+
+    fake_model.sentence = sentence
+    jobs = (test_planner.create_job_list(1, "Grammar", "B1", ["focus"], "", test_planner.STRATEGY_SEQUENTIAL)
+            + test_planner.create_job_list(1, "Vocabulary", "B1", ["focus"], "", test_planner.STRATEGY_SEQUENTIAL))
+    results = pipeline.run_batch(jobs, pipeline.KIND_MIXED, {
+        "api_key": "test-key", "context": {"example_banks": {}}, "stream": False, "dedup": True
+    })
+
+    assert len(results["sub_batches"]) == 2
+    sentences = [item.stage1["Complete Sentence"] for item in results["batch"]]
+    assert len(set(sentences)) == 2
+    assert sum(1 for item in results["batch"] if item.rejected == [repeated]) == 1
@@ -0,0 +1,50 @@
+import pytest
+
+import inflector
+
+
+@pytest.mark.parametrize("word, form, expected", [
+    ("panic", inflector.FORM_PAST, "panicked"),
+    ("picnic", inflector.FORM_ING, "picnicking"),
+    ("quiz", inflector.FORM_PLURAL, "quizzes"),
+    ("quiz", inflector.FORM_PAST, "quizzed"),
+    ("squat", inflector.FORM_ING, "squatting"),
+    ("equip", inflector.FORM_PAST, "equipped"),
+    ("early", inflector.FORM_COMPARATIVE, "earlier"),
+    ("friendly", inflector.FORM_SUPERLATIVE, "friendliest"),
+    ("quickly", inflector.FORM_COMPARATIVE, "more quickly"),
+    ("small", inflector.FORM_COMPARATIVE, "smaller"),
+    ("stop", inflector.FORM_PAST, "stopped"),
+    ("visit", inflector.FORM_PAST, "visited"),
+    ("buzz", inflector.FORM_PLURAL, "buzzes"),
+])
+def test_inflect(word, form, expected):
+    assert inflector.inflect(word, form) == expected
+
+
+@pytest.mark.parametrize("base, answer, pos, expected", [
+    ("early", "earlier", None, inflector.FORM_COMPARATIVE),
+    ("panic", "panicked", None, inflector.FORM_PAST),
+    ("quiz", "quizzes", "noun", inflector.FORM_PLURAL),
+    ("blow", "blew", None, inflector.FORM_PAST),
+])
+def test_detect_form(base, answer, pos, expected):
+    assert inflector.detect_form(base, answer, pos) == expected
+
+
+@pytest.mark.parametrize("sentence, expected", [
+    ("She put the book on the table.", inflector.FORM_PAST),
+    ("Yesterday I put the keys by the door.", inflector.FORM_PAST),
+    ("I have put the keys by the door.", inflector.FORM_PAST_PARTICIPLE),
+    ("The car was put in the garage.", inflector.FORM_PAST_PARTICIPLE),
+    ("Please put the keys by the door.", inflector.FORM_BASE),
+    ("I want to put it there.", inflector.FORM_BASE),
+    ("I put my keys by the door every day.", inflector.FORM_BASE),
+])
+def test_detect_form_of_verb_spelt_like_its_base(sentence, expected):
+    assert inflector.detect_form("put", "put", "verb", sentence) == expected
+
+
+def test_inflect_like_adjective_comparative():
+    assert inflector.inflect_like("small", inflector.FORM_COMPARATIVE, "adjective") == "smaller"
+    assert inflector.inflect_like("walk", inflector.FORM_PAST, "noun") is None
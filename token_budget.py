@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+import threading
+
+# -----------------------------------------------------------------
+# Prompt Token Budgeting
+# -----------------------------------------------------------------
+# Prompts are measured with tiktoken when it is installed and its encoding
+# files can be loaded. tiktoken downloads encodings on first use into its
+# own cache (TIKTOKEN_CACHE_DIR, default: a temp directory). The encoding
+# files are not part of the repository: to run offline, point
+# TIKTOKEN_CACHE_DIR at a directory holding them under tiktoken's cache names
+#   o200k_base:  fb374d419588a4632f3f557e76b4b70aebbca790
+#   cl100k_base: 9b5ad71b2ce5302211f9c61530b329a4922fc6a4
+# (a local tiktoken_cache/ is git-ignored for this). Without tiktoken or its
+# files, tokens are estimated as characters / 4.
+BUDGET_SETTINGS = {
+    # Input budget for one stage prompt (system + user message)
+    "max_input_tokens": 8000,
+    # Completion budget, matches llm_service max_tokens
+    "max_output_tokens": 4096,
+    # Share of max_output_tokens a chunk may plan to use (stems vary in length)
+    "output_headroom": 0.75,
+    "max_chunk_size": 12,
+    # Serialization of data blocks in prompts: "table" (CSV for flat rows,
+    # compact JSON otherwise), "compact" (JSON without whitespace) or
+    # "pretty" (indented JSON, the old format)
+    "serialization": "table"
+}
+
+# Typical completion tokens per item for each stage (the largest sets the
+# chunk's output budget; later-stage prompts grow with earlier outputs)
+OUTPUT_TOKENS_PER_ITEM = {1: 150, 2: 120, 3: 90}
+
+# Fixed chat-format overhead per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# encoding name -> tiktoken encoding, or None if it could not be loaded
+_encodings = {}
+_encodings_lock = threading.Lock()
+_fallback_logged = False
+
+
+def configure_budget(max_input_tokens=None, max_output_tokens=None, max_chunk_size=None, serialization=None):
+    """
+    Updates the token budget used for chunk packing and prompt serialization.
+    """
+    if max_input_tokens is not None:
+        BUDGET_SETTINGS["max_input_tokens"] = max_input_tokens
+    if max_output_tokens is not None:
+        BUDGET_SETTINGS["max_output_tokens"] = max_output_tokens
+    if max_chunk_size is not None:
+        BUDGET_SETTINGS["max_chunk_size"] = max_chunk_size
+    if serialization is not None:
+        BUDGET_SETTINGS["serialization"] = serialization
+
+
+def _get_encoding(model):
+    """
+    tiktoken encoding for a model, or None when unavailable. A failed load
+    (e.g. offline without the encoding files) is remembered so it is not
+    retried, and reported once per process.
+    """
+    global _fallback_logged
+    if tiktoken is None:
+        return None
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = "o200k_base"
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                _encodings[name] = None
+                if not _fallback_logged:
+                    _fallback_logged = True
+                    print(f"TOKENIZER UNAVAILABLE ({name}), estimating tokens as characters / 4: {e}")
+        return _encodings[name]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Number of tokens in text (estimated when no tokenizer is available).
+    """
+    text = text or ""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_messages(messages, model="gpt-4o"):
+    """
+    Prompt tokens for a (system_msg, user_msg) pair.
+    """
+    return sum(count_tokens(m, model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _is_flat(rows):
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        return False
+    return all(value is None or isinstance(value, (str, int, float, bool))
+               for row in rows for value in row.values())
+
+
+def serialize(data):
+    """
+    Serializes a data block for a prompt using the configured format.
+    Lists of flat records become CSV with a header row in "table" mode.
+    """
+    mode = BUDGET_SETTINGS["serialization"]
+    if mode == "pretty":
+        return json.dumps(data, indent=2, ensure_ascii=False)
+    if mode == "table" and isinstance(data, list) and _is_flat(data):
+        columns = []
+        for row in data:
+            columns.extend(key for key in row if key not in columns)
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=columns, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(data)
+        return out.getvalue().rstrip("\n")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def output_budget_per_chunk():
+    return int(BUDGET_SETTINGS["max_output_tokens"] * BUDGET_SETTINGS["output_headroom"])
+
+
+def pack_items(items, measure_input, output_tokens_per_item=None, max_chunk_size=None):
+    """
+    Splits items into consecutive chunks that fit the token budget:
+    - measure_input(chunk) -> prompt tokens must stay within max_input_tokens
+    - len(chunk) * output_tokens_per_item must stay within the output budget
+    A single item that is over budget on its own still gets its own chunk.
+    """
+    if output_tokens_per_item is None:
+        output_tokens_per_item = max(OUTPUT_TOKENS_PER_ITEM.values())
+    if max_chunk_size is None:
+        max_chunk_size = BUDGET_SETTINGS["max_chunk_size"]
+    limit = max(1, min(max_chunk_size, output_budget_per_chunk() // max(1, output_tokens_per_item)))
+
+    chunks = []
+    start = 0
+    while start < len(items):
+        # Largest size within the output limit whose prompt still fits
+        low, high = 1, min(limit, len(items) - start)
+        while low < high:
+            size = (low + high + 1) // 2
+            if measure_input(items[start:start + size]) <= BUDGET_SETTINGS["max_input_tokens"]:
+                low = size
+            else:
+                high = size - 1
+        chunks.append(items[start:start + low])
+        start += low
+    return chunks